@@ -0,0 +1,42 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from google import genai
+from google.adk.models import Gemini
+
+from context import api_key_context
+
+_CLIENT_CACHE_SIZE = 256
+_clients: "OrderedDict[str, genai.Client]" = OrderedDict()
+_clients_lock = threading.Lock()
+
+def get_genai_client(api_key: str) -> genai.Client:
+    """Returns a process-wide genai.Client for the key (LRU, keyed by key hash)."""
+    cache_key = hashlib.sha256(api_key.encode()).hexdigest()
+    with _clients_lock:
+        client = _clients.get(cache_key)
+        if client is None:
+            client = genai.Client(api_key=api_key)
+            _clients[cache_key] = client
+            while len(_clients) > _CLIENT_CACHE_SIZE:
+                _clients.popitem(last=False)
+        else:
+            _clients.move_to_end(cache_key)
+        return client
+
+class RequestScopedGemini(Gemini):
+    """
+    Gemini model whose API client is resolved per request from `api_key_context`.
+
+    Lets one agent graph be shared by concurrent users without writing each user's
+    key into os.environ. Falls back to ADK's default (env-configured) client when no
+    key is bound.
+    """
+
+    @property
+    def api_client(self) -> genai.Client:
+        api_key = api_key_context.get()
+        if not api_key:
+            return super().api_client
+        return get_genai_client(api_key)
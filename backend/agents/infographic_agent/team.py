@@ -1,9 +1,10 @@
-from .agent import create_infographic_agent
+from .agent import get_infographic_agent
 from config.settings import DEFAULT_TEXT_MODEL
 
-def create_infographic_team(api_key: str = None, model: str = DEFAULT_TEXT_MODEL):
+def create_infographic_team(model: str = DEFAULT_TEXT_MODEL):
     """
-    Creates the infographic agent team.
-    Delegates to the robust InfographicDirector defined in agent.py.
+    Returns the infographic agent team for `model`.
+    Delegates to the robust InfographicDirector defined in agent.py; the graph is
+    cached per model, so bind the caller's API key with `context.api_key_context`.
     """
-    return create_infographic_agent(api_key=api_key, model=model)
\ No newline at end of file
+    return get_infographic_agent(model=model)
@@ -0,0 +1,89 @@
+"""
+A2UI frame encoding micro-benchmark.
+
+Compares the previous per-emit encoding (nested dict literal + stdlib `json.dumps`)
+with `services.a2ui.A2UIFrames` on the frames each phase actually emits:
+  - script:   per-slide data-model `add` + status update
+  - graphics: per-slide `image_url` patch + card components
+Reports frames/sec and bytes/frame for each, plus the JSON backend in use.
+
+Usage (from backend/):
+    python benchmarks/a2ui_bench.py [--slides 40] [--rounds 500]
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from services.a2ui import A2UIFrames, JSON_BACKEND  # noqa: E402
+
+SURFACE = "infographic_workspace"
+SIGNED_URL = "https://storage.googleapis.com/bucket/users/u/projects/p/slide.png?X-Goog-Algorithm=GOOG4-RSA-SHA256&X-Goog-Signature=" + "a" * 512
+IMAGE_PATH = "users/u/projects/p/slide.png"
+
+def make_slides(n: int) -> list[dict]:
+    return [{
+        "id": f"s{i}",
+        "title": f"Slide {i + 1}: Quarterly growth by région",
+        "description": "Revenue grew 12% quarter over quarter, driven by EMEA and new enterprise accounts. " * 2,
+        "image_prompt": "A professional infographic illustration, clean vector, data visualization, minimalist. " * 3,
+    } for i in range(n)]
+
+# --- Previous encoding (inline dicts + json.dumps) ---
+def legacy_script(slides):
+    for idx, slide in enumerate(slides):
+        yield json.dumps({"updateDataModel": {"surfaceId": SURFACE, "path": f"/script/slides/{idx}", "op": "add", "value": slide}}) + "\n"
+        yield json.dumps({"updateComponents": {"surfaceId": SURFACE, "components": [{"id": "status", "component": "Text", "text": f"🧠 Planned slide {idx + 1}..."}]}}) + "\n"
+
+def legacy_graphics(slides):
+    for idx, slide in enumerate(slides):
+        sid, msg = slide["id"], f"🎨 Generated {idx + 1}/{len(slides)}"
+        yield json.dumps({"updateDataModel": {"surfaceId": SURFACE, "path": f"/script/slides/{idx}", "op": "replace", "value": {**slide, "image_url": SIGNED_URL, "image_path": IMAGE_PATH}}}) + "\n"
+        yield json.dumps({"updateComponents": {"surfaceId": SURFACE, "components": [{"id": f"card_{sid}", "component": "Column", "children": [f"t_{sid}", f"i_{sid}"], "status": "success"}, {"id": f"t_{sid}", "component": "Text", "text": slide["title"]}, {"id": f"i_{sid}", "component": "Image", "src": SIGNED_URL}, {"id": "status", "component": "Text", "text": msg}]}}) + "\n"
+
+# --- Frame builder ---
+def builder_script(slides, frames=A2UIFrames(SURFACE)):
+    for idx, slide in enumerate(slides):
+        yield frames.data_model(f"/script/slides/{idx}", "add", slide).line
+        yield frames.status(f"🧠 Planned slide {idx + 1}...").line
+
+def builder_graphics(slides, frames=A2UIFrames(SURFACE)):
+    for idx, slide in enumerate(slides):
+        sid, msg = slide["id"], f"🎨 Generated {idx + 1}/{len(slides)}"
+        yield frames.data_model(f"/script/slides/{idx}", "replace", {**slide, "image_url": SIGNED_URL, "image_path": IMAGE_PATH}).line
+        yield frames.slide_card(sid, slide["title"], SIGNED_URL, msg).line
+
+def measure(producer, slides, rounds: int) -> tuple[float, float]:
+    count, size = 0, 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for line in producer(slides):
+            count += 1
+            size += len(line) if isinstance(line, bytes) else len(line.encode("utf-8"))
+    elapsed = time.perf_counter() - start
+    return count / elapsed, size / count
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--slides", type=int, default=40)
+    parser.add_argument("--rounds", type=int, default=500)
+    args = parser.parse_args()
+
+    slides = make_slides(args.slides)
+    # Both encoders must produce the same frames
+    for legacy, builder in ((legacy_script, builder_script), (legacy_graphics, builder_graphics)):
+        assert [json.loads(a) for a in legacy(slides)] == [json.loads(b) for b in builder(slides)]
+
+    print(f"JSON backend: {JSON_BACKEND} | {args.slides} slides x {args.rounds} rounds\n")
+    print(f"{'phase':<10} {'encoder':<10} {'frames/s':>12} {'bytes/frame':>12}")
+    for phase, legacy, builder in (("script", legacy_script, builder_script), ("graphics", legacy_graphics, builder_graphics)):
+        for name, producer in (("legacy", legacy), ("builder", builder)):
+            rate, avg = measure(producer, slides, args.rounds)
+            print(f"{phase:<10} {name:<10} {rate:>12,.0f} {avg:>12.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+"""
+Offline load test for the backend.
+
+Boots the real FastAPI `app` (main.py) under uvicorn on a local port, with every
+Google dependency replaced by a local stand-in:
+  - Gemini:     a fake `google.genai.Client` (text streamed in chunks, PNG images)
+                with configurable latency, 429 and error injection
+  - GCS:        the artifact service and export workers use a `LocalBucket` directory
+  - Firestore:  disabled, so sessions run on ADK's `InMemorySessionService`
+  - Auth:       a stub token verifier (the bearer token is the uid) and URL signer
+
+N simulated users then run the script phase, graphics phase, `/agent/export` and
+`/agent/refresh_assets` concurrently. Reported: time-to-first-frame, per-slide
+completion latency (from request start), p50/p99 end-to-end latency per step and
+peak RSS of the server process and its export workers.
+
+Usage (from backend/):
+    python benchmarks/load_test.py --users 20 --slides 8 [--image-latency 2 --rate-limit-rate 0.1]
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+os.chdir(BACKEND_DIR)
+
+# --- Fake Gemini ---
+class FakeRateLimitError(Exception):
+    code = 429
+
+    def __init__(self):
+        super().__init__("429 RESOURCE_EXHAUSTED (injected)")
+
+class FakeGemini:
+    """Shared knobs for every fake client the app constructs."""
+    slides = 8
+    first_token_latency = 1.0
+    chunk_latency = 0.02
+    chunk_size = 64
+    image_latency = 2.0
+    image_jitter = 0.5
+    rate_limit_rate = 0.0
+    error_rate = 0.0
+    png = b""
+
+    @classmethod
+    def plan_text(cls, query: str) -> str:
+        slides = [{
+            "id": f"slide_{i + 1}",
+            "title": f"{query[:40]} — part {i + 1}",
+            "description": "Key figures and trends, summarised for a single infographic slide. " * 2,
+            "image_prompt": f"Clean vector infographic about {query[:40]}, section {i + 1}, data visualization, minimalist",
+        } for i in range(cls.slides)]
+        return "```json\n" + json.dumps({"global_settings": {"aspect_ratio": "16:9"}, "slides": slides}, indent=2) + "\n```"
+
+    @classmethod
+    def maybe_fail(cls):
+        roll = random.random()
+        if roll < cls.rate_limit_rate:
+            raise FakeRateLimitError()
+        if roll < cls.rate_limit_rate + cls.error_rate:
+            raise RuntimeError("500 INTERNAL (injected)")
+
+def _text_response(text: str, final: bool):
+    from google.genai import types
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(
+            content=types.Content(role="model", parts=[types.Part(text=text)]),
+            finish_reason=types.FinishReason.STOP if final else None,
+        )],
+        usage_metadata=types.GenerateContentResponseUsageMetadata(prompt_token_count=500, candidates_token_count=len(text) // 4) if final else None,
+    )
+
+def _image_response():
+    from google.genai import types
+    return types.GenerateContentResponse(candidates=[types.Candidate(
+        content=types.Content(role="model", parts=[types.Part(inline_data=types.Blob(mime_type="image/png", data=FakeGemini.png))]),
+        finish_reason=types.FinishReason.STOP,
+    )])
+
+def _prompt_text(contents) -> str:
+    try:
+        last = contents[-1] if isinstance(contents, list) else contents
+        parts = getattr(last, "parts", None) or []
+        return next((p.text for p in parts if getattr(p, "text", None)), "") or str(last)
+    except Exception:
+        return "benchmark"
+
+def _is_image_model(model: str) -> bool:
+    return "image" in (model or "")
+
+class _FakeAsyncModels:
+    async def generate_content(self, *, model, contents, config=None, **kwargs):
+        if _is_image_model(model):
+            await asyncio.sleep(max(0.0, random.gauss(FakeGemini.image_latency, FakeGemini.image_jitter)))
+            FakeGemini.maybe_fail()
+            return _image_response()
+        await asyncio.sleep(FakeGemini.first_token_latency)
+        FakeGemini.maybe_fail()
+        return _text_response(FakeGemini.plan_text(_prompt_text(contents)), final=True)
+
+    async def generate_content_stream(self, *, model, contents, config=None, **kwargs):
+        text = FakeGemini.plan_text(_prompt_text(contents))
+
+        async def stream():
+            await asyncio.sleep(FakeGemini.first_token_latency)
+            FakeGemini.maybe_fail()
+            for start in range(0, len(text), FakeGemini.chunk_size):
+                await asyncio.sleep(FakeGemini.chunk_latency)
+                yield _text_response(text[start:start + FakeGemini.chunk_size], final=False)
+            yield _text_response("", final=True)
+
+        return stream()
+
+class _FakeModels:
+    def generate_content(self, *, model, contents, config=None, **kwargs):
+        return asyncio.run(_FakeAsyncModels().generate_content(model=model, contents=contents, config=config))
+
+class _FakeAio:
+    def __init__(self):
+        self.models = _FakeAsyncModels()
+
+class FakeGenaiClient:
+    vertexai = False
+
+    def __init__(self, *args, **kwargs):
+        self.models = _FakeModels()
+        self.aio = _FakeAio()
+
+# --- Fake storage / auth ---
+class FakeStorageClient:
+    def __init__(self, bucket):
+        self._bucket = bucket
+
+    def bucket(self, name):
+        return self._bucket
+
+class FakeArtifactService:
+    """Stands in for GcsArtifactService: only `.bucket`, `.bucket_name` and `.storage_client` are used."""
+    root: Path = None
+
+    def __init__(self, bucket_name: str, **kwargs):
+        from services.local_bucket import LocalBucket
+        self.bucket_name = bucket_name
+        self.bucket = LocalBucket(self.root)
+        self.storage_client = FakeStorageClient(self.bucket)
+
+class StubTokenVerifier:
+    """Accepts any bearer token; the token itself is the uid."""
+    def start(self): pass
+    async def stop(self): pass
+    async def verify(self, token: str) -> dict:
+        return {"uid": token, "sub": token, "exp": time.time() + 3600}
+
+class FakeUrlSigner:
+    def __init__(self, bucket=None):
+        self.bucket = bucket
+    def start(self): pass
+    async def stop(self): pass
+    def sign_sync(self, path: str) -> str:
+        return f"https://loadtest.invalid/{path}?X-Goog-Signature=fake"
+    async def sign(self, path: str) -> str:
+        return self.sign_sync(path)
+    async def sign_many(self, paths: list[str]) -> dict[str, str]:
+        return {p: self.sign_sync(p) for p in paths if p}
+
+# --- Boot ---
+def boot_app(workdir: Path, verbose: bool):
+    """Installs the stand-ins, imports main.py and returns its FastAPI app."""
+    bucket_dir = workdir / "bucket"
+    os.environ.update({
+        "GOOGLE_CLOUD_PROJECT": "loadtest",
+        "GCS_BUCKET_NAME": "loadtest-bucket",
+        "EXPORT_LOCAL_BUCKET_DIR": str(bucket_dir),
+        "TRAFFIC_LOG_MODE": os.environ.get("TRAFFIC_LOG_MODE", "off"),
+    })
+    os.environ.pop("FIREBASE_AUTH_EMULATOR_HOST", None)
+    if not os.environ.get("ENCRYPTION_KEY"):
+        from cryptography.fernet import Fernet
+        os.environ["ENCRYPTION_KEY"] = Fernet.generate_key().decode()
+
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new("RGB", (1376, 768), (40, 90, 160)).save(buf, format="PNG")
+    FakeGemini.png = buf.getvalue()
+
+    import google.genai
+    google.genai.Client = FakeGenaiClient
+
+    import google.adk.artifacts
+    FakeArtifactService.root = bucket_dir
+    google.adk.artifacts.GcsArtifactService = FakeArtifactService
+
+    # No Firebase app -> db is None -> InMemorySessionService, no Firestore I/O
+    import firebase_admin
+    firebase_admin.initialize_app = lambda *args, **kwargs: None
+
+    import config.settings
+    config.settings.validate_bucket = lambda: "loadtest-bucket"
+
+    import main
+    main.token_verifier = StubTokenVerifier()
+    main.url_signer = FakeUrlSigner(main.artifact_service.bucket)
+    if not verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    return main.app
+
+# --- Client side ---
+def pct(values: list[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))]
+
+class Metrics:
+    def __init__(self):
+        self.ttff: dict[str, list[float]] = {"script": [], "graphics": []}
+        self.slide_latency: dict[str, list[float]] = {"script": [], "graphics": []}
+        self.e2e: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+    def record(self, step: str, seconds: float):
+        self.e2e.setdefault(step, []).append(seconds)
+
+    def fail(self, step: str):
+        self.errors[step] = self.errors.get(step, 0) + 1
+
+async def stream_phase(client, uid: str, payload: dict, phase: str, metrics: Metrics):
+    headers = {"Authorization": f"Bearer {uid}", "x-goog-api-key": "loadtest-key"}
+    start = time.perf_counter()
+    first = None
+    async with client.stream("POST", "/agent/stream", json=payload, headers=headers) as response:
+        if response.status_code != 200:
+            metrics.fail(phase)
+            return
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            now = time.perf_counter() - start
+            if first is None:
+                first = now
+                metrics.ttff[phase].append(now)
+            frame = json.loads(line)
+            update = frame.get("updateDataModel") or {}
+            path = update.get("path") or ""
+            if phase == "script" and update.get("op") == "add" and path.startswith("/script/slides/"):
+                metrics.slide_latency["script"].append(now)
+            elif phase == "graphics" and update.get("op") == "replace" and path.startswith("/script/slides/"):
+                metrics.slide_latency["graphics"].append(now)
+    metrics.record(phase, time.perf_counter() - start)
+
+async def run_user(client, index: int, phases: list[str], metrics: Metrics):
+    uid = f"loadtest-user-{index}"
+    project_id = f"project-{index}"
+    headers = {"Authorization": f"Bearer {uid}"}
+    script = None
+
+    if "script" in phases:
+        await stream_phase(client, uid, {"phase": "script", "query": f"Renewable energy trends #{index}", "project_id": project_id}, "script", metrics)
+    if "graphics" in phases:
+        await stream_phase(client, uid, {"phase": "graphics", "project_id": project_id}, "graphics", metrics)
+
+    if "export" in phases or "refresh" in phases:
+        # The graphics phase kept its result in the session; rebuild it client-side like the frontend would
+        slides = []
+        for path in sorted((FakeArtifactService.root / "users" / uid / "projects" / project_id / "assets").glob("*.png")):
+            rel = path.relative_to(FakeArtifactService.root).as_posix()
+            slides.append({"id": path.stem, "title": path.stem, "image_path": rel, "image_url": f"https://loadtest.invalid/{rel}"})
+        script = {"slides": slides}
+
+    for step, route, body in (
+        ("export", "/agent/export", {"script": script, "project_id": project_id, "format_type": "pdf"}),
+        ("refresh", "/agent/refresh_assets", {"script": script, "project_id": project_id}),
+    ):
+        if step not in phases:
+            continue
+        start = time.perf_counter()
+        response = await client.post(route, json=body, headers=headers)
+        if response.status_code == 200:
+            metrics.record(step, time.perf_counter() - start)
+        else:
+            metrics.fail(step)
+
+def report(metrics: Metrics, users: int, wall: float):
+    ms = lambda v: f"{v * 1000:8.0f}"
+    print(f"\n{users} users, wall time {wall:.1f}s\n")
+    print(f"{'metric':<28} {'n':>5} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for phase in ("script", "graphics"):
+        for label, values in ((f"{phase} time-to-first-frame", metrics.ttff[phase]), (f"{phase} per-slide latency", metrics.slide_latency[phase])):
+            if values:
+                print(f"{label:<28} {len(values):>5} {ms(pct(values, 50))} {ms(pct(values, 99))} {ms(max(values))}")
+    for step, values in metrics.e2e.items():
+        print(f"{step + ' end-to-end':<28} {len(values):>5} {ms(pct(values, 50))} {ms(pct(values, 99))} {ms(max(values))}")
+    if metrics.errors:
+        print(f"\nfailed requests: {metrics.errors}")
+    # ru_maxrss is KiB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    print(f"\npeak RSS: server {own:.0f} MiB | largest export worker {children:.0f} MiB")
+
+async def run(args):
+    import httpx
+    import uvicorn
+
+    workdir = Path(tempfile.mkdtemp(prefix="infographic-loadtest-"))
+    app = boot_app(workdir, args.verbose)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning", lifespan="on"))
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+
+    metrics = Metrics()
+    phases = args.phases.split(",")
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=600, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(run_user(client, i, phases, metrics) for i in range(args.users)))
+        wall = time.perf_counter() - start
+
+    server.should_exit = True
+    await serve_task
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    report(metrics, args.users, wall)
+    if args.json:
+        Path(args.json).write_text(json.dumps({
+            "users": args.users, "wall": wall, "ttff": metrics.ttff, "slide_latency": metrics.slide_latency,
+            "e2e": metrics.e2e, "errors": metrics.errors,
+            "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }, indent=2))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10, help="concurrent simulated users")
+    parser.add_argument("--slides", type=int, default=8, help="slides per generated plan")
+    parser.add_argument("--phases", default="script,graphics,export,refresh")
+    parser.add_argument("--first-token-latency", type=float, default=1.0, help="fake text model latency to first chunk (s)")
+    parser.add_argument("--chunk-latency", type=float, default=0.02, help="delay between streamed text chunks (s)")
+    parser.add_argument("--image-latency", type=float, default=2.0, help="mean fake image generation latency (s)")
+    parser.add_argument("--image-jitter", type=float, default=0.5)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of model calls failing with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of model calls failing with 500")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--json", help="also write raw results to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's INFO logging")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary bucket directory")
+    args = parser.parse_args()
+
+    FakeGemini.slides = args.slides
+    FakeGemini.first_token_latency = args.first_token_latency
+    FakeGemini.chunk_latency = args.chunk_latency
+    FakeGemini.image_latency = args.image_latency
+    FakeGemini.image_jitter = args.image_jitter
+    FakeGemini.rate_limit_rate = args.rate_limit_rate
+    FakeGemini.error_rate = args.error_rate
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+PDF export benchmark.
+
+Renders a synthetic deck (noisy 2K PNGs, like the image model's output) with every
+PDF quality profile and reports output size and render time per profile and layout.
+No network or bucket access: images are handed to `ExportTool.render_pdf` directly.
+
+Usage (from backend/):
+    python benchmarks/pdf_bench.py [--slides 10] [--repeat 3]
+"""
+import argparse
+import io
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from tools.export_tool import ExportTool, PDF_QUALITY_PROFILES  # noqa: E402
+
+def synthetic_slide(seed: int, size=(2752, 1536)) -> bytes:
+    """A 16:9 '2K' PNG with gradients, shapes and noise so codecs have real work to do."""
+    rng = random.Random(seed)
+    img = Image.linear_gradient("L").resize(size).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x0, y0 = rng.randrange(size[0]), rng.randrange(size[1])
+        x1, y1 = x0 + rng.randrange(50, 600), y0 + rng.randrange(50, 400)
+        draw.rectangle([x0, y0, x1, y1], fill=tuple(rng.randrange(256) for _ in range(3)))
+    noise = Image.effect_noise(size, 24).convert("RGB")
+    img = Image.blend(img, noise, 0.15)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--slides", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    images = [synthetic_slide(i) for i in range(args.slides)]
+    slides = [{"title": f"Slide {i+1}", "description": "Synthetic benchmark slide."} for i in range(args.slides)]
+    source_mb = sum(len(b) for b in images) / 1e6
+    print(f"{args.slides} slides, {source_mb:.1f} MB of source PNGs\n")
+
+    tool = ExportTool()
+    print(f"{'profile':<10} {'layout':<12} {'size MB':>9} {'median s':>9} {'min s':>7}")
+    for layout in ("pdf", "pdf_handout"):
+        for profile in PDF_QUALITY_PROFILES:
+            timings, size = [], 0
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                data = tool.render_pdf(slides, format_type=layout, quality=profile, images=images)
+                timings.append(time.perf_counter() - start)
+                size = len(data or b"")
+            print(f"{profile:<10} {layout:<12} {size / 1e6:>9.2f} {statistics.median(timings):>9.2f} {min(timings):>7.2f}")
+
+if __name__ == "__main__":
+    main()
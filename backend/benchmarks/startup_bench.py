@@ -0,0 +1,107 @@
+"""
+Cold-start benchmark for the backend.
+
+Reports, for every top-level module imported by main.py:
+  - standalone: cost of importing it alone in a fresh interpreter
+  - in-order:   incremental import + init cost when imported in main.py's order
+                (what a Cloud Run cold start actually pays for it)
+and finally the total cost of `import main` (app + service construction).
+
+Usage (from backend/):
+    python benchmarks/startup_bench.py [--repeat 3]
+"""
+import argparse
+import ast
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+def top_level_modules(main_path: Path) -> list[str]:
+    """Modules imported at module level by main.py (including inside top-level try blocks)."""
+    tree = ast.parse(main_path.read_text())
+    modules = []
+
+    def visit(nodes):
+        for node in nodes:
+            if isinstance(node, ast.Import):
+                modules.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                modules.append(node.module)
+            elif isinstance(node, ast.Try):
+                visit(node.body)
+
+    visit(tree.body)
+    return list(dict.fromkeys(modules))
+
+_IN_ORDER = """
+import importlib, json, sys, time
+results = {}
+for name in json.loads(sys.argv[1]):
+    t = time.perf_counter()
+    try:
+        importlib.import_module(name)
+        results[name] = time.perf_counter() - t
+    except Exception as e:
+        results[name] = repr(e)
+print(json.dumps(results))
+"""
+
+_STANDALONE = """
+import importlib, sys, time
+t = time.perf_counter()
+try:
+    importlib.import_module(sys.argv[1])
+    print(time.perf_counter() - t)
+except Exception as e:
+    print(repr(e))
+"""
+
+def _run(code: str, *args: str) -> str:
+    proc = subprocess.run([sys.executable, "-c", code, *args], cwd=BACKEND_DIR, capture_output=True, text=True)
+    return proc.stdout.strip().splitlines()[-1] if proc.stdout.strip() else proc.stderr.strip().splitlines()[-1]
+
+def _median(samples):
+    numbers = [s for s in samples if isinstance(s, float)]
+    return statistics.median(numbers) if numbers else samples[-1]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreters per measurement (median is reported)")
+    args = parser.parse_args()
+
+    modules = top_level_modules(BACKEND_DIR / "main.py")
+
+    in_order_runs = [json.loads(_run(_IN_ORDER, json.dumps(modules))) for _ in range(args.repeat)]
+    in_order = {m: _median([run[m] for run in in_order_runs]) for m in modules}
+
+    standalone = {}
+    for m in modules:
+        samples = []
+        for _ in range(args.repeat):
+            out = _run(_STANDALONE, m)
+            try: samples.append(float(out))
+            except ValueError: samples.append(out)
+        standalone[m] = _median(samples)
+
+    print(f"{'module':<45} {'standalone ms':>14} {'in-order ms':>12}")
+    print("-" * 73)
+    for m in sorted(modules, key=lambda m: -(in_order[m] if isinstance(in_order[m], float) else 0)):
+        fmt = lambda v: f"{v * 1000:>8.1f}" if isinstance(v, float) else f"  ERR {v[:30]}"
+        print(f"{m:<45} {fmt(standalone[m]):>14} {fmt(in_order[m]):>12}")
+
+    total = _median([_to_float(_run(_STANDALONE, "main")) for _ in range(args.repeat)])
+    print("-" * 73)
+    print(f"{'import main (total, incl. app init)':<45} {'':>14} {(total * 1000 if isinstance(total, float) else float('nan')):>12.1f}")
+    if not isinstance(total, float):
+        print(f"main failed to import: {total}")
+
+def _to_float(out: str):
+    try: return float(out)
+    except ValueError: return out
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,40 @@ logger = logging.getLogger(__name__)
 # --- Models (Restored User Specification) ---
 DEFAULT_TEXT_MODEL = "gemini-3-pro-preview" 
 DEFAULT_IMAGE_MODEL = "gemini-3-pro-image-preview"
+# Models the UI offers; anything else is reported as "other" in metrics labels
+KNOWN_MODELS = frozenset({
+    DEFAULT_TEXT_MODEL, DEFAULT_IMAGE_MODEL,
+    "gemini-3-flash-preview", "gemini-2.5-pro", "gemini-2.5-flash", "gemini-2.5-flash-preview-09-2025",
+    "gemini-2.5-flash-image",
+})
+# /metrics is served only to requests bearing this token (unset = endpoint disabled)
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# --- Image Generation Concurrency ---
+# Starting number of in-flight image generations per graphics run; the limiter
+# grows towards the max while latency stays under target and halves on 429s.
+IMAGE_GEN_CONCURRENCY = int(os.environ.get("IMAGE_GEN_CONCURRENCY", "4"))
+IMAGE_GEN_MAX_CONCURRENCY = int(os.environ.get("IMAGE_GEN_MAX_CONCURRENCY", "16"))
+IMAGE_GEN_LATENCY_TARGET = float(os.environ.get("IMAGE_GEN_LATENCY_TARGET", "45"))
+
+# --- Exports ---
+# PDF image profile: "screen" (150 DPI JPEG), "print" (300 DPI JPEG), "lossless" (300 DPI PNG), "original"
+DEFAULT_PDF_QUALITY = os.environ.get("PDF_QUALITY", "screen")
+# Background export jobs: rendering processes, max queued/running jobs per instance
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", "2"))
+EXPORT_MAX_PENDING = int(os.environ.get("EXPORT_MAX_PENDING", "32"))
+# When set, export workers write artifacts into this directory instead of GCS (local testing)
+EXPORT_LOCAL_BUCKET_DIR = os.environ.get("EXPORT_LOCAL_BUCKET_DIR")
+# Background generation jobs: max running jobs per instance
+GENERATION_MAX_PENDING = int(os.environ.get("GENERATION_MAX_PENDING", "16"))
+# Largest accepted /agent/upload file
+UPLOAD_MAX_MB = int(os.environ.get("UPLOAD_MAX_MB", "100"))
+
+# --- Traffic Logging ---
+# "full" (truncated frame content), "metadata" (frame type/path/size only) or "off"
+TRAFFIC_LOG_MODE = os.environ.get("TRAFFIC_LOG_MODE", "full")
+TRAFFIC_LOG_SAMPLE_RATE = float(os.environ.get("TRAFFIC_LOG_SAMPLE_RATE", "1.0"))   # fraction of streams logged
+TRAFFIC_LOG_MAX_FIELD_CHARS = int(os.environ.get("TRAFFIC_LOG_MAX_FIELD_CHARS", "256"))
 
 # --- Project & Bucket Logic ---
 def get_project_id():
@@ -17,13 +51,34 @@ def get_project_id():
         logger.warning(f"GOOGLE_CLOUD_PROJECT not found. Using hardcoded fallback: {project_id}")
     return project_id
 
-def get_or_create_bucket(project_id):
+BAD_BUCKET_NAME = "infographic-agent-pro-assets"
+def default_bucket_name(project_id):
+    return f"{project_id}-infographic-assets"
+
+_bucket_name = None
+
+def get_bucket_name():
+    """
+    Resolves the artifact bucket name without any network call.
+    Order: GCS_BUCKET_NAME env (set from a secret on deploy) -> project default.
+    `validate_bucket` (run off the hot path at startup) corrects it if needed.
+    """
+    global _bucket_name
+    if _bucket_name:
+        return _bucket_name
+
     # Sanitize first
-    bad_bucket = "infographic-agent-pro-assets"
-    if os.environ.get("GCS_BUCKET_NAME") == bad_bucket:
-        logger.warning(f"Removing toxic env var GCS_BUCKET_NAME={bad_bucket}")
+    if os.environ.get("GCS_BUCKET_NAME") == BAD_BUCKET_NAME:
+        logger.warning(f"Removing toxic env var GCS_BUCKET_NAME={BAD_BUCKET_NAME}")
         del os.environ["GCS_BUCKET_NAME"]
 
+    _bucket_name = os.environ.get("GCS_BUCKET_NAME") or default_bucket_name(PROJECT_ID)
+    # Set Env Var for compatibility with tools that might read it
+    os.environ["GCS_BUCKET_NAME"] = _bucket_name
+    return _bucket_name
+
+def get_or_create_bucket(project_id):
+    """Slow path: verifies, discovers (list_buckets) or creates the bucket. Never call per request."""
     env_bucket = os.environ.get("GCS_BUCKET_NAME")
     storage_client = storage.Client(project=project_id)
     
@@ -44,7 +99,7 @@ def get_or_create_bucket(project_id):
         logger.warning(f"Discovery failed: {e}")
 
     # Fallback / Creation
-    fallback = f"{project_id}-infographic-assets"
+    fallback = default_bucket_name(project_id)
     try:
         bucket = storage_client.bucket(fallback)
         if not bucket.exists(): bucket.create(location="US")
@@ -53,9 +108,26 @@ def get_or_create_bucket(project_id):
         logger.warning(f"Creation failed for {fallback}: {e}. Returning blindly.")
         return fallback
 
+def validate_bucket():
+    """
+    Startup check (run in a background thread): confirms the lazily resolved bucket,
+    falling back to discovery/creation. Returns the validated bucket name.
+    The result is per instance (Cloud Run disks don't outlive it): a discovered bucket
+    that differs from GCS_BUCKET_NAME should be put into that secret.
+    """
+    global _bucket_name
+    resolved = get_or_create_bucket(PROJECT_ID)
+    if resolved != get_bucket_name():
+        logger.warning(f"Bucket '{_bucket_name}' not usable; switching to '{resolved}'")
+        _bucket_name = resolved
+        os.environ["GCS_BUCKET_NAME"] = resolved
+    return resolved
+
 # Initialize Settings
 PROJECT_ID = get_project_id()
-GCS_BUCKET_NAME = get_or_create_bucket(PROJECT_ID)
 
-# Set Env Var for compatibility with tools that might read it
-os.environ["GCS_BUCKET_NAME"] = GCS_BUCKET_NAME
+def __getattr__(name):
+    # Backwards compatible, lazily resolved `from config.settings import GCS_BUCKET_NAME`
+    if name == "GCS_BUCKET_NAME":
+        return get_bucket_name()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
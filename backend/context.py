@@ -1,4 +1,8 @@
 from contextvars import ContextVar
+from typing import Optional
 
 # Default to the standard model if not specified
 model_context: ContextVar[str] = ContextVar("model_context", default="gemini-2.5-flash")
+
+# Per-request Gemini API key, read by the shared agent graph's model binding
+api_key_context: ContextVar[Optional[str]] = ContextVar("api_key_context", default=None)
@@ -1,24 +1,21 @@
 import os
+import hmac
 import logging
 import json
 import asyncio
 import uuid
-import datetime
-from datetime import timedelta
-from typing import Optional
+from typing import AsyncIterator, Awaitable, Callable
 from pathlib import Path
 
-import google.auth
-from google.auth.transport import requests as google_requests
 from fastapi import FastAPI, Request, Depends, HTTPException
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import JSONResponse
 import firebase_admin
-from firebase_admin import auth as firebase_auth, firestore
-from google.cloud import storage
+from firebase_admin import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
 
 # --- OPENTELEMETRY TRACING ---
 try:
@@ -31,7 +28,12 @@ except ImportError:
     trace = None
 
 # --- CONFIGURATION IMPORT ---
-from config.settings import PROJECT_ID, GCS_BUCKET_NAME, DEFAULT_TEXT_MODEL, DEFAULT_IMAGE_MODEL
+from config.settings import (
+    PROJECT_ID, DEFAULT_TEXT_MODEL, DEFAULT_IMAGE_MODEL, METRICS_TOKEN, get_bucket_name, validate_bucket,
+    IMAGE_GEN_CONCURRENCY, IMAGE_GEN_MAX_CONCURRENCY, IMAGE_GEN_LATENCY_TARGET,
+    DEFAULT_PDF_QUALITY, EXPORT_WORKERS, EXPORT_MAX_PENDING, EXPORT_LOCAL_BUCKET_DIR, GENERATION_MAX_PENDING, UPLOAD_MAX_MB,
+    TRAFFIC_LOG_MODE, TRAFFIC_LOG_SAMPLE_RATE, TRAFFIC_LOG_MAX_FIELD_CHARS
+)
 
 # Configure Tracing
 if trace:
@@ -47,79 +49,109 @@ if trace:
 
 # ADK Core
 from google.adk.runners import Runner
+from google.adk.agents.run_config import RunConfig, StreamingMode
 from google.adk.sessions import InMemorySessionService
+from google.adk.sessions.base_session_service import GetSessionConfig
+from google.adk.events import Event, EventActions
 from google.adk.artifacts import GcsArtifactService
 from google.genai import types
 
 try:
-    from context import model_context
+    from context import model_context, api_key_context
 except ImportError:
     from contextvars import ContextVar
     model_context = ContextVar("model_context", default=DEFAULT_TEXT_MODEL)
+    api_key_context = ContextVar("api_key_context", default=None)
 
 from agents.infographic_agent.team import create_infographic_team
-from tools.image_gen import ImageGenerationTool
+from tools.image_gen import ImageGenerationTool, LimiterRegistry
 from tools.export_tool import ExportTool
 from tools.security_tool import security_service
 from tools.slides_tool import GoogleSlidesTool
 from services.firestore_session import FirestoreSessionService
+from services.image_cache import ImageCache
+from services.script_parser import IncrementalScriptParser
+from services.token_verifier import TokenVerifier
+from services.api_key_cache import ApiKeyCache
+from services.url_signer import UrlSigner
+from services.asset_fetcher import AssetFetcher
+from services.export_jobs import ExportJobManager, ExportQueueFull
+from services.export_cache import ExportCache
+from services.generation_jobs import GenerationJobManager, GenerationQueueFull
+from services.upload_store import UploadStore, UploadTooLarge
+from services.local_bucket import LocalBucket
+from services.traffic_log import TrafficLogger
+from services.a2ui import A2UIFrames, EncodedFrame
+from services.telemetry import observe, render_metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-logger.info(f"🚀 BACKEND STARTING - Project: {PROJECT_ID} | Bucket: {GCS_BUCKET_NAME}")
+logger.info(f"🚀 BACKEND STARTING - Project: {PROJECT_ID} | Bucket: {get_bucket_name()}")
 
 # --- TRAFFIC LOGGER ---
-def log_traffic(direction: str, content: dict):
-    """Logs traffic to STDOUT for Cloud Logging."""
-    entry = {
-        "timestamp": datetime.datetime.now().isoformat(),
-        "tag": "TRAFFIC_DEBUG", # Etichetta per filtrare facilmente i log
-        "direction": direction, # "IN" (Request) or "OUT" (Response Chunk)
-        "content": content
-    }
-    # Su Cloud Run, print() finisce direttamente in Cloud Logging
-    print(json.dumps(entry))
+# Sampled, truncated and written off the request path (TRAFFIC_LOG_MODE=metadata in production)
+traffic_log = TrafficLogger(mode=TRAFFIC_LOG_MODE, sample_rate=TRAFFIC_LOG_SAMPLE_RATE, max_field_chars=TRAFFIC_LOG_MAX_FIELD_CHARS)
 
 # --- UTILS ---
-def extract_first_json_block(text: str) -> Optional[dict]:
-    text = text.strip()
-    start_index = text.find('{')
-    if start_index == -1: return None
-    brace_count = 0
-    in_string = False
-    escape = False
-    for i in range(start_index, len(text)):
-        char = text[i]
-        if char == '"' and not escape: in_string = not in_string
-        if not in_string:
-            if char == '{': brace_count += 1
-            elif char == '}': brace_count -= 1
-            if brace_count == 0:
-                try: return json.loads(text[start_index:i+1])
-                except json.JSONDecodeError: return None
-        if char == '\\' and not escape: escape = True
-        else: escape = False
-    return None
+def enrich_slide_with_prompt(slide: dict) -> dict:
+    if "image_prompt" not in slide or not slide["image_prompt"]:
+        title = slide.get("title", "Infographic")
+        desc = slide.get("description", "")
+        slide["image_prompt"] = f"A professional infographic illustration about '{title}'. Context: {desc}. Style: clean vector, data visualization, minimalist, high resolution."
+        logger.warning(f"🩹 SELF-HEALED: Injected missing image_prompt for slide '{title}'")
+    return slide
 
 def enrich_script_with_prompts(script_data: dict) -> dict:
     if not script_data or "slides" not in script_data: return script_data
     for slide in script_data["slides"]:
-        if "image_prompt" not in slide or not slide["image_prompt"]:
-            title = slide.get("title", "Infographic")
-            desc = slide.get("description", "")
-            slide["image_prompt"] = f"A professional infographic illustration about '{title}'. Context: {desc}. Style: clean vector, data visualization, minimalist, high resolution."
-            logger.warning(f"🩹 SELF-HEALED: Injected missing image_prompt for slide '{title}'")
+        enrich_slide_with_prompt(slide)
     return script_data
 
 # --- SERVICES ---
-artifact_service = GcsArtifactService(bucket_name=GCS_BUCKET_NAME)
+artifact_service = GcsArtifactService(bucket_name=get_bucket_name())
+url_signer = UrlSigner(artifact_service.bucket)
+asset_fetcher = AssetFetcher(bucket=artifact_service.bucket)
 
 try:
     firebase_admin.initialize_app()
 except ValueError: pass
 db = firestore.client() if firebase_admin._apps else None
 session_service = FirestoreSessionService(db) if db else InMemorySessionService()
+image_cache = ImageCache(db)
+upload_store = UploadStore(artifact_service.bucket, db, max_bytes=UPLOAD_MAX_MB * 1024 * 1024)
+firebase_project_id = (firebase_admin.get_app().project_id if firebase_admin._apps else None) or PROJECT_ID
+token_verifier = TokenVerifier(firebase_project_id)
+api_key_cache = ApiKeyCache(ttl_seconds=int(os.environ.get("API_KEY_CACHE_TTL", "300")))
+# Image concurrency is owned by one adaptive limiter per (API key, model), shared by every run
+# on this instance (grows on fast successes, halves on 429s)
+image_limiters = LimiterRegistry(
+    initial=IMAGE_GEN_CONCURRENCY,
+    maximum=IMAGE_GEN_MAX_CONCURRENCY,
+    latency_target=IMAGE_GEN_LATENCY_TARGET
+)
+
+# Export rendering runs in worker processes; EXPORT_LOCAL_BUCKET_DIR swaps GCS for a directory
+local_export_bucket = LocalBucket(EXPORT_LOCAL_BUCKET_DIR) if EXPORT_LOCAL_BUCKET_DIR else None
+
+def export_bucket_spec():
+    if local_export_bucket:
+        return ("local", str(local_export_bucket.root))
+    return ("gcs", artifact_service.bucket_name)
+
+async def sign_export_path(path: str) -> str:
+    if local_export_bucket:
+        return local_export_bucket.blob(path).public_url
+    return await url_signer.sign(path)
+
+export_cache = ExportCache(db)
+export_jobs = ExportJobManager(
+    export_bucket_spec, sign_export_path,
+    max_workers=EXPORT_WORKERS, max_pending=EXPORT_MAX_PENDING, cache=export_cache, db=db
+)
+
+# Generation jobs outlive the request that started them; frames go to a per-job log in Firestore
+generation_jobs = GenerationJobManager(db, max_pending=GENERATION_MAX_PENDING)
 
 app = FastAPI()
 
@@ -127,20 +159,160 @@ app = FastAPI()
 if trace:
     FastAPIInstrumentor.instrument_app(app)
 
+async def validate_artifact_bucket():
+    """Confirms the lazily resolved bucket off the request path and rebinds storage if it changed."""
+    try:
+        name = await asyncio.to_thread(validate_bucket)
+    except Exception as e:
+        logger.warning(f"Bucket validation failed: {e}")
+        return
+    if name != artifact_service.bucket_name:
+        artifact_service.bucket_name = name
+        artifact_service.bucket = artifact_service.storage_client.bucket(name)
+        url_signer.bucket = artifact_service.bucket
+        asset_fetcher.bucket = artifact_service.bucket
+        upload_store.bucket = artifact_service.bucket
+        logger.info(f"🪣 Artifact bucket switched to {name}")
+
+@app.on_event("startup")
+async def start_background_refreshers():
+    # Prefetch Firebase signing certs and signer credentials so the first request doesn't pay for them
+    token_verifier.start()
+    url_signer.start()
+    app.state.bucket_validation = asyncio.create_task(validate_artifact_bucket())
+
+@app.on_event("shutdown")
+async def stop_background_refreshers():
+    await token_verifier.stop()
+    await url_signer.stop()
+    await generation_jobs.shutdown()
+    await export_jobs.shutdown()
+    await asyncio.to_thread(traffic_log.close)
+
 # --- HELPERS ---
+async def save_session_state(session, user_id: str, session_id: str, flush: bool = False):
+    """Write-behind state update on Firestore; ADK-native state-delta event on other session services."""
+    if hasattr(session_service, "update_session_state"):
+        await session_service.update_session_state(app_name="infographic-pro", user_id=user_id, session_id=session_id, state=session.state, session=session, flush=flush)
+    else:
+        await session_service.append_event(session, Event(author="user", actions=EventActions(state_delta=dict(session.state))))
+
+async def load_session(user_id: str, session_id: str):
+    session = None
+    # Only state is read here (the Runner loads its own history), so skip the event log
+    try: session = await session_service.get_session(app_name="infographic-pro", user_id=user_id, session_id=session_id, config=GetSessionConfig(num_recent_events=1))
+    except Exception: pass
+    if not session:
+        session = await session_service.create_session(
+            app_name="infographic-pro", user_id=user_id, session_id=session_id,
+            state={"current_phase": "init", "script": None}
+        )
+    return session
+
+async def flush_session_state(session_id: str):
+    if hasattr(session_service, "flush_session_state"):
+        try: await session_service.flush_session_state(session_id)
+        except Exception as e: logger.warning(f"Session state flush failed: {e}")
+
+def checkpoint_entry(slide: dict) -> dict:
+    return {"image_url": slide.get("image_url"), "image_path": slide.get("image_path"), "image_prompt": slide.get("image_prompt")}
+
+async def checkpoint_slide(project_ref, slide: dict):
+    """Records one finished slide as its own `checkpoints.<id>` entry; the script itself isn't rewritten."""
+    try:
+        await asyncio.to_thread(project_ref.set, {"checkpoints": {slide["id"]: checkpoint_entry(slide)}, "status": "generating"}, merge=True)
+    except Exception as e:
+        logger.warning(f"Checkpoint for slide {slide.get('id')} failed: {e}")
+
+async def recover_checkpointed_images(project_ref, slides: list[dict]) -> bool:
+    """
+    If the project's last graphics run didn't complete, fills in the images it saved on the
+    project doc (script or per-slide checkpoints) for slides whose prompt is unchanged.
+    Returns whether there was such an unfinished run to resume.
+    """
+    try:
+        doc = await asyncio.to_thread(project_ref.get)
+    except Exception as e:
+        logger.warning(f"Checkpoint lookup failed: {e}")
+        return False
+    data = (doc.to_dict() or {}) if doc.exists else {}
+    if data.get("status") != "generating":
+        return False
+    by_id = {s.get("id"): s for s in (data.get("script") or {}).get("slides", []) if s.get("image_path")}
+    # Checkpoints are newer than the script they haven't been folded into yet
+    by_id.update({sid: c for sid, c in (data.get("checkpoints") or {}).items() if c.get("image_path")})
+    for slide in slides:
+        prev = by_id.get(slide.get("id"))
+        if prev and not slide.get("image_path") and prev.get("image_prompt") == slide.get("image_prompt"):
+            slide["image_path"] = prev["image_path"]
+            slide["image_url"] = prev.get("image_url")
+    return True
+
+async def fold_checkpoints(project_ref, script: dict, generated: dict[str, dict], complete: bool):
+    """
+    Folds this run's images into the stored script in one transaction and clears their
+    checkpoints. A slide whose checkpoint is gone or different was changed since (e.g. by
+    /agent/regenerate_slide) and is left as stored.
+    """
+    @firestore.transactional
+    def _fold(transaction):
+        doc = project_ref.get(transaction=transaction)
+        data = (doc.to_dict() or {}) if doc.exists else {}
+        stored = (data.get("script") or {}).get("slides")
+        status = {"status": "completed"} if complete else {}
+        if not stored:
+            transaction.set(project_ref, {"script": script, **status}, merge=True)
+            return
+        checkpoints = data.get("checkpoints") or {}
+        for slide in stored:
+            entry = generated.get(slide.get("id"))
+            if entry and (checkpoints.get(slide["id"]) == entry or not slide.get("image_path")):
+                slide["image_url"], slide["image_path"] = entry["image_url"], entry["image_path"]
+        update = {"script.slides": stored, **status}
+        for sid in generated:
+            update[FieldPath("checkpoints", sid).to_api_repr()] = firestore.DELETE_FIELD
+        transaction.update(project_ref, update)
+
+    try:
+        await asyncio.to_thread(_fold, db.transaction())
+    except Exception as e:
+        logger.warning(f"Saving generated images to the project failed: {e}")
+
+async def patch_project_slide(project_ref, slide: dict):
+    """Replaces one slide (matched by id) in the project doc's `script.slides`, leaving the rest of the doc alone."""
+    @firestore.transactional
+    def _patch(transaction):
+        doc = project_ref.get(transaction=transaction)
+        slides = ((doc.to_dict() or {}).get("script") or {}).get("slides", []) if doc.exists else []
+        for i, current in enumerate(slides):
+            if current.get("id") == slide.get("id"):
+                # Arrays can't be addressed per element, so only the slides field path is rewritten;
+                # a pending graphics checkpoint for this slide is now stale
+                slides[i] = slide
+                transaction.update(project_ref, {
+                    "script.slides": slides,
+                    FieldPath("checkpoints", slide["id"]).to_api_repr(): firestore.DELETE_FIELD,
+                })
+                return
+
+    await asyncio.to_thread(_patch, db.transaction())
+
 async def get_user_id(request: Request):
     auth_header = request.headers.get("Authorization")
     if not auth_header or not auth_header.startswith("Bearer "): raise HTTPException(401)
-    try: return firebase_auth.verify_id_token(auth_header.split("Bearer ")[1])['uid']
+    try: return (await token_verifier.verify(auth_header.split("Bearer ")[1]))['uid']
     except: raise HTTPException(401)
 
 async def get_api_key(request: Request, user_id: str = Depends(get_user_id)) -> str:
     api_key = request.headers.get("x-goog-api-key")
+    if not api_key:
+        api_key = api_key_cache.get(user_id)
     if not api_key and db:
-        doc = db.collection("users").document(user_id).get()
+        doc = await asyncio.to_thread(db.collection("users").document(user_id).get)
         if doc.exists:
             k = doc.to_dict().get("gemini_api_key")
             if k: api_key = security_service.decrypt_data(k)
+        if api_key: api_key_cache.set(user_id, api_key)
     if not api_key: raise HTTPException(401)
     return api_key
 
@@ -161,6 +333,16 @@ STATIC_DIR.mkdir(exist_ok=True)
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 # --- ENDPOINTS ---
+@app.get("/metrics")
+async def metrics(request: Request):
+    # Prometheus scrape target (stage latency histograms, cache / fallback / 429 counters).
+    # The service is public, so scrapers must present METRICS_TOKEN; without one it doesn't exist.
+    presented = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not METRICS_TOKEN or not hmac.compare_digest(presented.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(404)
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 @app.get("/user/projects")
 async def list_projects(user_id: str = Depends(get_user_id)):
     if not db: return []
@@ -174,13 +356,181 @@ async def get_project(project_id: str, user_id: str = Depends(get_user_id)):
     if not doc.exists: raise HTTPException(404)
     return doc.to_dict()
 
+@app.post("/user/api_key")
+async def update_api_key(request: Request, user_id: str = Depends(get_user_id)):
+    """Stores the user's Gemini API key encrypted at rest and drops the cached copy."""
+    if not db: raise HTTPException(500)
+    data = await request.json()
+    api_key = (data.get("api_key") or "").strip()
+    user_ref = db.collection("users").document(user_id)
+    if api_key:
+        await asyncio.to_thread(user_ref.set, {"gemini_api_key": security_service.encrypt_data(api_key)}, merge=True)
+    else:
+        await asyncio.to_thread(user_ref.set, {"gemini_api_key": firestore.DELETE_FIELD}, merge=True)
+    api_key_cache.invalidate(user_id)
+    return {"status": "ok"}
+
+async def graphics_events(session, data: dict, *, user_id: str, project_id: str, session_id: str, api_key: str,
+                          image_model: str, frames: A2UIFrames, emit: Callable[[EncodedFrame], bytes],
+                          should_stop: Callable[[], Awaitable[bool]]) -> AsyncIterator[bytes]:
+    """Graphics phase as NDJSON lines; shared by `/agent/stream` and background generation jobs."""
+    logger.info("🎨 ENTERING GRAPHICS PHASE BLOCK")
+    script = session.state.get("script") or data.get("script", {})
+    slides = script.get("slides", [])
+    
+    if not slides:
+        yield emit(frames.log("Error: No script found. Please run the planning phase first."))
+        return
+
+    project_ref = db.collection("users").document(user_id).collection("projects").document(project_id) if db and project_id else None
+    # "regenerate" forces fresh images instead of serving identical prompts from the cache
+    bypass_cache = bool(data.get("regenerate", False))
+
+    # Images are only replayed when resuming a run that didn't complete; running the phase
+    # again on a finished deck starts over (identical prompts still come from the cache)
+    if bypass_cache:
+        resuming = False
+    elif project_ref:
+        # The project doc is checkpointed per slide; staged session state may not have survived a restart
+        resuming = await recover_checkpointed_images(project_ref, slides)
+    else:
+        resuming = session.state.get("current_phase") == "generating"
+    if not resuming:
+        for slide in slides:
+            slide.pop("image_url", None)
+            slide.pop("image_path", None)
+    session.state["current_phase"] = "generating"
+
+    # Slides finished by the interrupted run are replayed, not regenerated
+    owned_prefix = f"users/{user_id}/"
+    done = [s for s in slides if (s.get("image_path") or "").startswith(owned_prefix)]
+    signed = await url_signer.sign_many([s["image_path"] for s in done])
+    for slide in done:
+        if slide["image_path"] in signed:
+            slide["image_url"] = signed[slide["image_path"]]
+    done_ids = {s.get("id") for s in done if s["image_path"] in signed}
+    pending = [s for s in slides if s.get("id") not in done_ids]
+    if done_ids:
+        logger.info(f"⏩ Resuming graphics: {len(done_ids)} slides already done, {len(pending)} to generate")
+
+    # Full snapshot once on connect; per-slide results below are sent as targeted patches.
+    slide_index = {s.get("id"): i for i, s in enumerate(slides)}
+    total_slides = len(slides)
+    yield emit(frames.snapshot(script, project_id))
+    for slide in slides:
+        if slide.get("id") in done_ids:
+            yield emit(frames.slide_card(slide["id"], slide.get("title", "Slide"), slide["image_url"], f"🎨 Generating {len(done_ids)}/{total_slides}..."))
+    yield emit(frames.status(f"🎨 Starting generation ({len(done_ids)}/{total_slides})..."))
+
+    ar = script.get("global_settings", {}).get("aspect_ratio", "16:9")
+    logo_url = await get_project_logo(user_id, project_id) if db and pending else None
+    
+    # ADK Native: Use artifact_service directly.
+    limiter = image_limiters.get(api_key, image_model)
+    img_tool = ImageGenerationTool(api_key=api_key, artifact_service=artifact_service, limiter=limiter, cache=image_cache, url_signer=url_signer)
+
+    async def process_single_slide(slide):
+        sid = slide.get('id')
+        if not sid: return None
+        try:
+            logger.info(f"🎨 Generating image for slide {sid}...")
+            prompt_text = slide.get('image_prompt')
+            if not prompt_text:
+                prompt_text = f"Infographic about {slide.get('title', 'Data')}, professional style, vector illustration, high resolution"
+
+            # Result is now a dict: {"url": str, "path": str} or {"error": str}
+            result_data = await img_tool.agenerate_and_save(
+                prompt_text, 
+                aspect_ratio=ar, 
+                user_id=user_id, 
+                project_id=project_id, 
+                logo_url=logo_url,
+                model=image_model,
+                bypass_cache=bypass_cache
+            )
+            
+            if "error" in result_data:
+                raise Exception(result_data["error"])
+
+            img_url = result_data["url"]
+            img_path = result_data.get("path")
+            
+            logger.info(f"✅ Slide {sid} done: {img_url}")
+            return {
+                "sid": sid, 
+                "url": img_url, 
+                "path": img_path,
+                "title": slide.get('title', 'Slide')
+            }
+        except Exception as e:
+            logger.error(f"❌ Failed processing slide {sid}: {e}")
+            return {"sid": sid, "url": f"Error: {str(e)}", "title": slide.get('title', 'Slide')}
+
+    tasks = [process_single_slide(slide) for slide in pending]
+    logger.info(f"Queued {len(tasks)} image generation tasks...")
+    
+    success_count = len(done_ids)
+    generated: dict[str, dict] = {}
+    checkpoint_writes: list[asyncio.Task] = []
+    error_count = 0
+    
+    for future in asyncio.as_completed(tasks):
+        if await should_stop(): break
+        result = await future
+        if not result: continue
+        sid = result["sid"]
+        img_url = result["url"]
+        
+        progress_msg = f"🎨 Generating {success_count + error_count + 1}/{total_slides}..."
+        
+        if "http" in img_url:
+            success_count += 1
+            idx = slide_index[sid]
+            slides[idx]["image_url"] = img_url
+            if result.get("path"): slides[idx]["image_path"] = result["path"]
+            
+            # Whole slide, so image_path reaches the client too even if it never sees the closing snapshot
+            yield emit(frames.data_model(f"/script/slides/{idx}", "replace", slides[idx]))
+            yield emit(frames.slide_card(sid, result["title"], img_url, progress_msg))
+
+            # Checkpoint every finished slide so a dropped stream or recycled instance loses nothing.
+            # The write runs in the background so it never holds up the next frame.
+            generated[sid] = checkpoint_entry(slides[idx])
+            session.state["script"] = script
+            await save_session_state(session, user_id, session_id)
+            if project_ref:
+                checkpoint_writes.append(asyncio.create_task(checkpoint_slide(project_ref, slides[idx])))
+        else:
+            error_count += 1
+            yield emit(frames.slide_error(sid, img_url, progress_msg))
+
+    complete = success_count == total_slides
+    session.state["script"] = script
+    session.state["current_phase"] = "completed" if complete else "generating"
+    await save_session_state(session, user_id, session_id, flush=True)
+    if project_ref and (generated or complete):
+        await asyncio.gather(*checkpoint_writes)
+        await fold_checkpoints(project_ref, script, generated, complete)
+    
+    final_msg = "✨ All images ready!"
+    if error_count > 0:
+        if success_count == 0:
+            final_msg = "❌ Generation failed. Please try again."
+        else:
+            final_msg = f"⚠️ Finished with {error_count} errors."
+    
+    # Closing snapshot so late joiners / dropped patches converge on the final script
+    yield emit(frames.snapshot(script, project_id))
+    yield emit(frames.status(final_msg))
+
 @app.post("/agent/stream")
 async def agent_stream(request: Request, user_id: str = Depends(get_user_id), api_key: str = Depends(get_api_key)):
     try:
         data = await request.json()
         
         # [LOGGING] Log Incoming Request
-        log_traffic("IN", {
+        traffic = traffic_log.start_stream(uuid.uuid4().hex[:12])
+        traffic.inbound({
             "phase": data.get("phase"),
             "query": data.get("query"),
             "project_id": data.get("project_id"),
@@ -200,50 +550,72 @@ async def agent_stream(request: Request, user_id: str = Depends(get_user_id), ap
         logger.info(f"📥 AGENT STREAM REQUEST | Phase: {phase} | Models: T={requested_text_model} I={requested_img_model}")
         
         surface_id = "infographic_workspace"
+        frames = A2UIFrames(surface_id)
         session_id = f"{user_id}_{project_id}"
 
         async def event_generator():
-            # Helper per inviare e loggare
-            async def yield_and_log(msg_str):
-                try:
-                    log_traffic("OUT", json.loads(msg_str))
-                except:
-                    pass
-                return msg_str + "\n"
-
-            yield await yield_and_log(json.dumps({"createSurface": {"surfaceId": surface_id, "catalogId": "https://a2ui.dev/specification/0.9/standard_catalog_definition.json"}}))
-
-            session = None
-            try: session = await session_service.get_session(app_name="infographic-pro", user_id=user_id, session_id=session_id)
-            except Exception: pass
-            
-            if not session:
-                session = await session_service.create_session(
-                    app_name="infographic-pro", user_id=user_id, session_id=session_id,
-                    state={"current_phase": "init", "script": None}
-                )
+            try:
+                async for chunk in phase_events():
+                    yield chunk
+            finally:
+                # Write-behind session state must land even if the client disconnects mid-phase
+                await flush_session_state(session_id)
+
+        async def phase_events():
+            # Frames arrive pre-encoded; the traffic log gets the same frame as a dict
+            def emit(encoded: EncodedFrame) -> bytes:
+                traffic.outbound(encoded.frame, len(encoded.line))
+                return encoded.line
+
+            yield emit(frames.create_surface())
+
+            session = await load_session(user_id, session_id)
 
             if phase == "script":
                 logger.info("🎬 Starting SCRIPT phase")
                 session.state["current_phase"] = "planning"
-                await session_service.update_session_state(app_name="infographic-pro", user_id=user_id, session_id=session_id, state=session.state)
+                # Staged only; coalesced with the script_ready update below into a single write
+                await save_session_state(session, user_id, session_id)
 
-                yield await yield_and_log(json.dumps({"updateComponents": {"surfaceId": surface_id, "components": [{"id": "status", "component": "Text", "text": "🧠 Planning content..."}]}}))
+                yield emit(frames.status("🧠 Planning content..."))
                 
-                agent = create_infographic_team(api_key=api_key, model=requested_text_model)
+                # Shared per-model agent graph; the user's key is bound to this request only
+                api_key_context.set(api_key)
+                agent = create_infographic_team(model=requested_text_model)
                 runner = Runner(agent=agent, app_name="infographic-pro", session_service=session_service)
                 user_query = data.get("query", "")
 
-                agent_output = ""
-                async for event in runner.run_async(session_id=session.id, user_id=user_id, new_message=types.Content(role="user", parts=[types.Part(text=user_query)])):
-                    if await request.is_disconnected(): break
-                    if event.content and event.content.parts:
-                        for part in event.content.parts:
-                            if part.text:
-                                agent_output += part.text
-                                yield await yield_and_log(json.dumps({"log": part.text[:100] + "..."}))
-
-                script_data = extract_first_json_block(agent_output)
+                # SSE streaming yields partial text events; slides are parsed and pushed as soon as
+                # each element of the "slides" array closes, instead of after the whole plan.
+                parser = IncrementalScriptParser()
+                saw_partial = False
+                run_config = RunConfig(streaming_mode=StreamingMode.SSE)
+                with observe("runner.turn", phase="script", model=requested_text_model):
+                    async for event in runner.run_async(session_id=session.id, user_id=user_id, new_message=types.Content(role="user", parts=[types.Part(text=user_query)]), run_config=run_config):
+                        if await request.is_disconnected(): break
+                        if event.partial:
+                            saw_partial = True
+                        elif saw_partial:
+                            # Final aggregated event repeats the text already received as partials
+                            saw_partial = False
+                            continue
+                        if event.content and event.content.parts:
+                            for part in event.content.parts:
+                                if part.text:
+                                    yield emit(frames.log(part.text[:100] + "..."))
+                                    for slide in parser.feed(part.text):
+                                        idx = len(parser.slides) - 1
+                                        enrich_slide_with_prompt(slide)
+                                        if idx == 0:
+                                            yield emit(frames.snapshot({"slides": []}, project_id))
+                                        yield emit(frames.data_model(f"/script/slides/{idx}", "add", slide))
+                                        yield emit(frames.status(f"🧠 Planned slide {idx + 1}..."))
+
+                script_data = parser.result()
+                if not script_data and parser.slides:
+                    # Plan was cut short but individual slides were complete: keep them.
+                    logger.warning(f"Plan JSON incomplete; recovered {len(parser.slides)} streamed slides")
+                    script_data = {"slides": parser.slides}
                 if script_data:
                     script_data = enrich_script_with_prompts(script_data)
                     if db:
@@ -252,128 +624,80 @@ async def agent_stream(request: Request, user_id: str = Depends(get_user_id), ap
                         }, merge=True)
                     session.state["script"] = script_data
                     session.state["current_phase"] = "script_ready"
-                    await session_service.update_session_state(app_name="infographic-pro", user_id=user_id, session_id=session_id, state=session.state)
-                    yield await yield_and_log(json.dumps({"updateDataModel": {"surfaceId": surface_id, "path": "/", "op": "replace", "value": {"script": script_data, "project_id": project_id}}}))
-                    yield await yield_and_log(json.dumps({"updateComponents": {"surfaceId": surface_id, "components": [{"id": "status", "component": "Text", "text": "✅ Script Ready for Review"}]}}))
+                    await save_session_state(session, user_id, session_id, flush=True)
+                    yield emit(frames.snapshot(script_data, project_id))
+                    yield emit(frames.status("✅ Script Ready for Review"))
                 else:
-                    logger.error(f"Failed to parse JSON. Output was: {agent_output[:500]}...")
-                    yield await yield_and_log(json.dumps({"log": "Error: Agent failed to produce valid plan."}))
+                    logger.error(f"Failed to parse JSON. Output was: {parser.text[:500]}...")
+                    yield emit(frames.log("Error: Agent failed to produce valid plan."))
 
             elif phase == "graphics":
-                logger.info("🎨 ENTERING GRAPHICS PHASE BLOCK")
-                script = session.state.get("script") or data.get("script", {})
-                slides = script.get("slides", [])
-                
-                if not slides:
-                    yield await yield_and_log(json.dumps({"log": "Error: No script found. Please run the planning phase first."}))
-                    return
-
-                yield await yield_and_log(json.dumps({"updateComponents": {"surfaceId": surface_id, "components": [{"id": "status", "component": "Text", "text": f"🎨 Starting generation (0/{len(slides)})..."}]}}))
-
-                ar = script.get("global_settings", {}).get("aspect_ratio", "16:9")
-                logo_url = await get_project_logo(user_id, project_id) if db else None
-                
-                # ADK Native: Use artifact_service directly
-                img_tool = ImageGenerationTool(api_key=api_key, artifact_service=artifact_service)
-                
-                batch_updates = {}
-                sem = asyncio.Semaphore(2)
-
-                async def process_single_slide(slide):
-                    sid = slide.get('id')
-                    if not sid: return None
-                    async with sem:
-                        try:
-                            logger.info(f"🎨 Generating image for slide {sid}...")
-                            prompt_text = slide.get('image_prompt')
-                            if not prompt_text:
-                                prompt_text = f"Infographic about {slide.get('title', 'Data')}, professional style, vector illustration, high resolution"
-
-                            # Result is now a dict: {"url": str, "path": str} or {"error": str}
-                            result_data = await asyncio.to_thread(
-                                img_tool.generate_and_save, 
-                                prompt_text, 
-                                aspect_ratio=ar, 
-                                user_id=user_id, 
-                                project_id=project_id, 
-                                logo_url=logo_url,
-                                model=requested_img_model
-                            )
-                            
-                            if "error" in result_data:
-                                raise Exception(result_data["error"])
-
-                            img_url = result_data["url"]
-                            img_path = result_data.get("path")
-                            
-                            logger.info(f"✅ Slide {sid} done: {img_url}")
-                            return {
-                                "sid": sid, 
-                                "url": img_url, 
-                                "path": img_path,
-                                "title": slide.get('title', 'Slide')
-                            }
-                        except Exception as e:
-                            logger.error(f"❌ Failed processing slide {sid}: {e}")
-                            return {"sid": sid, "url": f"Error: {str(e)}", "title": slide.get('title', 'Slide')}
-
-                tasks = [process_single_slide(slide) for slide in slides]
-                logger.info(f"Queued {len(tasks)} image generation tasks...")
-                
-                success_count = 0
-                error_count = 0
-                total_slides = len(slides)
-                
-                for future in asyncio.as_completed(tasks):
-                    if await request.is_disconnected(): break
-                    result = await future
-                    if not result: continue
-                    sid = result["sid"]
-                    img_url = result["url"]
-                    
-                    progress_msg = f"🎨 Generating {success_count + error_count + 1}/{total_slides}..."
-                    
-                    if "http" in img_url:
-                        success_count += 1
-                        # Save result for batch update
-                        batch_updates[sid] = result
-                        for s in script["slides"]:
-                            if s["id"] == sid: 
-                                s["image_url"] = img_url
-                                if "path" in result: s["image_path"] = result["path"]
-                        
-                        yield await yield_and_log(json.dumps({"updateDataModel": {"value": {"script": script}}}))
-                        yield await yield_and_log(json.dumps({"updateComponents": {"surfaceId": surface_id, "components": [{"id": f"card_{sid}", "component": "Column", "children": [f"t_{sid}", f"i_{sid}"], "status": "success"}, {"id": f"t_{sid}", "component": "Text", "text": result["title"]}, {"id": f"i_{sid}", "component": "Image", "src": img_url}, {"id": "status", "component": "Text", "text": progress_msg}]}}))
-                    else:
-                        error_count += 1
-                        yield await yield_and_log(json.dumps({"updateComponents": {"surfaceId": surface_id, "components": [{"id": f"card_{sid}", "component": "Text", "text": f"⚠️ {img_url}", "status": "error"}, {"id": "status", "component": "Text", "text": progress_msg}]}}))
-
-                if db and project_id and batch_updates:
-                    for s in script.get("slides", []):
-                        if s['id'] in batch_updates: 
-                            s['image_url'] = batch_updates[s['id']]['url']
-                            if 'path' in batch_updates[s['id']]:
-                                s['image_path'] = batch_updates[s['id']]['path']
-                    
-                    db.collection("users").document(user_id).collection("projects").document(project_id).update({"script": script, "status": "completed"})
-                    session.state["script"] = script
-                    session.state["current_phase"] = "completed"
-                    await session_service.update_session_state(app_name="infographic-pro", user_id=user_id, session_id=session_id, state=session.state)
-                
-                final_msg = "✨ All images ready!"
-                if error_count > 0:
-                    if success_count == 0:
-                        final_msg = "❌ Generation failed. Please try again."
-                    else:
-                        final_msg = f"⚠️ Finished with {error_count} errors."
-                
-                yield await yield_and_log(json.dumps({"updateComponents": {"surfaceId": surface_id, "components": [{"id": "status", "component": "Text", "text": final_msg}]}}))
+                async for line in graphics_events(
+                    session, data, user_id=user_id, project_id=project_id, session_id=session_id, api_key=api_key,
+                    image_model=requested_img_model, frames=frames, emit=emit, should_stop=request.is_disconnected
+                ):
+                    yield line
 
         return StreamingResponse(event_generator(), media_type="application/x-ndjson")
     except Exception as e:
         logger.error(f"Stream Error: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+def generation_job_events(data: dict, user_id: str, project_id: str, api_key: str, image_model: str):
+    async def events(job):
+        traffic = traffic_log.start_stream(job.id[:12])
+        traffic.inbound({"phase": "graphics", "project_id": project_id, "job_id": job.id, "models": {"image": image_model}})
+        frames = A2UIFrames("infographic_workspace")
+        session_id = f"{user_id}_{project_id}"
+
+        def emit(encoded: EncodedFrame) -> bytes:
+            traffic.outbound(encoded.frame, len(encoded.line))
+            return encoded.line
+
+        async def never_stop() -> bool:
+            # No client connection to lose: the job runs until the deck is done
+            return False
+
+        yield emit(frames.create_surface())
+        session = await load_session(user_id, session_id)
+        try:
+            async for line in graphics_events(
+                session, data, user_id=user_id, project_id=project_id, session_id=session_id, api_key=api_key,
+                image_model=image_model, frames=frames, emit=emit, should_stop=never_stop
+            ):
+                yield line
+        finally:
+            await flush_session_state(session_id)
+    return events
+
+@app.post("/agent/generate/jobs")
+async def create_generation_job(request: Request, user_id: str = Depends(get_user_id), api_key: str = Depends(get_api_key)):
+    """
+    Starts the graphics phase as a server-side job (same body as a `phase: graphics` stream request)
+    and returns immediately. Re-submitting while a job runs for the project, on any instance,
+    returns that job.
+    """
+    data = await request.json()
+    project_id = data.get("project_id") or uuid.uuid4().hex
+    image_model = request.headers.get("X-GenAI-Image-Model", DEFAULT_IMAGE_MODEL)
+    try:
+        status = await generation_jobs.submit(user_id, project_id, generation_job_events(data, user_id, project_id, api_key, image_model))
+    except GenerationQueueFull as e:
+        raise HTTPException(503, str(e))
+    return JSONResponse(status_code=202, content=status)
+
+@app.get("/agent/generate/jobs/{job_id}")
+async def get_generation_job(job_id: str, user_id: str = Depends(get_user_id)):
+    status = await generation_jobs.get(job_id, user_id)
+    if not status: raise HTTPException(404, "Generation job not found")
+    return status
+
+@app.get("/agent/generate/jobs/{job_id}/stream")
+async def stream_generation_job(job_id: str, since: int = 0, user_id: str = Depends(get_user_id)):
+    """A2UI frames after `since`, then live until the job ends; `{"cursor": n}` lines mark resume points."""
+    if not await generation_jobs.get(job_id, user_id): raise HTTPException(404, "Generation job not found")
+    return StreamingResponse(generation_jobs.stream(job_id, user_id, since), media_type="application/x-ndjson")
+
 @app.post("/agent/export_slides")
 async def export_slides_endpoint(request: Request, user_id: str = Depends(get_user_id)):
     try:
@@ -387,38 +711,180 @@ async def export_slides_endpoint(request: Request, user_id: str = Depends(get_us
         if not script: raise HTTPException(400, "Missing script")
         if not oauth_token: raise HTTPException(401, "Missing Google OAuth Token for Slides export")
 
+        # Slides fetches each image by URL, so hand it freshly signed ones for the user's own assets
+        slides = [dict(s) for s in script.get("slides", [])]
+        owned_prefix = f"users/{user_id}/"
+        signed = await url_signer.sign_many([s["image_path"] for s in slides if (s.get("image_path") or "").startswith(owned_prefix)])
+        for slide in slides:
+            if slide.get("image_path") in signed:
+                slide["image_url"] = signed[slide["image_path"]]
+
         slides_tool = GoogleSlidesTool(access_token=oauth_token)
-        presentation_id = slides_tool.create_presentation(script.get("slides", []), f"Project {project_id}")
+        presentation_id = await asyncio.to_thread(slides_tool.create_presentation, slides, f"Project {project_id}")
         return {"url": f"https://docs.google.com/presentation/d/{presentation_id}"}
     except Exception as e:
         logger.error(f"Slides Export Error: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+async def submit_export_job(data: dict, user_id: str):
+    script = data.get("script")
+    if not script: raise HTTPException(400, "Missing script")
+    kinds = tuple(k for k in data.get("artifacts", ["pdf", "zip"]) if k in ("pdf", "zip"))
+    if not kinds: raise HTTPException(400, "No known artifacts requested")
+    try:
+        return await export_jobs.submit(
+            user_id, data.get("project_id"), script.get("slides", []),
+            format_type=data.get("format_type", "pdf"),
+            quality=data.get("quality", DEFAULT_PDF_QUALITY),
+            kinds=kinds,
+            force=bool(data.get("force"))
+        )
+    except ExportQueueFull as e:
+        raise HTTPException(503, str(e))
+
 @app.post("/agent/export")
 async def export_assets(request: Request, user_id: str = Depends(get_user_id)):
+    """Synchronous export: runs a background job and waits for it (rendering still happens off-process)."""
     try:
-        data = await request.json()
-        script = data.get("script")
-        project_id = data.get("project_id")
-        if not script: raise HTTPException(400, "Missing script")
-        export_tool = ExportTool(artifact_service=artifact_service)
-        pdf_url, zip_url = await asyncio.gather(
-            asyncio.to_thread(export_tool.generate_pdf, script, project_id),
-            asyncio.to_thread(export_tool.create_zip, script, project_id)
-        )
-        return {"pdf": pdf_url, "zip": zip_url}
+        job = await submit_export_job(await request.json(), user_id)
+        await export_jobs.wait(job)
+        if job.status == "failed":
+            return JSONResponse(status_code=500, content={"error": job.error})
+        return {"pdf": job.results.get("pdf", ""), "zip": job.results.get("zip", "")}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Export Error: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+@app.post("/agent/export/jobs")
+async def create_export_job(request: Request, user_id: str = Depends(get_user_id)):
+    """Queues a PDF/ZIP export and returns immediately; poll or stream its status."""
+    job = await submit_export_job(await request.json(), user_id)
+    return JSONResponse(status_code=202, content=job.to_dict())
+
+@app.get("/agent/export/jobs/{job_id}")
+async def get_export_job(job_id: str, user_id: str = Depends(get_user_id)):
+    status = await export_jobs.status(job_id, user_id)
+    if not status: raise HTTPException(404, "Export job not found")
+    return status
+
+@app.get("/agent/export/jobs/{job_id}/stream")
+async def stream_export_job(job_id: str, user_id: str = Depends(get_user_id)):
+    """NDJSON stream of status snapshots until the job finishes."""
+    if not await export_jobs.status(job_id, user_id): raise HTTPException(404, "Export job not found")
+
+    async def snapshots():
+        async for snapshot in export_jobs.watch(job_id, user_id):
+            yield json.dumps(snapshot) + "\n"
+
+    return StreamingResponse(snapshots(), media_type="application/x-ndjson")
+
+@app.post("/agent/export/zip")
+async def export_zip_stream(request: Request, user_id: str = Depends(get_user_id)):
+    """Streams the ZIP straight into the response; nothing is staged on local disk."""
+    data = await request.json()
+    script = data.get("script")
+    project_id = data.get("project_id") or "export"
+    if not script: raise HTTPException(400, "Missing script")
+    export_tool = ExportTool(artifact_service=artifact_service, url_signer=url_signer, fetcher=asset_fetcher, user_id=user_id)
+    return StreamingResponse(
+        export_tool.iter_zip(script.get("slides", [])),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="presentation_{project_id}.zip"'}
+    )
+
 @app.post("/agent/refine_text")
 async def refine_text(request: Request): return {}
 
 @app.post("/agent/regenerate_slide")
-async def regenerate_slide(request: Request): return {}
+async def regenerate_slide(request: Request, user_id: str = Depends(get_user_id), api_key: str = Depends(get_api_key)):
+    """
+    Regenerates one slide's image (optionally with a new prompt) and streams back the
+    targeted A2UI update for just that slide; nothing else in the deck is touched.
+    """
+    data = await request.json()
+    project_id, slide_id = data.get("project_id"), data.get("slide_id")
+    if not project_id or not slide_id: raise HTTPException(400, "project_id and slide_id are required")
+    image_model = request.headers.get("X-GenAI-Image-Model", DEFAULT_IMAGE_MODEL)
+    new_prompt = (data.get("prompt") or "").strip()
+
+    session_id = f"{user_id}_{project_id}"
+    session = await load_session(user_id, session_id)
+    project_ref = db.collection("users").document(user_id).collection("projects").document(project_id) if db else None
+    script = session.state.get("script")
+    if not script and project_ref:
+        doc = await asyncio.to_thread(project_ref.get)
+        script = (doc.to_dict() or {}).get("script") if doc.exists else None
+    slides = (script or {}).get("slides", [])
+    idx = next((i for i, s in enumerate(slides) if s.get("id") == slide_id), None)
+    if idx is None: raise HTTPException(404, "Slide not found")
+
+    slide = slides[idx]
+    if new_prompt:
+        slide["image_prompt"] = new_prompt
+    enrich_slide_with_prompt(slide)
+    frames = A2UIFrames("infographic_workspace")
+
+    async def slide_events():
+        yield frames.status(f"🎨 Regenerating slide {idx + 1}...").line
+        limiter = image_limiters.get(api_key, image_model)
+        img_tool = ImageGenerationTool(api_key=api_key, artifact_service=artifact_service, limiter=limiter, cache=image_cache, url_signer=url_signer)
+        # The user asked for a different image, so identical prompts don't come from the cache
+        result = await img_tool.agenerate_and_save(
+            slide["image_prompt"],
+            aspect_ratio=script.get("global_settings", {}).get("aspect_ratio", "16:9"),
+            user_id=user_id,
+            project_id=project_id,
+            logo_url=await get_project_logo(user_id, project_id) if db else None,
+            model=image_model,
+            bypass_cache=True
+        )
+        if "error" in result:
+            logger.error(f"❌ Regenerating slide {slide_id} failed: {result['error']}")
+            yield frames.slide_error(slide_id, f"Error: {result['error']}", "⚠️ Regeneration failed.").line
+            return
+
+        slide["image_url"] = result["url"]
+        if result.get("path"): slide["image_path"] = result["path"]
+        yield frames.data_model(f"/script/slides/{idx}", "replace", slide).line
+        yield frames.slide_card(slide_id, slide.get("title", "Slide"), slide["image_url"], f"✅ Slide {idx + 1} regenerated").line
+
+        session.state["script"] = script
+        await save_session_state(session, user_id, session_id, flush=True)
+        if project_ref:
+            try: await patch_project_slide(project_ref, slide)
+            except Exception as e: logger.warning(f"Project patch for slide {slide_id} failed: {e}")
+
+    return StreamingResponse(slide_events(), media_type="application/x-ndjson")
 
 @app.post("/agent/upload")
-async def upload_document(request: Request): return {}
+async def upload_document(request: Request, user_id: str = Depends(get_user_id), api_key: str = Depends(get_api_key)):
+    """
+    Streams a multipart file (field name is free, first file part wins) into the user's uploads.
+    Clients may send `X-Content-SHA256`; a file already stored for the user is then reused without
+    reading the body. The response carries a signed URL and the Gemini File API handle.
+    """
+    record, deduplicated = await upload_store.lookup(user_id, request.headers.get("X-Content-SHA256")), True
+    if not record:
+        try:
+            record, deduplicated = await upload_store.store(user_id, request.stream(), request.headers.get("content-type", ""))
+        except UploadTooLarge as e:
+            raise HTTPException(413, str(e))
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+    record = await upload_store.ensure_gemini_file(user_id, record, api_key)
+    gemini_file = record.get("gemini_file") or {}
+    return {
+        "sha256": record["sha256"],
+        "path": record["path"],
+        "url": await url_signer.sign(record["path"]),
+        "filename": record["filename"],
+        "content_type": record["content_type"],
+        "size": record["size"],
+        "deduplicated": deduplicated,
+        "gemini_file": {k: gemini_file[k] for k in ("name", "uri", "mime_type", "expires_at")} if gemini_file else None,
+    }
 
 @app.post("/agent/refresh_assets")
 async def refresh_assets(request: Request, user_id: str = Depends(get_user_id)):
@@ -431,41 +897,17 @@ async def refresh_assets(request: Request, user_id: str = Depends(get_user_id)):
         if not script or "slides" not in script:
             return JSONResponse(status_code=400, content={"error": "Invalid script data"})
 
-        # Prepare credentials once for the batch
-        credentials, _ = google.auth.default()
-        if not credentials.valid:
-            request_adapter = google_requests.Request()
-            credentials.refresh(request_adapter)
-        
-        service_account_email = getattr(credentials, "service_account_email", None)
+        # Sign every slide concurrently through the shared signer (cached URLs are reused)
+        owned_prefix = f"users/{user_id}/"
+        paths = [slide["image_path"] for slide in script["slides"] if (slide.get("image_path") or "").startswith(owned_prefix)]
+        signed = await url_signer.sign_many(paths)
 
         refreshed_count = 0
         for slide in script["slides"]:
-            # If we have the storage path, we can regenerate the signed URL
-            if "image_path" in slide and slide["image_path"]:
-                try:
-                    blob = artifact_service.bucket.blob(slide["image_path"])
-                    
-                    if service_account_email:
-                        new_url = blob.generate_signed_url(
-                            version="v4",
-                            expiration=timedelta(days=7),
-                            method="GET",
-                            service_account_email=service_account_email,
-                            access_token=credentials.token
-                        )
-                    else:
-                        # Fallback for local dev
-                        new_url = blob.generate_signed_url(
-                            version="v4",
-                            expiration=timedelta(days=7),
-                            method="GET",
-                        )
-                        
-                    slide["image_url"] = new_url
-                    refreshed_count += 1
-                except Exception as e:
-                    logger.warning(f"Failed to refresh URL for {slide['image_path']}: {e}")
+            new_url = signed.get(slide.get("image_path"))
+            if new_url:
+                slide["image_url"] = new_url
+                refreshed_count += 1
         
         logger.info(f"♻️ Refreshed {refreshed_count} assets for project {project_id}")
         
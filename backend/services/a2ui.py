@@ -0,0 +1,116 @@
+"""
+A2UI 0.9 frame builder for the agent NDJSON stream.
+
+Frames are emitted as ready-to-send `bytes` lines. Static parts (surface id, catalog
+id, component shells) are encoded once per surface and spliced together with the
+encoded dynamic values, so only the values are serialised per emit. Encoding uses
+orjson when it is installed and falls back to the stdlib encoder otherwise.
+
+Every builder returns an `EncodedFrame`: the wire line plus the frame as a plain dict
+(references only, never encoded) for the traffic log.
+"""
+import json
+from typing import Any, NamedTuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CATALOG_ID = "https://a2ui.dev/specification/0.9/standard_catalog_definition.json"
+
+if orjson:
+    JSON_BACKEND = "orjson"
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+else:
+    JSON_BACKEND = "json"
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def dumps(obj: Any) -> bytes:
+        return _encoder.encode(obj).encode("utf-8")
+
+class EncodedFrame(NamedTuple):
+    line: bytes   # newline-terminated NDJSON line
+    frame: dict   # same frame as a dict, for logging
+
+_NL = b"\n"
+
+class A2UIFrames:
+    """Frame builder bound to one surface."""
+
+    def __init__(self, surface_id: str, catalog_id: str = CATALOG_ID):
+        self.surface_id = surface_id
+        self.catalog_id = catalog_id
+        sid = dumps(surface_id)
+        create = {"createSurface": {"surfaceId": surface_id, "catalogId": catalog_id}}
+        self._create = EncodedFrame(dumps(create) + _NL, create)
+        self._components_head = b'{"updateComponents":{"surfaceId":' + sid + b',"components":['
+        self._data_head = b'{"updateDataModel":{"surfaceId":' + sid + b',"path":'
+        self._status_head = b'{"id":"status","component":"Text","text":'
+        self._tail = b"]}}" + _NL
+
+    # --- Surface ---
+    def create_surface(self) -> EncodedFrame:
+        return self._create
+
+    # --- Data model ---
+    def data_model(self, path: str, op: str, value: Any) -> EncodedFrame:
+        line = self._data_head + dumps(path) + b',"op":' + dumps(op) + b',"value":' + dumps(value) + b"}}" + _NL
+        return EncodedFrame(line, {"updateDataModel": {"surfaceId": self.surface_id, "path": path, "op": op, "value": value}})
+
+    def snapshot(self, script: dict, project_id: str) -> EncodedFrame:
+        """Full data-model replace at the root."""
+        return self.data_model("/", "replace", {"script": script, "project_id": project_id})
+
+    # --- Components ---
+    def _status_component(self, text: str) -> bytes:
+        return self._status_head + dumps(text) + b"}"
+
+    def components(self, components: list[dict]) -> EncodedFrame:
+        line = self._components_head + b",".join(dumps(c) for c in components) + self._tail
+        return EncodedFrame(line, {"updateComponents": {"surfaceId": self.surface_id, "components": components}})
+
+    def status(self, text: str) -> EncodedFrame:
+        line = self._components_head + self._status_component(text) + self._tail
+        component = {"id": "status", "component": "Text", "text": text}
+        return EncodedFrame(line, {"updateComponents": {"surfaceId": self.surface_id, "components": [component]}})
+
+    def slide_card(self, slide_id: str, title: str, image_url: str, status_text: str) -> EncodedFrame:
+        """Card column (title + image) for a finished slide, plus the progress status."""
+        card_id, title_id, image_id = dumps(f"card_{slide_id}"), dumps(f"t_{slide_id}"), dumps(f"i_{slide_id}")
+        line = b"".join((
+            self._components_head,
+            b'{"id":', card_id, b',"component":"Column","children":[', title_id, b",", image_id, b'],"status":"success"},',
+            b'{"id":', title_id, b',"component":"Text","text":', dumps(title), b"},",
+            b'{"id":', image_id, b',"component":"Image","src":', dumps(image_url), b"},",
+            self._status_component(status_text),
+            self._tail,
+        ))
+        components = [
+            {"id": f"card_{slide_id}", "component": "Column", "children": [f"t_{slide_id}", f"i_{slide_id}"], "status": "success"},
+            {"id": f"t_{slide_id}", "component": "Text", "text": title},
+            {"id": f"i_{slide_id}", "component": "Image", "src": image_url},
+            {"id": "status", "component": "Text", "text": status_text},
+        ]
+        return EncodedFrame(line, {"updateComponents": {"surfaceId": self.surface_id, "components": components}})
+
+    def slide_error(self, slide_id: str, message: str, status_text: str) -> EncodedFrame:
+        card_id = dumps(f"card_{slide_id}")
+        line = b"".join((
+            self._components_head,
+            b'{"id":', card_id, b',"component":"Text","text":', dumps(f"⚠️ {message}"), b',"status":"error"},',
+            self._status_component(status_text),
+            self._tail,
+        ))
+        components = [
+            {"id": f"card_{slide_id}", "component": "Text", "text": f"⚠️ {message}", "status": "error"},
+            {"id": "status", "component": "Text", "text": status_text},
+        ]
+        return EncodedFrame(line, {"updateComponents": {"surfaceId": self.surface_id, "components": components}})
+
+    # --- Misc ---
+    @staticmethod
+    def log(message: str) -> EncodedFrame:
+        return EncodedFrame(b'{"log":' + dumps(message) + b"}" + _NL, {"log": message})
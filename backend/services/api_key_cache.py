@@ -0,0 +1,52 @@
+import time
+from collections import OrderedDict
+from typing import Optional
+
+class _SecretKey:
+    """Holds a decrypted key; repr/str are redacted so it never leaks into logs or tracebacks."""
+    __slots__ = ("_value", "expires_at")
+
+    def __init__(self, value: str, expires_at: float):
+        self._value = value
+        self.expires_at = expires_at
+
+    def reveal(self) -> str:
+        return self._value
+
+    def __repr__(self) -> str:
+        return "<SecretKey ***>"
+
+    __str__ = __repr__
+
+class ApiKeyCache:
+    """
+    Bounded, TTL'd in-memory cache of decrypted per-user Gemini API keys.
+    Saves the Firestore `users/{uid}` read + Fernet decrypt on every request.
+    """
+
+    def __init__(self, ttl_seconds: float = 300, max_entries: int = 2048):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _SecretKey]" = OrderedDict()
+
+    def get(self, user_id: str) -> Optional[str]:
+        entry = self._entries.get(user_id)
+        if not entry:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._entries.pop(user_id, None)
+            return None
+        self._entries.move_to_end(user_id)
+        return entry.reveal()
+
+    def set(self, user_id: str, api_key: str):
+        self._entries[user_id] = _SecretKey(api_key, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str):
+        self._entries.pop(user_id, None)
+
+    def __repr__(self) -> str:
+        return f"<ApiKeyCache entries={len(self._entries)}>"
@@ -0,0 +1,156 @@
+import ipaddress
+import logging
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+METADATA_IP = "169.254.169.254"
+
+class AssetFetcher:
+    """
+    Shared fetch layer for export rendering (ZIP/PDF).
+
+    - Slides carrying `image_path` are read straight from the artifact bucket,
+      skipping the signed-URL HTTP hop.
+    - Other URLs go through one pooled `requests.Session` with retries.
+    - SSRF verdicts per hostname are cached with a TTL instead of resolving DNS per URL.
+    - `iter_slide_images` downloads in parallel with a bounded in-flight window.
+    """
+
+    _TIMEOUT = 5            # per-file timeout (seconds)
+    _RETRIES = 2
+    _HOST_VERDICT_TTL = 300 # seconds
+    _MAX_PARALLEL = 6
+
+    def __init__(self, bucket=None, max_parallel: int = None):
+        self.bucket = bucket
+        self.max_parallel = max_parallel or self._MAX_PARALLEL
+        retry = Retry(total=self._RETRIES, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=("GET",))
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._host_verdicts: dict[str, tuple[bool, float]] = {}
+        self._verdict_lock = threading.Lock()
+
+    # --- SSRF protection ---
+    def _resolve_host_verdict(self, hostname: str) -> bool:
+        try:
+            infos = socket.getaddrinfo(hostname, None)
+        except socket.gaierror:
+            return False # Cannot resolve, unsafe
+        for info in infos:
+            ip_str = info[4][0]
+            ip = ipaddress.ip_address(ip_str)
+            # Block Cloud Metadata IP (Critical)
+            if ip_str == METADATA_IP or ip.is_link_local:
+                return False
+            # We explicitly allow loopback for local dev/testing
+            if ip.is_loopback:
+                continue
+            # Block private ranges (10.x, 172.16.x, 192.168.x)
+            if ip.is_private:
+                logger.warning(f"Blocked private IP access to {ip_str} for host {hostname}")
+                return False
+        return True
+
+    def is_safe_url(self, url: str) -> bool:
+        """
+        Validates URL to prevent SSRF attacks.
+        Blocks access to metadata servers and private internal ranges.
+        """
+        try:
+            parsed = urlparse(url)
+            hostname = parsed.hostname
+            # Allow safe schemes only
+            if not hostname or parsed.scheme not in ('http', 'https'):
+                return False
+
+            now = time.monotonic()
+            with self._verdict_lock:
+                cached = self._host_verdicts.get(hostname)
+            if cached and cached[1] > now:
+                return cached[0]
+
+            verdict = self._resolve_host_verdict(hostname)
+            with self._verdict_lock:
+                self._host_verdicts[hostname] = (verdict, now + self._HOST_VERDICT_TTL)
+            return verdict
+        except Exception as e:
+            logger.error(f"URL Validation Error: {e}")
+            return False
+
+    # --- Fetching ---
+    def fetch_url(self, url: str) -> bytes | None:
+        """Safely downloads file content from a URL through the pooled session."""
+        if not self.is_safe_url(url):
+            logger.warning(f"Skipping unsafe URL: {url}")
+            return None
+        try:
+            response = self.session.get(url, timeout=self._TIMEOUT)
+            response.raise_for_status()
+            logger.info(f"Downloaded {len(response.content)} bytes from {url[:80]}.")
+            return response.content
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Download attempt failed for {url[:80]}: {e}")
+            return None
+
+    def fetch_path(self, path: str) -> bytes | None:
+        """Reads an object directly from the artifact bucket."""
+        attempt = 0
+        while True:
+            try:
+                return self.bucket.blob(path).download_as_bytes(timeout=self._TIMEOUT)
+            except Exception as e:
+                if attempt >= self._RETRIES:
+                    logger.warning(f"Bucket read failed for {path}: {e}")
+                    return None
+                attempt += 1
+                time.sleep(0.3 * (2 ** attempt))
+
+    def fetch_slide_image(self, slide: dict, allowed_prefix: Optional[str] = None) -> bytes | None:
+        path = slide.get("image_path")
+        if path and self.bucket and (not allowed_prefix or path.startswith(allowed_prefix)):
+            content = self.fetch_path(path)
+            if content:
+                return content
+        url = slide.get("image_url") or ""
+        if url.startswith("http"):
+            return self.fetch_url(url)
+        return None
+
+    def iter_slide_images(self, slides: list[dict], allowed_prefix: Optional[str] = None) -> Iterator[tuple[int, dict, bytes | None]]:
+        """
+        Yields (index, slide, bytes) in slide order while keeping up to `max_parallel`
+        fetches in flight, so memory stays bounded by that window.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix="asset-fetch") as pool:
+            pending = deque()
+            remaining = iter(enumerate(slides))
+
+            def submit_next():
+                for idx, slide in remaining:
+                    pending.append((idx, slide, pool.submit(self.fetch_slide_image, slide, allowed_prefix)))
+                    return
+
+            for _ in range(self.max_parallel):
+                submit_next()
+            while pending:
+                idx, slide, future = pending.popleft()
+                submit_next()
+                try:
+                    content = future.result()
+                except Exception as e:
+                    logger.warning(f"Image fetch failed for slide {idx+1}: {e}")
+                    content = None
+                yield idx, slide, content
@@ -0,0 +1,73 @@
+import asyncio
+import time
+import uuid
+from typing import Generic, Optional, TypeVar
+
+TERMINAL_STATES = ("done", "failed", "interrupted")
+
+class BackgroundJob:
+    """State shared by every kind of background job (export, generation)."""
+
+    def __init__(self, user_id: str, project_id: str):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.project_id = project_id
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in TERMINAL_STATES
+
+    def touch(self, **fields):
+        for key, value in fields.items():
+            setattr(self, key, value)
+        self.updated_at = time.time()
+        # Wake current watchers and arm a fresh event for the next change
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    @property
+    def changed(self) -> asyncio.Event:
+        """Set by the next `touch()`; take it before reading state so no change is missed."""
+        return self._changed
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "project_id": self.project_id,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+J = TypeVar("J", bound=BackgroundJob)
+
+class JobTable(Generic[J]):
+    """This instance's jobs of one kind; finished jobs are dropped `ttl_seconds` after their last update."""
+
+    def __init__(self, ttl_seconds: float = 3600):
+        self.ttl_seconds = ttl_seconds
+        self._jobs: dict[str, J] = {}
+
+    def add(self, job: J):
+        self.evict_expired()
+        self._jobs[job.id] = job
+
+    def get(self, job_id: str, user_id: str) -> Optional[J]:
+        job = self._jobs.get(job_id)
+        if job and job.user_id == user_id:
+            return job
+        return None
+
+    def active(self) -> list[J]:
+        return [j for j in self._jobs.values() if not j.finished]
+
+    def evict_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.updated_at < cutoff]:
+            del self._jobs[job_id]
@@ -0,0 +1,60 @@
+import hashlib
+import json
+import logging
+import time
+from typing import Optional
+
+from services.user_index import UserIndex
+
+logger = logging.getLogger(__name__)
+
+class ExportCache:
+    """
+    Content-addressed cache of rendered exports (PDF/ZIP).
+
+    The key is a canonical hash of everything that shows up in the artifact: each
+    slide's image identity (bucket path, or URL without its signature query), title
+    and notes, plus the export kind, layout and quality profile. Editing any slide
+    changes the key, so stale artifacts are never served. Entries live in a
+    per-user index (`users/{uid}/export_cache/{key}`, see `UserIndex`).
+    """
+
+    # Artifacts older than this are re-rendered (keeps clear of bucket lifecycle deletes)
+    _MAX_AGE = 6 * 24 * 3600
+
+    def __init__(self, db=None, max_entries: int = 512):
+        self._index = UserIndex(db, "export_cache", "export", max_entries)
+
+    @staticmethod
+    def _image_identity(slide: dict) -> str:
+        # Signed URLs change on every refresh; only the object path / bare URL identifies the image
+        return slide.get("image_path") or (slide.get("image_url") or "").split("?")[0]
+
+    @classmethod
+    def make_key(cls, kind: str, slides: list[dict], format_type: str = "pdf", quality: str = "") -> str:
+        if kind == "zip":
+            # ZIPs only contain the images
+            canonical = {"kind": kind, "images": [cls._image_identity(s) for s in slides]}
+        else:
+            canonical = {
+                "kind": kind,
+                "format_type": format_type,
+                "quality": quality,
+                "slides": [
+                    [cls._image_identity(s), s.get("title") or "", s.get("description") or s.get("image_prompt") or ""]
+                    for s in slides
+                ],
+            }
+        blob = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def _fresh(self, record: dict) -> bool:
+        return bool(record.get("path")) and time.time() - record.get("created_at", 0) < self._MAX_AGE
+
+    async def get(self, user_id: str, key: str) -> Optional[str]:
+        """Returns the object path of a still-fresh artifact for `key`, or None."""
+        record = await self._index.get(user_id, key, self._fresh)
+        return record["path"] if record else None
+
+    async def put(self, user_id: str, key: str, path: str, project_id: str = None):
+        await self._index.put(user_id, key, {"path": path, "project_id": project_id, "created_at": time.time()})
@@ -0,0 +1,301 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from services.background_jobs import TERMINAL_STATES, BackgroundJob, JobTable
+from services.telemetry import observe, record_duration
+
+logger = logging.getLogger(__name__)
+
+class ExportQueueFull(Exception):
+    """Raised when too many export jobs are already queued or running."""
+
+# --- Worker process side ---
+# Buckets are built once per worker process and reused across jobs.
+_worker_buckets: dict = {}
+
+def _worker_bucket(bucket_spec: tuple[str, str]):
+    bucket = _worker_buckets.get(bucket_spec)
+    if bucket is None:
+        kind, location = bucket_spec
+        if kind == "local":
+            from services.local_bucket import LocalBucket
+            bucket = LocalBucket(location)
+        else:
+            from google.cloud import storage
+            bucket = storage.Client().bucket(location)
+        _worker_buckets[bucket_spec] = bucket
+    return bucket
+
+def render_export_artifact(bucket_spec: tuple[str, str], kind: str, slides: list[dict], format_type: str,
+                           quality: str, user_id: str, project_id: str) -> tuple[Optional[str], dict]:
+    """
+    Renders one artifact ('pdf' or 'zip') and uploads it. Runs in a pool process.
+    Returns (object path, stage timings) since metrics live in the API process.
+    """
+    from tools.export_tool import ExportTool
+    tool = ExportTool(bucket=_worker_bucket(bucket_spec), user_id=user_id)
+    if kind == "pdf":
+        path = tool.upload_pdf(slides, format_type=format_type, quality=quality, user_id=user_id, project_id=project_id)
+    else:
+        path = tool.upload_zip(slides, user_id=user_id, project_id=project_id)
+    return path, tool.timings
+
+# --- API process side ---
+class ExportJob(BackgroundJob):
+    def __init__(self, user_id: str, project_id: str, kinds: list[str]):
+        super().__init__(user_id, project_id)
+        self.kinds = kinds
+        self.paths: dict[str, str] = {}       # bucket object per kind; results holds their signed URLs
+        self.results: dict[str, str] = {}
+        self.cached: list[str] = []
+        self._write_lock = asyncio.Lock()
+
+    def to_dict(self) -> dict:
+        return {
+            **super().to_dict(),
+            "progress": {"done": len(self.results), "total": len(self.kinds)},
+            "results": dict(self.results),
+            "cached": list(self.cached),
+        }
+
+class ExportJobManager:
+    """
+    Runs PDF/ZIP exports as background jobs on a process pool.
+
+    - Rendering (FPDF, Pillow, zipfile) happens in `spawn`ed worker processes, so it
+      never competes with the event loop for the GIL; the pool size bounds concurrency.
+    - Workers upload artifacts straight to the bucket and hand back object paths,
+      which are signed here with the API process's warm credentials.
+    - With an `ExportCache`, an unchanged deck reuses the previously rendered artifact
+      instead of re-downloading and re-rendering it (`force=True` skips the lookup).
+    - The owning instance keeps jobs in memory for `ttl_seconds` after they finish. With
+      Firestore, status, artifact paths and errors are also written to
+      `users/{uid}/export_jobs/{job_id}` on every change, so any instance can answer
+      status and stream requests (signing the paths itself). The owner rewrites the doc
+      at least every `heartbeat_interval` seconds; a running job older than `stale_after`
+      lost its instance and is reported "interrupted".
+    - Jobs outlive the request that submitted them, so the instance needs CPU outside
+      requests (Cloud Run `--no-cpu-throttling`, set in cloudbuild.yaml); otherwise
+      rendering stalls whenever no client is polling or watching.
+    """
+
+    def __init__(
+        self,
+        bucket_spec: Callable[[], tuple[str, str]],
+        sign: Callable[[str], Awaitable[str]],
+        max_workers: int = 2,
+        max_pending: int = 32,
+        ttl_seconds: float = 3600,
+        cache=None,
+        db=None,
+        poll_interval: float = 1.0,
+        heartbeat_interval: float = 10.0,
+        stale_after: float = 45.0,
+    ):
+        self.bucket_spec = bucket_spec
+        self.cache = cache
+        self.sign = sign
+        self.db = db
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self._jobs: JobTable[ExportJob] = JobTable(ttl_seconds)
+        self._tasks: set[asyncio.Task] = set()
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # Created on first use so the pool doesn't add to cold start; spawn avoids forking gRPC state
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def submit(self, user_id: str, project_id: str, slides: list[dict], format_type: str = "pdf",
+                     quality: str = "screen", kinds: tuple[str, ...] = ("pdf", "zip"), force: bool = False) -> ExportJob:
+        self._jobs.evict_expired()
+        active = len(self._jobs.active())
+        if active >= self.max_pending:
+            raise ExportQueueFull(f"{active} export jobs already pending")
+
+        job = ExportJob(user_id, project_id, list(kinds))
+        self._jobs.add(job)
+        # Written before the 202 goes out, so every instance can already find the job
+        await self._write_job(job)
+        task = asyncio.create_task(self._run(job, slides, format_type, quality, force))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        logger.info(f"📦 Export job {job.id} queued ({', '.join(kinds)}, {len(slides)} slides)")
+        return job
+
+    def get(self, job_id: str, user_id: str) -> Optional[ExportJob]:
+        """A job owned by this instance."""
+        return self._jobs.get(job_id, user_id)
+
+    def _job_ref(self, user_id: str, job_id: str):
+        return self.db.collection("users").document(user_id).collection("export_jobs").document(job_id)
+
+    async def _write_job(self, job: ExportJob):
+        if not self.db:
+            return
+        # Serialized per job so an older snapshot never lands after a newer one
+        async with job._write_lock:
+            fields = {
+                "project_id": job.project_id, "kinds": job.kinds, "status": job.status, "error": job.error,
+                "paths": dict(job.paths), "cached": list(job.cached),
+                "created_at": job.created_at, "updated_at": time.time(),
+            }
+            try:
+                await asyncio.to_thread(self._job_ref(job.user_id, job.id).set, fields)
+            except Exception as e:
+                logger.warning(f"Export job {job.id} status write failed: {e}")
+
+    async def _heartbeat(self, job: ExportJob):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            await self._write_job(job)
+
+    async def _read_remote(self, job_id: str, user_id: str) -> Optional[dict]:
+        """Status of a job owned by another instance, from its Firestore doc."""
+        if not self.db:
+            return None
+        doc = await asyncio.to_thread(self._job_ref(user_id, job_id).get)
+        if not doc.exists:
+            return None
+        data = doc.to_dict() or {}
+        status, error = data.get("status"), data.get("error")
+        if status not in TERMINAL_STATES and time.time() - (data.get("updated_at") or 0) > self.stale_after:
+            status, error = "interrupted", "Export job stopped responding"
+            logger.warning(f"⚠️ Export job {job_id} stopped heartbeating; marking it interrupted")
+            try:
+                await asyncio.to_thread(self._job_ref(user_id, job_id).update, {"status": status, "error": error})
+            except Exception as e:
+                logger.warning(f"Export job {job_id} status write failed: {e}")
+        paths = data.get("paths") or {}
+        urls = await asyncio.gather(*(self.sign(path) for path in paths.values()))
+        return {
+            "job_id": job_id,
+            "project_id": data.get("project_id"),
+            "status": status,
+            "error": error,
+            "created_at": data.get("created_at"),
+            "updated_at": data.get("updated_at"),
+            "progress": {"done": len(paths), "total": len(data.get("kinds") or [])},
+            "results": dict(zip(paths, urls)),
+            "cached": data.get("cached") or [],
+        }
+
+    async def status(self, job_id: str, user_id: str) -> Optional[dict]:
+        """Status of a job owned by this instance or, via Firestore, by any other."""
+        job = self.get(job_id, user_id)
+        if job:
+            return job.to_dict()
+        return await self._read_remote(job_id, user_id)
+
+    async def _render(self, job: ExportJob, kind: str, slides: list[dict], format_type: str, quality: str, force: bool):
+        cache_key = self.cache.make_key(kind, slides, format_type, quality) if self.cache else None
+        if cache_key and not force:
+            path = await self.cache.get(job.user_id, cache_key)
+            if path:
+                job.results[kind] = await self.sign(path)
+                job.paths[kind] = path
+                job.cached.append(kind)
+                job.touch()
+                await self._write_job(job)
+                return
+
+        loop = asyncio.get_running_loop()
+        args = (self.bucket_spec(), kind, slides, format_type, quality, job.user_id, job.project_id)
+        with observe(f"export.{kind}", slides=len(slides), format_type=format_type, quality=quality) as span:
+            try:
+                path, timings = await loop.run_in_executor(self._get_pool(), render_export_artifact, *args)
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM on a huge handout); start a fresh pool and retry once
+                logger.warning(f"Export pool broken during job {job.id}; restarting it")
+                self._pool = None
+                path, timings = await loop.run_in_executor(self._get_pool(), render_export_artifact, *args)
+            for stage, seconds in timings.items():
+                record_duration(f"export.{kind}.{stage}", seconds)
+                if span is not None:
+                    span.set_attribute(f"export.{stage}_seconds", seconds)
+        if not path:
+            raise RuntimeError(f"No {kind} produced (no slide images could be read)")
+        if cache_key:
+            await self.cache.put(job.user_id, cache_key, path, project_id=job.project_id)
+        with observe("export.sign"):
+            url = await self.sign(path)
+        job.results[kind] = url
+        job.paths[kind] = path
+        job.touch()
+        await self._write_job(job)
+
+    async def _run(self, job: ExportJob, slides: list[dict], format_type: str, quality: str, force: bool = False):
+        job.touch(status="running")
+        heartbeat = asyncio.create_task(self._heartbeat(job)) if self.db else None
+        start = time.perf_counter()
+        try:
+            outcomes = await asyncio.gather(
+                *(self._render(job, kind, slides, format_type, quality, force) for kind in job.kinds),
+                return_exceptions=True
+            )
+        except asyncio.CancelledError:
+            job.touch(status="interrupted")
+            raise
+        else:
+            errors = [f"{kind}: {o}" for kind, o in zip(job.kinds, outcomes) if isinstance(o, BaseException)]
+            if errors and not job.results:
+                logger.error(f"❌ Export job {job.id} failed: {errors}")
+                job.touch(status="failed", error="; ".join(errors))
+            else:
+                logger.info(f"✅ Export job {job.id} finished in {time.perf_counter() - start:.1f}s")
+                job.touch(status="done", error="; ".join(errors) or None)
+        finally:
+            if heartbeat:
+                heartbeat.cancel()
+            await self._write_job(job)
+
+    async def wait(self, job: ExportJob) -> ExportJob:
+        while not job.finished:
+            await job.changed.wait()
+        return job
+
+    async def watch(self, job_id: str, user_id: str) -> AsyncIterator[dict]:
+        """Yields a status snapshot now and after every change, ending once the job is finished."""
+        job = self.get(job_id, user_id)
+        if job:
+            while True:
+                changed = job.changed
+                yield job.to_dict()
+                if job.finished:
+                    return
+                await changed.wait()
+
+        # The job runs on another instance: poll its doc, yielding only when something changed
+        last = None
+        while True:
+            snapshot = await self._read_remote(job_id, user_id)
+            if not snapshot:
+                return
+            # Heartbeats bump updated_at and each read re-signs the URLs; neither is a change
+            state = (snapshot["status"], snapshot["error"], sorted(snapshot["results"]))
+            if state != last:
+                last = state
+                yield snapshot
+            if snapshot["status"] in TERMINAL_STATES:
+                return
+            await asyncio.sleep(self.poll_interval)
+
+    async def shutdown(self):
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        # Let cancelled jobs record "interrupted"
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -1,16 +1,136 @@
 import asyncio
+from collections import OrderedDict
 from typing import Optional, Dict, Any, List
 from google.adk.sessions import Session
-from google.adk.sessions.base_session_service import BaseSessionService
+from google.adk.sessions.base_session_service import BaseSessionService, GetSessionConfig
 from google.adk.events import Event
 from google.cloud import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+import logging
 import time
 import uuid
+from services.telemetry import observe
+
+logger = logging.getLogger(__name__)
+
+_DELETED = object()
 
 class FirestoreSessionService(BaseSessionService):
+    """
+    ADK session service backed by Firestore.
+
+    Layout:
+      adk_sessions/{session_id}                     -> id, appName, userId, state, eventCount, lastUpdateTime
+      adk_sessions/{session_id}/events/{seq_eventId} -> seq, timestamp, event
+
+    Events live in an ordered subcollection (keyed by a zero-padded sequence number)
+    instead of an ever-growing array on the session doc, so the doc stays small and
+    `get_session` can load only the last N events via `config.num_recent_events`.
+
+    State updates are write-behind: `update_session_state` diffs against the last known
+    state, stages only the changed top-level keys and returns the in-memory session.
+    The known state is a shallow copy, so a dict/list handed back after an in-place edit
+    is always staged rather than deep-copied on every update.
+    Staged keys are written in one `update` (as `state.<key>` field paths) by
+    `flush_session_state`, which callers invoke at phase boundaries.
+    """
+
+    EVENTS_SUBCOLLECTION = "events"
+    _MAX_TRACKED_SESSIONS = 1024
+    _MAX_BATCH_WRITES = 499
+
     def __init__(self, client: firestore.Client, collection_name: str = "adk_sessions"):
         self.db = client
         self.collection = self.db.collection(collection_name)
+        # Next sequence number per session, learned on load and advanced on append (LRU;
+        # an evicted session re-reads eventCount on its next append)
+        self._next_seq: "OrderedDict[str, int]" = OrderedDict()
+        # Write-behind state: last known state per session and staged (unflushed) keys
+        self._known_state: "OrderedDict[str, dict]" = OrderedDict()
+        self._pending: Dict[str, Dict[str, Any]] = {}
+
+    @staticmethod
+    async def _call(op: str, fn, *args):
+        """Runs a blocking Firestore call off the event loop inside a `firestore.<op>` span."""
+        with observe(f"firestore.{op}"):
+            return await asyncio.to_thread(fn, *args)
+
+    def _events_ref(self, session_id: str):
+        return self.collection.document(session_id).collection(self.EVENTS_SUBCOLLECTION)
+
+    @staticmethod
+    def _event_doc_id(seq: int, event: Event) -> str:
+        # Zero-padded so lexical doc order == sequence order; event id avoids clobbering on races
+        return f"{seq:010d}_{event.id}"
+
+    @staticmethod
+    def _to_event(data: dict) -> Optional[Event]:
+        try:
+            return Event.model_validate(data)
+        except Exception as err:
+            # Skip malformed events to avoid crashing the whole session load
+            logger.warning(f"Failed to deserialize event: {err}")
+            return None
+
+    async def _migrate_legacy_events(self, session_id: str, events_data: list) -> int:
+        """Moves a pre-subcollection `events` array into the subcollection. Returns the event count."""
+        events_ref = self._events_ref(session_id)
+        docs = []
+        for e in events_data:
+            event = self._to_event(e)
+            if not event:
+                continue
+            seq = len(docs)
+            docs.append((events_ref.document(self._event_doc_id(seq, event)), {
+                "seq": seq, "timestamp": event.timestamp, "event": e
+            }))
+        # Firestore caps a batch at 500 writes. Event docs have deterministic ids, so a
+        # migration that fails part-way simply rewrites them on the next load.
+        for start in range(0, len(docs), self._MAX_BATCH_WRITES):
+            batch = self.db.batch()
+            for ref, data in docs[start:start + self._MAX_BATCH_WRITES]:
+                batch.set(ref, data)
+            await self._call("migrate_events", batch.commit)
+        # The legacy array is only dropped once every event has landed
+        await self._call("migrate_events", self.collection.document(session_id).update, {
+            "events": firestore.DELETE_FIELD, "eventCount": len(docs)
+        })
+        logger.info(f"📦 Migrated {len(docs)} legacy events for session {session_id} to subcollection")
+        return len(docs)
+
+    async def _load_events(self, session_id: str, config: Optional[GetSessionConfig] = None) -> List[Event]:
+        query = self._events_ref(session_id)
+        num_recent = getattr(config, "num_recent_events", None) if config else None
+        after_ts = getattr(config, "after_timestamp", None) if config else None
+
+        # Firestore needs the range-filtered field to lead the ordering; seq and timestamp grow together
+        order_field = "seq"
+        if after_ts:
+            query = query.where("timestamp", ">=", after_ts)
+            order_field = "timestamp"
+        if num_recent:
+            query = query.order_by(order_field, direction=firestore.Query.DESCENDING).limit(num_recent)
+        else:
+            query = query.order_by(order_field)
+
+        docs = await self._call("load_events", lambda: list(query.stream()))
+        if num_recent:
+            docs.reverse()
+        events = [self._to_event(d.to_dict().get("event", {})) for d in docs]
+        return [e for e in events if e]
+
+    async def list_events(self, *, session_id: str, page_size: int = 50, page_token: Optional[int] = None) -> tuple[List[Event], Optional[int]]:
+        """
+        Pages through a session's history in order.
+        `page_token` is the sequence number to start from; returns (events, next_page_token).
+        """
+        query = self._events_ref(session_id).order_by("seq")
+        if page_token is not None:
+            query = query.where("seq", ">=", page_token)
+        docs = await self._call("list_events", lambda: list(query.limit(page_size + 1).stream()))
+        next_token = docs[page_size].to_dict().get("seq") if len(docs) > page_size else None
+        events = [self._to_event(d.to_dict().get("event", {})) for d in docs[:page_size]]
+        return [e for e in events if e], next_token
 
     async def create_session(
         self,
@@ -21,22 +141,26 @@ class FirestoreSessionService(BaseSessionService):
         session_id: Optional[str] = None,
     ) -> Session:
         sid = session_id or str(uuid.uuid4())
-        
+
         # Ensure we don't overwrite an existing session's history if it exists
         doc_ref = self.collection.document(sid)
-        doc = await asyncio.to_thread(doc_ref.get)
-        
+        doc = await self._call("get_session", doc_ref.get)
+
         current_time = time.time()
-        
+
         if doc.exists:
             # If exists, we preserve events but might update state
             data = doc.to_dict()
-            existing_events_data = data.get("events", [])
-            existing_events = [Event.model_validate(e) for e in existing_events_data]
-            
+            if "events" in data:
+                self._set_seq(sid, await self._migrate_legacy_events(sid, data.get("events") or []))
+            else:
+                self._set_seq(sid, data.get("eventCount", 0))
+            existing_events = await self._load_events(sid)
+
             # Update state if provided, else keep existing
-            new_state = state if state is not None else data.get("state", {})
-            
+            new_state = state if state is not None else self._with_pending(sid, data.get("state", {}))
+            self._remember_state(sid, data.get("state", {}))
+
             return Session(
                 id=sid,
                 app_name=app_name,
@@ -45,7 +169,7 @@ class FirestoreSessionService(BaseSessionService):
                 events=existing_events,
                 last_update_time=current_time
             )
-            
+
         # Create New
         session = Session(
             id=sid,
@@ -56,8 +180,12 @@ class FirestoreSessionService(BaseSessionService):
             last_update_time=current_time
         )
 
-        doc_data = session.model_dump(mode='json', by_alias=True)
-        await asyncio.to_thread(doc_ref.set, doc_data)
+        doc_data = session.model_dump(mode='json', by_alias=True, exclude={"events"})
+        doc_data["eventCount"] = 0
+        await self._call("create_session", doc_ref.set, doc_data)
+        self._set_seq(sid, 0)
+        self._remember_state(sid, session.state)
+        self._pending.pop(sid, None)
         return session
 
     async def get_session(
@@ -66,84 +194,180 @@ class FirestoreSessionService(BaseSessionService):
         app_name: str,
         user_id: str,
         session_id: str,
-        config: Optional[Any] = None,
+        config: Optional[GetSessionConfig] = None,
     ) -> Optional[Session]:
         doc_ref = self.collection.document(session_id)
-        doc = await asyncio.to_thread(doc_ref.get)
-        
+        doc = await self._call("get_session", doc_ref.get)
+
         if not doc.exists:
             return None
-        
+
         data = doc.to_dict()
         if data.get("appName") != app_name or data.get("userId") != user_id:
             return None
 
-        # Deserialize Events explicitly to ensure Pydantic validation passes
-        events_data = data.get("events", [])
-        events_objects = []
-        for e in events_data:
-            try:
-                events_objects.append(Event.model_validate(e))
-            except Exception as err:
-                print(f"Warning: Failed to deserialize event: {err}")
-                # Skip malformed events to avoid crashing the whole session load
+        if "events" in data:
+            self._set_seq(session_id, await self._migrate_legacy_events(session_id, data.get("events") or []))
+        else:
+            self._set_seq(session_id, data.get("eventCount", 0))
+
+        # Only the requested window of history is read (all of it when no config is given)
+        events_objects = await self._load_events(session_id, config)
+
+        # Unflushed write-behind updates take precedence over what Firestore holds
+        state = self._with_pending(session_id, data.get("state", {}))
+        if session_id not in self._pending:
+            self._remember_state(session_id, state)
 
         # Reconstruct Session
         return Session(
             id=data.get("id"),
             app_name=data.get("appName") or data.get("app_name"), # Handle aliasing
             user_id=data.get("userId") or data.get("user_id"),
-            state=data.get("state", {}),
+            state=state,
             events=events_objects,
             last_update_time=data.get("lastUpdateTime") or data.get("last_update_time") or time.time()
         )
 
+    def _set_seq(self, session_id: str, seq: int):
+        self._next_seq[session_id] = seq
+        self._next_seq.move_to_end(session_id)
+        while len(self._next_seq) > self._MAX_TRACKED_SESSIONS:
+            self._next_seq.popitem(last=False)
+
+    def _remember_state(self, session_id: str, state: dict):
+        # Shallow: top-level values are only compared, never copied (see `_changed`)
+        self._known_state[session_id] = dict(state)
+        self._known_state.move_to_end(session_id)
+        while len(self._known_state) > self._MAX_TRACKED_SESSIONS:
+            self._known_state.popitem(last=False)
+
+    @staticmethod
+    def _changed(known: Optional[dict], key: str, value: Any) -> bool:
+        if known is None or key not in known:
+            return True
+        old = known[key]
+        # The same dict/list passed again may have been mutated in place, so it can't be diffed
+        return (old is value and isinstance(value, (dict, list))) or old != value
+
+    def _with_pending(self, session_id: str, state: dict) -> dict:
+        pending = self._pending.get(session_id)
+        if not pending:
+            return state
+        merged = dict(state)
+        for key, value in pending.items():
+            if value is _DELETED:
+                merged.pop(key, None)
+            else:
+                merged[key] = value
+        return merged
+
     async def update_session_state(
         self,
         app_name: str,
         user_id: str,
         session_id: str,
         state: Dict[str, Any],
+        *,
+        session: Optional[Session] = None,
+        flush: bool = False,
     ) -> Session:
-        doc_ref = self.collection.document(session_id)
-        current_time = time.time()
-        
+        """
+        Stages the top-level state keys that changed since the last known state and
+        returns `session` (or a lightweight in-memory Session) without refetching events.
+        Nothing is written until `flush_session_state` (or `flush=True`).
+        """
+        known = self._known_state.get(session_id)
+        pending = self._pending.setdefault(session_id, {})
+        for key, value in state.items():
+            if self._changed(known, key, value):
+                pending[key] = value
+        if known:
+            for key in known:
+                if key not in state:
+                    pending[key] = _DELETED
+        self._remember_state(session_id, state)
+
+        if flush:
+            await self.flush_session_state(session_id)
+
+        if session is None:
+            return Session(id=session_id, app_name=app_name, user_id=user_id, state=state, events=[], last_update_time=time.time())
+        session.state = state
+        session.last_update_time = time.time()
+        return session
+
+    async def flush_session_state(self, session_id: str) -> None:
+        """Writes all staged state keys for the session as a single field-path update."""
+        pending = self._pending.pop(session_id, None)
+        if not pending:
+            return
         update_data = {
-            "state": state,
-            "lastUpdateTime": current_time
+            FieldPath("state", key).to_api_repr(): (firestore.DELETE_FIELD if value is _DELETED else value)
+            for key, value in pending.items()
         }
-        
-        await asyncio.to_thread(doc_ref.update, update_data)
-        
-        # We need to return the full session object, so we must fetch it or reconstruct it.
-        # Fetching is safer to ensure we have the events.
-        return await self.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+        update_data["lastUpdateTime"] = time.time()
+        try:
+            await self._call("flush_state", self.collection.document(session_id).update, update_data)
+        except Exception:
+            # Put the keys back (newer staged values win) so a later flush can retry
+            self._pending[session_id] = {**pending, **self._pending.get(session_id, {})}
+            raise
 
     async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
-        await asyncio.to_thread(self.collection.document(session_id).delete)
+        events_ref = self._events_ref(session_id)
+
+        def _delete_all():
+            # Subcollections are not removed with their parent doc
+            while True:
+                docs = list(events_ref.limit(400).stream())
+                if not docs:
+                    break
+                batch = self.db.batch()
+                for d in docs:
+                    batch.delete(d.reference)
+                batch.commit()
+            self.collection.document(session_id).delete()
+
+        await self._call("delete_session", _delete_all)
+        self._next_seq.pop(session_id, None)
+        self._known_state.pop(session_id, None)
+        self._pending.pop(session_id, None)
 
     async def list_sessions(self, *, app_name: str, user_id: str, page_size: int = 20, page_token: Optional[str] = None) -> Any:
         return []
 
     async def append_event(self, session: Session, event: Event) -> Event:
         """
-        Persists the event to Firestore by appending it to the 'events' array.
+        Persists the event as the next document of the session's `events` subcollection.
         This is critical for ADK Runner history.
         """
+        # Partial (streaming) events are transient and never persisted
+        if event.partial:
+            return event
+
         # 1. Update in-memory session (Runner expects this mutation)
         session.events.append(event)
         session.last_update_time = time.time()
 
         # 2. Persist to Firestore
-        doc_ref = self.collection.document(session.id)
-        
+        seq = self._next_seq.get(session.id)
+        if seq is None:
+            doc = await self._call("get_session", self.collection.document(session.id).get)
+            seq = (doc.to_dict() or {}).get("eventCount", 0) if doc.exists else 0
+        self._set_seq(session.id, seq + 1)
+
         # Serialize event using Pydantic V2
         event_data = event.model_dump(mode='json', by_alias=True)
-        
-        # Use ArrayUnion to append atomicaly
-        await asyncio.to_thread(doc_ref.update, {
-            "events": firestore.ArrayUnion([event_data]),
+
+        batch = self.db.batch()
+        batch.set(self._events_ref(session.id).document(self._event_doc_id(seq, event)), {
+            "seq": seq, "timestamp": event.timestamp, "event": event_data
+        })
+        batch.update(self.collection.document(session.id), {
+            "eventCount": firestore.Increment(1),
             "lastUpdateTime": session.last_update_time
         })
-        
-        return event
\ No newline at end of file
+        await self._call("append_event", batch.commit)
+
+        return event
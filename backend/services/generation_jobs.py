@@ -0,0 +1,318 @@
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Callable, Optional
+
+from google.cloud import firestore
+
+from services.background_jobs import TERMINAL_STATES, BackgroundJob, JobTable
+
+logger = logging.getLogger(__name__)
+
+class GenerationQueueFull(Exception):
+    """Raised when too many generation jobs are already running on this instance."""
+
+class GenerationJob(BackgroundJob):
+    def __init__(self, user_id: str, project_id: str):
+        super().__init__(user_id, project_id)
+        self.lines: list[bytes] = []
+        self.persisted = 0          # frames already written to the durable log
+        self.heartbeat_at = 0.0     # last time the job doc was written
+
+    @property
+    def cursor(self) -> int:
+        return len(self.lines)
+
+    def append(self, line: bytes):
+        self.lines.append(line)
+        self.touch()
+
+    def to_dict(self) -> dict:
+        return {**super().to_dict(), "cursor": self.cursor}
+
+def cursor_line(cursor: int) -> bytes:
+    # Control line interleaved with the A2UI frames; clients re-attach with ?since=<cursor>
+    return b'{"cursor":%d}\n' % cursor
+
+class GenerationJobManager:
+    """
+    Runs generation phases as server-side jobs, decoupled from any one HTTP connection.
+
+    A job drives an async iterator of NDJSON lines (A2UI frames) and appends each one
+    to an ordered log. Watchers attach with a cursor (number of frames already seen)
+    and get everything after it, then follow along live; a `{"cursor": n}` line after
+    each delivery tells them where to resume.
+
+    With Firestore the log is durable and visible from every instance:
+
+      users/{uid}/generation_jobs/{job_id}                 -> status, frames, project_id, ...
+      users/{uid}/generation_jobs/{job_id}/frames/{first}  -> first, end, lines[]
+
+      users/{uid}/generation_locks/{project_id}            -> job_id of the project's current job
+
+    Frames are flushed in chunks (every `flush_interval` seconds or `chunk_frames`
+    frames), so a deck costs a handful of writes rather than one per frame. The owning
+    instance serves watchers from memory; other instances poll the log.
+
+    The owner touches the job doc at least every `heartbeat_interval` seconds. A running
+    job whose doc is older than `stale_after` lost its instance: watchers mark it
+    "interrupted" and stop, and a new submit for the project may take over. Submits
+    claim the project lock in a transaction, so only one instance runs a project at a time.
+    """
+
+    FRAMES_SUBCOLLECTION = "frames"
+    LOCKS_COLLECTION = "generation_locks"
+    _STALE_ERROR = "Generation job stopped responding"
+    _MAX_CHUNK_BYTES = 512 * 1024      # well under Firestore's 1 MiB document limit
+
+    def __init__(self, db=None, max_pending: int = 16, ttl_seconds: float = 3600,
+                 flush_interval: float = 0.5, chunk_frames: int = 200, poll_interval: float = 1.0,
+                 heartbeat_interval: float = 10.0, stale_after: float = 45.0):
+        self.db = db
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.chunk_frames = chunk_frames
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self._jobs: JobTable[GenerationJob] = JobTable(ttl_seconds)
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def _job_ref(self, user_id: str, job_id: str):
+        return self.db.collection("users").document(user_id).collection("generation_jobs").document(job_id)
+
+    def _lock_ref(self, user_id: str, project_id: str):
+        return self.db.collection("users").document(user_id).collection(self.LOCKS_COLLECTION).document(project_id)
+
+    def _is_live(self, data: dict) -> bool:
+        """True for a job doc that is still running and heartbeating."""
+        if data.get("status") in TERMINAL_STATES:
+            return False
+        return time.time() - (data.get("updated_at") or 0) <= self.stale_after
+
+    def _claim(self, job: GenerationJob) -> str:
+        """Makes `job` the project's current job unless a live one exists; returns the winning job id."""
+        lock_ref = self._lock_ref(job.user_id, job.project_id)
+
+        @firestore.transactional
+        def claim(transaction):
+            lock = lock_ref.get(transaction=transaction)
+            current = (lock.to_dict() or {}).get("job_id") if lock.exists else None
+            if current:
+                current_ref = self._job_ref(job.user_id, current)
+                doc = current_ref.get(transaction=transaction)
+                data = (doc.to_dict() or {}) if doc.exists else {}
+                if self._is_live(data):
+                    return current
+                if doc.exists and data.get("status") not in TERMINAL_STATES:
+                    transaction.update(current_ref, {"status": "interrupted", "error": self._STALE_ERROR})
+            transaction.set(lock_ref, {"job_id": job.id, "created_at": job.created_at})
+            transaction.set(self._job_ref(job.user_id, job.id), self._job_fields(job, created=True))
+            return job.id
+
+        return claim(self.db.transaction())
+
+    async def submit(self, user_id: str, project_id: str,
+                     events: Callable[[GenerationJob], AsyncIterator[bytes]]) -> dict:
+        """Starts a job and returns its status, or that of the job already running for this project on any instance."""
+        self._jobs.evict_expired()
+        running = self._jobs.active()
+        for job in running:
+            if job.user_id == user_id and job.project_id == project_id:
+                return job.to_dict()
+        active = len(running)
+        if active >= self.max_pending:
+            raise GenerationQueueFull(f"{active} generation jobs already running")
+
+        job = GenerationJob(user_id, project_id)
+        if self.db:
+            try:
+                owner = await asyncio.to_thread(self._claim, job)
+            except Exception as e:
+                logger.warning(f"Generation lock for project {project_id} failed, starting anyway: {e}")
+                owner = job.id
+            if owner != job.id:
+                logger.info(f"🔁 Project {project_id} already has generation job {owner}")
+                status = await self.get(owner, user_id)
+                if status:
+                    return status
+        self._jobs.add(job)
+        task = asyncio.create_task(self._run(job, events))
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.id, None))
+        logger.info(f"🛠️ Generation job {job.id} started for project {project_id}")
+        return job.to_dict()
+
+    def get_local(self, job_id: str, user_id: str) -> Optional[GenerationJob]:
+        return self._jobs.get(job_id, user_id)
+
+    async def get(self, job_id: str, user_id: str) -> Optional[dict]:
+        """Status of a job owned by this instance or, via Firestore, by any other."""
+        job = self.get_local(job_id, user_id)
+        if job:
+            return job.to_dict()
+        if not self.db:
+            return None
+        doc = await asyncio.to_thread(self._job_ref(user_id, job_id).get)
+        if not doc.exists:
+            return None
+        data = doc.to_dict() or {}
+        if data.get("status") not in TERMINAL_STATES and not self._is_live(data):
+            data.update(await self._mark_interrupted(user_id, job_id))
+        return {
+            "job_id": job_id,
+            "project_id": data.get("project_id"),
+            "status": data.get("status"),
+            "cursor": data.get("frames", 0),
+            "error": data.get("error"),
+            "created_at": data.get("created_at"),
+            "updated_at": data.get("updated_at"),
+        }
+
+    # --- Producer side ---
+    async def _run(self, job: GenerationJob, events: Callable[[GenerationJob], AsyncIterator[bytes]]):
+        job.touch(status="running")
+        await self._write_job(job, created=True)
+        flusher = asyncio.create_task(self._flush_loop(job)) if self.db else None
+        start = time.perf_counter()
+        try:
+            async for line in events(job):
+                job.append(line)
+            job.status = "done"
+            logger.info(f"✅ Generation job {job.id} finished in {time.perf_counter() - start:.1f}s ({job.cursor} frames)")
+        except asyncio.CancelledError:
+            # Instance shutting down: whatever was produced stays in the log; a new job resumes from checkpoints
+            job.status = "interrupted"
+            raise
+        except Exception as e:
+            logger.error(f"❌ Generation job {job.id} failed: {e}")
+            job.status, job.error = "failed", str(e)
+        finally:
+            if flusher:
+                flusher.cancel()
+            await self._flush(job)
+            await self._write_job(job)
+            job.touch()
+
+    async def _flush_loop(self, job: GenerationJob):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush(job)
+            if time.time() - job.heartbeat_at >= self.heartbeat_interval:
+                # Nothing to flush for a while (e.g. a slow image): show watchers the job is alive
+                await self._write_job(job)
+
+    async def _flush(self, job: GenerationJob):
+        """Appends unflushed frames to the durable log as one or more chunk documents."""
+        if not self.db:
+            job.persisted = job.cursor
+            return
+        while job.persisted < job.cursor:
+            first, chunk, size = job.persisted, [], 0
+            for line in job.lines[first:first + self.chunk_frames]:
+                if chunk and size + len(line) > self._MAX_CHUNK_BYTES:
+                    break
+                chunk.append(line.decode("utf-8"))
+                size += len(line)
+            end = first + len(chunk)
+            batch = self.db.batch()
+            batch.set(self._job_ref(job.user_id, job.id).collection(self.FRAMES_SUBCOLLECTION).document(f"{first:08d}"),
+                      {"first": first, "end": end, "lines": chunk})
+            now = time.time()
+            batch.update(self._job_ref(job.user_id, job.id), {"frames": end, "updated_at": now})
+            try:
+                await asyncio.to_thread(batch.commit)
+            except Exception as e:
+                logger.warning(f"Generation log flush failed for job {job.id}: {e}")
+                return
+            job.persisted, job.heartbeat_at = end, now
+
+    @staticmethod
+    def _job_fields(job: GenerationJob, created: bool = False) -> dict:
+        # updated_at doubles as the heartbeat, so it is the write time rather than the job's last change
+        fields = {"status": job.status, "error": job.error, "frames": job.persisted, "updated_at": time.time()}
+        if created:
+            fields.update({"project_id": job.project_id, "created_at": job.created_at})
+        return fields
+
+    async def _write_job(self, job: GenerationJob, created: bool = False):
+        if not self.db:
+            return
+        fields = self._job_fields(job, created)
+        try:
+            await asyncio.to_thread(self._job_ref(job.user_id, job.id).set, fields, merge=True)
+        except Exception as e:
+            logger.warning(f"Generation job {job.id} status write failed: {e}")
+            return
+        job.heartbeat_at = fields["updated_at"]
+
+    async def _mark_interrupted(self, user_id: str, job_id: str) -> dict:
+        """Records that a job's owner went away without finishing it."""
+        fields = {"status": "interrupted", "error": self._STALE_ERROR}
+        logger.warning(f"⚠️ Generation job {job_id} stopped heartbeating; marking it interrupted")
+        try:
+            await asyncio.to_thread(self._job_ref(user_id, job_id).update, fields)
+        except Exception as e:
+            logger.warning(f"Generation job {job_id} status write failed: {e}")
+        return fields
+
+    # --- Watcher side ---
+    async def stream(self, job_id: str, user_id: str, since: int = 0) -> AsyncIterator[bytes]:
+        """Frames after `since`, followed live until the job ends; each delivery ends with a cursor line."""
+        job = self.get_local(job_id, user_id)
+        if job:
+            async for line in self._stream_local(job, since):
+                yield line
+        else:
+            async for line in self._stream_remote(job_id, user_id, since):
+                yield line
+
+    async def _stream_local(self, job: GenerationJob, since: int) -> AsyncIterator[bytes]:
+        cursor = max(0, since)
+        while True:
+            changed = job.changed
+            if cursor < job.cursor:
+                end = job.cursor
+                for line in job.lines[cursor:end]:
+                    yield line
+                cursor = end
+                yield cursor_line(cursor)
+            if job.finished and cursor >= job.cursor:
+                return
+            await changed.wait()
+
+    async def _stream_remote(self, job_id: str, user_id: str, since: int) -> AsyncIterator[bytes]:
+        # The job runs on another instance: follow its Firestore log
+        job_ref = self._job_ref(user_id, job_id)
+        cursor = max(0, since)
+        while True:
+            doc = await asyncio.to_thread(job_ref.get)
+            if not doc.exists:
+                return
+            data = doc.to_dict() or {}
+            # Status is read before the frames, so frames written before a terminal status are never missed
+            finished = data.get("status") in TERMINAL_STATES
+            if not finished and not self._is_live(data):
+                # The owning instance died mid-job; deliver what it logged and stop
+                await self._mark_interrupted(user_id, job_id)
+                finished = True
+            query = job_ref.collection(self.FRAMES_SUBCOLLECTION).where("end", ">", cursor).order_by("end")
+            chunks = await asyncio.to_thread(lambda: [c.to_dict() for c in query.stream()])
+            delivered = False
+            for chunk in chunks:
+                for line in chunk["lines"][max(0, cursor - chunk["first"]):]:
+                    yield line.encode("utf-8")
+                    delivered = True
+                cursor = max(cursor, chunk["end"])
+            if delivered:
+                yield cursor_line(cursor)
+            if finished:
+                return
+            await asyncio.sleep(self.poll_interval)
+
+    async def shutdown(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        # Let cancelled jobs flush their log and record "interrupted"
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,57 @@
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+from services.telemetry import record_cache
+from services.user_index import UserIndex
+
+logger = logging.getLogger(__name__)
+
+class ImageCache:
+    """
+    Content-addressed cache of generated images.
+
+    Maps sha256(prompt, model, aspect_ratio, image_size) to the GCS object path of
+    an image that was already generated for those exact inputs. The mapping is kept
+    in a per-user index (`users/{uid}/image_cache/{key}`, see `UserIndex`), so retries, re-runs of the graphics phase and duplicated slides never pay for
+    a second Gemini call + upload. Identical requests already in flight share one
+    generation (`single_flight`).
+    """
+
+    def __init__(self, db=None, max_entries: int = 1024):
+        self._index = UserIndex(db, "image_cache", "image", max_entries)
+        self._inflight: dict[tuple[str, str], asyncio.Task] = {}
+
+    @staticmethod
+    def make_key(prompt: str, model: str, aspect_ratio: str, image_size: str, logo_url: str = None) -> str:
+        h = hashlib.sha256()
+        for part in (model, aspect_ratio, image_size, logo_url or "", prompt):
+            h.update(part.encode("utf-8"))
+            h.update(b"\x00")
+        return h.hexdigest()
+
+    async def get(self, user_id: str, key: str) -> Optional[str]:
+        """Returns the cached object path for `key`, or None."""
+        record = await self._index.get(user_id, key, lambda r: bool(r.get("path")))
+        return record["path"] if record else None
+
+    async def put(self, user_id: str, key: str, path: str, model: str = None):
+        await self._index.put(user_id, key, {"path": path, "model": model, "created_at": time.time()})
+
+    async def single_flight(self, user_id: str, key: str, produce: Callable[[], Awaitable[dict]]) -> dict:
+        """
+        Runs `produce` once per (user, key) at a time: concurrent callers with the same key
+        (e.g. duplicated slides in one deck, which all miss the cache together) await the
+        same generation. It runs as its own task, so one caller going away doesn't cancel
+        it for the others.
+        """
+        task = self._inflight.get((user_id, key))
+        if task is None:
+            task = asyncio.ensure_future(produce())
+            self._inflight[(user_id, key)] = task
+            task.add_done_callback(lambda _: self._inflight.pop((user_id, key), None))
+        else:
+            record_cache("image", "inflight", True)
+        return dict(await asyncio.shield(task))
@@ -0,0 +1,80 @@
+import shutil
+from pathlib import Path
+
+class LocalBlob:
+    """Filesystem stand-in for the subset of `google.cloud.storage.Blob` the backend uses."""
+
+    def __init__(self, bucket: "LocalBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+        self.content_type = None
+
+    @property
+    def _file(self) -> Path:
+        path = (self.bucket.root / self.name).resolve()
+        if self.bucket.root not in path.parents:
+            raise ValueError(f"Object path escapes bucket root: {self.name}")
+        return path
+
+    @property
+    def public_url(self) -> str:
+        return self._file.as_uri()
+
+    def exists(self, *args, **kwargs) -> bool:
+        return self._file.is_file()
+
+    def upload_from_string(self, data, content_type: str = None, **kwargs):
+        if isinstance(data, str):
+            data = data.encode()
+        self._file.parent.mkdir(parents=True, exist_ok=True)
+        self._file.write_bytes(data)
+        self.content_type = content_type
+
+    def upload_from_file(self, file_obj, content_type: str = None, **kwargs):
+        self._file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self._file, "wb") as out:
+            shutil.copyfileobj(file_obj, out)
+        self.content_type = content_type
+
+    def download_as_bytes(self, *args, **kwargs) -> bytes:
+        try:
+            return self._file.read_bytes()
+        except FileNotFoundError:
+            raise FileNotFoundError(f"No such object: {self.bucket.name}/{self.name}")
+
+    def open(self, mode: str = "r", content_type: str = None, **kwargs):
+        # GCS-only options (chunk_size, ignore_flush, ...) have no local meaning
+        if "w" in mode:
+            self._file.parent.mkdir(parents=True, exist_ok=True)
+            self.content_type = content_type
+        return open(self._file, mode if "b" in mode else mode + "b")
+
+    def delete(self, *args, **kwargs):
+        self._file.unlink()
+
+    def generate_signed_url(self, *args, **kwargs) -> str:
+        return self.public_url
+
+class LocalBucket:
+    """
+    Directory-backed bucket for running export workers and load tests without GCS.
+    Object names map to paths under `root`.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.name = self.root.name
+
+    def blob(self, name: str) -> LocalBlob:
+        return LocalBlob(self, name)
+
+    def list_blobs(self, prefix: str = ""):
+        for path in sorted(self.root.rglob("*")):
+            if path.is_file():
+                name = path.relative_to(self.root).as_posix()
+                if name.startswith(prefix):
+                    yield LocalBlob(self, name)
+
+    def __repr__(self) -> str:
+        return f"<LocalBucket {self.root}>"
@@ -0,0 +1,136 @@
+import json
+import logging
+import re
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Only these characters change parser state; everything else is skipped in bulk.
+_STRUCTURAL = re.compile(r'[\\"{}\[\]:]')
+
+class IncrementalScriptParser:
+    """
+    Incremental parser for the Director's JSON plan.
+
+    Feed it text chunks as they arrive from `runner.run_async`; `feed` returns every
+    element of the top-level `"slides"` array that was completed by that chunk, so
+    slides can be streamed to the UI while the rest of the plan is still being written.
+    Each character is scanned once; only structural characters are visited.
+    """
+
+    def __init__(self, array_key: str = "slides"):
+        self.array_key = array_key
+        self._chunks: list[str] = []
+        self._started = False       # seen the first top-level '{'
+        self._done = False          # top-level object closed
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # Key tracking at depth 1 (root object members)
+        self._key_parts: Optional[list[str]] = None
+        self._last_string = None
+        self._current_key = None
+        self._array_depth = None    # depth inside the target array, when open
+        # Current array element being captured
+        self._elem_parts: Optional[list[str]] = None
+        self.slides: list[dict] = []
+
+    def feed(self, chunk: str) -> list[dict]:
+        if not chunk or self._done:
+            return []
+        self._chunks.append(chunk)
+        completed = []
+        pos = 0
+        if not self._started:
+            start = chunk.find('{')
+            if start == -1:
+                return []
+            self._started = True
+            pos = start
+        elem_start = 0 if self._elem_parts is not None else None
+        key_start = 0 if self._key_parts is not None else None
+        # An escape started by a trailing backslash in the previous chunk swallows char 0
+        skip_at = 0 if self._escape else -1
+        self._escape = False
+
+        for m in _STRUCTURAL.finditer(chunk, pos):
+            i = m.start()
+            char = m.group()
+
+            if self._in_string:
+                if i == skip_at:
+                    continue
+                if char == '\\':
+                    skip_at = i + 1
+                elif char == '"':
+                    self._in_string = False
+                    if self._key_parts is not None:
+                        self._key_parts.append(chunk[key_start:i])
+                        self._last_string = "".join(self._key_parts)
+                        self._key_parts = None
+                        key_start = None
+                continue
+
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    self._key_parts = []
+                    key_start = i + 1
+            elif char == ':':
+                if self._depth == 1:
+                    self._current_key = self._last_string
+            elif char in '{[':
+                self._depth += 1
+                if char == '[' and self._depth == 2 and self._current_key == self.array_key:
+                    self._array_depth = 2
+                elif char == '{' and self._array_depth is not None and self._depth == self._array_depth + 1:
+                    self._elem_parts = []
+                    elem_start = i
+            elif char in '}]':
+                self._depth -= 1
+                if self._elem_parts is not None and char == '}' and self._depth == self._array_depth:
+                    self._elem_parts.append(chunk[elem_start:i + 1])
+                    slide = self._parse_element("".join(self._elem_parts))
+                    self._elem_parts = None
+                    elem_start = None
+                    if slide is not None:
+                        self.slides.append(slide)
+                        completed.append(slide)
+                elif char == ']' and self._array_depth is not None and self._depth == self._array_depth - 1:
+                    self._array_depth = None
+                if self._depth == 0:
+                    self._done = True
+                    break
+
+        # Carry partial captures over to the next chunk
+        if self._elem_parts is not None and elem_start is not None:
+            self._elem_parts.append(chunk[elem_start:])
+        if self._key_parts is not None and key_start is not None:
+            self._key_parts.append(chunk[key_start:])
+        self._escape = self._in_string and skip_at == len(chunk)
+        return completed
+
+    @staticmethod
+    def _parse_element(text: str) -> Optional[dict]:
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Skipping unparseable streamed slide: {e}")
+            return None
+        return value if isinstance(value, dict) else None
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def result(self) -> Optional[dict]:
+        """Parses the first complete top-level object once the stream has ended."""
+        text = self.text
+        start = text.find('{')
+        if start == -1:
+            return None
+        try:
+            value, _ = json.JSONDecoder().raw_decode(text, start)
+            return value if isinstance(value, dict) else None
+        except json.JSONDecodeError:
+            return None
@@ -0,0 +1,84 @@
+"""
+Metrics and spans for the hot paths.
+
+`observe(stage, **attrs)` opens an OpenTelemetry span named after the stage and
+records its duration in the `infographic_stage_seconds{stage=...}` histogram, so the
+same boundaries show up in Cloud Trace and on `/metrics`. Counters cover cache
+lookups, model fallbacks and rate limiting.
+
+Both backends are optional: without opentelemetry spans are no-ops, and without
+prometheus_client metrics are no-ops and `/metrics` reports that it is disabled.
+"""
+import logging
+import time
+from contextlib import contextmanager, nullcontext
+
+from config.settings import KNOWN_MODELS
+
+logger = logging.getLogger(__name__)
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+try:
+    from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+except ImportError:
+    Counter = Histogram = generate_latest = None
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+_tracer = trace.get_tracer("infographic-pro") if trace else None
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def observe(self, value: float):
+        pass
+
+# Buckets span fast Firestore calls (~10 ms) through multi-minute image generations
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120, 300)
+
+if Histogram:
+    STAGE_SECONDS = Histogram("infographic_stage_seconds", "Latency of instrumented stages", ["stage"], buckets=_LATENCY_BUCKETS)
+    CACHE_LOOKUPS = Counter("infographic_cache_lookups_total", "Cache lookups by cache, tier and result", ["cache", "tier", "result"])
+    MODEL_FALLBACKS = Counter("infographic_model_fallbacks_total", "Requests retried on a fallback model", ["model", "fallback"])
+    RATE_LIMITED = Counter("infographic_rate_limited_total", "429 / quota rejections from upstream APIs", ["api", "model"])
+    STAGE_ERRORS = Counter("infographic_stage_errors_total", "Instrumented stages that raised", ["stage"])
+else:
+    STAGE_SECONDS = CACHE_LOOKUPS = MODEL_FALLBACKS = RATE_LIMITED = STAGE_ERRORS = _NoopMetric()
+
+@contextmanager
+def observe(stage: str, **attributes):
+    """Span + latency histogram around a block. Works in sync and async code alike."""
+    start = time.perf_counter()
+    span_cm = _tracer.start_as_current_span(stage, attributes={k: v for k, v in attributes.items() if v is not None}) if _tracer else nullcontext()
+    try:
+        with span_cm as span:
+            yield span
+    except BaseException:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+def record_duration(stage: str, seconds: float):
+    """For stages timed elsewhere (e.g. inside export worker processes)."""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+def model_label(model: str) -> str:
+    """Model names come from client headers; bound label cardinality to the models we ship."""
+    return model if model in KNOWN_MODELS else "other"
+
+def record_cache(cache: str, tier: str, hit: bool):
+    CACHE_LOOKUPS.labels(cache, tier, "hit" if hit else "miss").inc()
+
+def render_metrics() -> tuple[bytes, str]:
+    """Prometheus text exposition of this process's metrics."""
+    if not generate_latest:
+        return b"# prometheus_client not installed; metrics disabled\n", CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,124 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import requests
+from google.auth import jwt
+from firebase_admin import auth as firebase_auth
+
+logger = logging.getLogger(__name__)
+
+FIREBASE_CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+
+class TokenVerifier:
+    """
+    Cached, non-blocking Firebase ID token verification.
+
+    - Verified claims are cached (keyed by token hash) until the token's own `exp`.
+    - Google's public signing certs are fetched once and refreshed in the background
+      before their Cache-Control max-age runs out.
+    - Signature checks run in a worker thread so the event loop never blocks.
+    """
+
+    _CLOCK_SKEW = 10          # seconds tolerated on iat/exp
+    _REFRESH_MARGIN = 300     # refresh certs this long before they expire
+    _DEFAULT_MAX_AGE = 3600
+    _MIN_FORCED_INTERVAL = 60 # unknown `kid`s can't trigger a fetch storm
+
+    def __init__(self, project_id: str, max_entries: int = 10000):
+        self.project_id = project_id
+        self.issuer = f"https://securetoken.google.com/{project_id}"
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[str, dict]" = OrderedDict()
+        self._certs: dict[str, str] = {}
+        self._certs_expiry = 0.0
+        self._certs_fetched_at = 0.0
+        self._certs_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        # The Auth emulator issues unsigned tokens; let firebase_admin handle those.
+        self._use_firebase_admin = bool(os.environ.get("FIREBASE_AUTH_EMULATOR_HOST"))
+
+    # --- Signing keys ---
+    def _fetch_certs(self) -> tuple[dict, float]:
+        response = requests.get(FIREBASE_CERTS_URL, timeout=5)
+        response.raise_for_status()
+        max_age = self._DEFAULT_MAX_AGE
+        match = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+        if match:
+            max_age = int(match.group(1))
+        return response.json(), time.time() + max_age
+
+    async def refresh_certs(self, force: bool = False):
+        async with self._certs_lock:
+            now = time.time()
+            if not force and self._certs and now < self._certs_expiry - self._REFRESH_MARGIN:
+                return
+            if force and now - self._certs_fetched_at < self._MIN_FORCED_INTERVAL:
+                return
+            certs, expiry = await asyncio.to_thread(self._fetch_certs)
+            self._certs, self._certs_expiry, self._certs_fetched_at = certs, expiry, now
+            logger.info(f"🔑 Refreshed {len(certs)} Firebase signing certs (valid {int(expiry - time.time())}s)")
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.refresh_certs()
+                delay = max(60, self._certs_expiry - time.time() - self._REFRESH_MARGIN)
+            except Exception as e:
+                logger.warning(f"Firebase cert refresh failed: {e}")
+                delay = 30
+            await asyncio.sleep(delay)
+
+    def start(self):
+        """Starts background prefetch/refresh of the signing certs (call from app startup)."""
+        if self._use_firebase_admin or self._refresh_task:
+            return
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    # --- Verification ---
+    def _decode(self, token: str, certs: dict) -> dict:
+        claims = jwt.decode(token, certs=certs, audience=self.project_id, clock_skew_in_seconds=self._CLOCK_SKEW)
+        if claims.get("iss") != self.issuer:
+            raise ValueError(f"Invalid token issuer: {claims.get('iss')}")
+        if not claims.get("sub"):
+            raise ValueError("Token has no subject")
+        claims["uid"] = claims["sub"]
+        return claims
+
+    def _remember(self, key: str, claims: dict):
+        self._cache[key] = claims
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def verify(self, token: str) -> dict:
+        """Returns the decoded claims (with `uid`) or raises on an invalid token."""
+        key = hashlib.sha256(token.encode()).hexdigest()
+        claims = self._cache.get(key)
+        if claims:
+            if claims.get("exp", 0) > time.time():
+                return claims
+            del self._cache[key]
+
+        if self._use_firebase_admin:
+            claims = await asyncio.to_thread(firebase_auth.verify_id_token, token)
+        else:
+            await self.refresh_certs()
+            kid = jwt.decode_header(token).get("kid")
+            if kid not in self._certs:
+                # Google rotated keys before our scheduled refresh
+                await self.refresh_certs(force=True)
+            claims = await asyncio.to_thread(self._decode, token, self._certs)
+
+        self._remember(key, claims)
+        return claims
@@ -0,0 +1,155 @@
+import datetime
+import json
+import logging
+import queue
+import random
+import re
+import sys
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+_BASE64_RE = re.compile(r"^[A-Za-z0-9+/=]{200,}$")
+# Keys whose values are whole scripts/slide lists: summarised instead of dumped
+_BULKY_KEYS = ("script", "slides")
+
+class TrafficStream:
+    """Per-request handle: the sampling decision is made once so a sampled stream is logged whole."""
+    __slots__ = ("_log", "sampled", "request_id")
+
+    def __init__(self, log: "TrafficLogger", sampled: bool, request_id: str):
+        self._log = log
+        self.sampled = sampled
+        self.request_id = request_id
+
+    def inbound(self, content: dict):
+        if self.sampled:
+            self._log.enqueue("IN", self.request_id, content, None)
+
+    def outbound(self, frame: dict, size: int = None):
+        if self.sampled:
+            self._log.enqueue("OUT", self.request_id, frame, size)
+
+class TrafficLogger:
+    """
+    Structured IN/OUT traffic log for the agent stream, written to stdout for Cloud Logging.
+
+    The request path only makes a sampling decision and enqueues the frame object it
+    already built; redaction, truncation and JSON encoding happen on a background
+    writer thread. Frames are dropped (and counted) when the queue is full rather
+    than slowing the stream down.
+
+    Modes:
+      - "full":     frame content with long strings, base64 payloads and URL query
+                    strings truncated, and scripts/slide lists summarised
+      - "metadata": frame type, surface, path/op and size only (production)
+      - "off":      nothing
+    """
+
+    _TAG = "TRAFFIC_DEBUG"
+
+    def __init__(self, mode: str = "full", sample_rate: float = 1.0, max_field_chars: int = 256, max_queue: int = 10000, stream=None):
+        self.mode = mode if mode in ("full", "metadata", "off") else "full"
+        self.sample_rate = sample_rate
+        self.max_field_chars = max_field_chars
+        self.stream = stream or sys.stdout
+        self.dropped = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
+
+    # --- Request path (cheap) ---
+    def start_stream(self, request_id: str) -> TrafficStream:
+        sampled = self.mode != "off" and (self.sample_rate >= 1 or random.random() < self.sample_rate)
+        return TrafficStream(self, sampled, request_id)
+
+    def enqueue(self, direction: str, request_id: str, content: dict, size: Optional[int]):
+        if self._writer is None:
+            self._ensure_writer()
+        try:
+            self._queue.put_nowait((datetime.datetime.now().isoformat(), direction, request_id, content, size))
+        except queue.Full:
+            self.dropped += 1
+
+    # --- Writer thread ---
+    def _ensure_writer(self):
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name="traffic-log", daemon=True)
+                self._writer.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self.stream.write(self._format(*item) + "\n")
+                if self._queue.empty():
+                    self.stream.flush()
+            except Exception as e:
+                logger.debug(f"Traffic log write failed: {e}")
+
+    def close(self, timeout: float = 2.0):
+        """Drains what's queued and stops the writer (call on shutdown)."""
+        if self._writer is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._writer.join(timeout)
+        self._writer = None
+
+    # --- Formatting ---
+    @staticmethod
+    def _frame_meta(content: dict) -> dict:
+        kind = next(iter(content), None) if isinstance(content, dict) else None
+        meta = {"kind": kind}
+        body = content.get(kind) if kind else None
+        if isinstance(body, dict):
+            for key in ("surfaceId", "path", "op"):
+                if key in body:
+                    meta[key] = body[key]
+        return meta
+
+    def _truncate(self, value, key: str = None):
+        if isinstance(value, str):
+            if value.startswith("data:") or (len(value) > self.max_field_chars and _BASE64_RE.match(value[:4096])):
+                return f"<base64 {len(value)} chars>"
+            if value.startswith(("http://", "https://")) and "?" in value:
+                # Signed URLs: the query is long and sensitive
+                value = value.split("?", 1)[0] + "?…"
+            if len(value) > self.max_field_chars:
+                return value[:self.max_field_chars] + f"…(+{len(value) - self.max_field_chars} chars)"
+            return value
+        if key in _BULKY_KEYS:
+            if isinstance(value, list):
+                return f"<{len(value)} items>"
+            if isinstance(value, dict) and isinstance(value.get("slides"), list):
+                return f"<script: {len(value['slides'])} slides>"
+        if isinstance(value, dict):
+            return {k: self._truncate(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._truncate(v) for v in value]
+        return value
+
+    def _format(self, timestamp: str, direction: str, request_id: str, content: dict, size: Optional[int]) -> str:
+        entry = {
+            "timestamp": timestamp,
+            "tag": self._TAG,
+            "direction": direction, # "IN" (Request) or "OUT" (Response Chunk)
+            "request_id": request_id,
+        }
+        if direction == "OUT":
+            entry.update(self._frame_meta(content))
+        if size is not None:
+            entry["bytes"] = size
+        if self.mode == "full":
+            entry["content"] = self._truncate(content)
+        elif direction == "IN":
+            # Request metadata only: the user's query text stays out of production logs
+            entry["content"] = {k: v for k, v in content.items() if k != "query"}
+            entry["query_chars"] = len(content.get("query") or "")
+        return json.dumps(entry, ensure_ascii=False, default=str)
@@ -0,0 +1,229 @@
+import asyncio
+import hashlib
+import logging
+import re
+import time
+import uuid
+from pathlib import PurePath
+from typing import AsyncIterator, Optional
+
+from google import genai
+from google.genai import types
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
+
+from services.telemetry import observe, record_cache
+from services.user_index import UserIndex
+
+logger = logging.getLogger(__name__)
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the configured size limit."""
+
+class _FilePartReader:
+    """
+    python-multipart callbacks that pick out the first file part of a form.
+    Its bytes are collected in `pending` as they are parsed and drained by the caller.
+    """
+
+    def __init__(self):
+        self.filename: Optional[str] = None
+        self.content_type = "application/octet-stream"
+        self.pending: list[bytes] = []
+        self.done = False
+        self._headers: dict[bytes, bytes] = {}
+        self._field = self._value = b""
+        self._active = False
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._part_begin,
+            "on_header_field": self._header_field,
+            "on_header_value": self._header_value,
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        }
+
+    def _part_begin(self):
+        self._headers = {}
+
+    def _header_field(self, data: bytes, start: int, end: int):
+        self._field += data[start:end]
+
+    def _header_value(self, data: bytes, start: int, end: int):
+        self._value += data[start:end]
+
+    def _header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field = self._value = b""
+
+    def _headers_finished(self):
+        _, params = parse_options_header(self._headers.get(b"content-disposition", b""))
+        filename = params.get(b"filename")
+        self._active = filename is not None and self.filename is None and not self.done
+        if self._active:
+            self.filename = filename.decode("utf-8", "replace")
+            content_type = self._headers.get(b"content-type")
+            if content_type:
+                self.content_type = content_type.decode("latin-1").strip()
+
+    def _part_data(self, data: bytes, start: int, end: int):
+        if self._active:
+            self.pending.append(data[start:end])
+
+    def _part_end(self):
+        if self._active:
+            self._active = False
+            self.done = True
+
+class UploadStore:
+    """
+    Per-user document store for source PDFs, brand guides and other uploads.
+
+    - Multipart bodies are parsed as they stream in and written to the artifact bucket
+      in resumable chunks, hashing along the way; at most one chunk is held in memory.
+    - Files are deduplicated per user by sha256, indexed in `users/{uid}/uploads/{sha256}`
+      (a `UserIndex`).
+      A client that sends `X-Content-SHA256` for a known file skips the transfer entirely.
+    - The Gemini File API handle is stored with the record and reused while it is still
+      valid for the same API key, so repeat uploads never go through the File API again.
+    """
+
+    _CHUNK_SIZE = 8 * 256 * 1024        # resumable upload chunk; GCS wants multiples of 256 KiB
+    _GEMINI_FILE_MARGIN = 3600          # don't hand out File API handles expiring within the hour
+    _GEMINI_FILE_TTL = 47 * 3600        # File API keeps files for 48h
+
+    def __init__(self, bucket, db=None, max_bytes: int = 100 * 1024 * 1024, max_entries: int = 512):
+        self.bucket = bucket
+        self.max_bytes = max_bytes
+        self._index = UserIndex(db, "uploads", "upload", max_entries)
+
+    @staticmethod
+    def _safe_filename(filename: str) -> str:
+        name = PurePath((filename or "").replace("\\", "/")).name
+        return re.sub(r"[^A-Za-z0-9._-]+", "_", name).strip("._")[:120] or "upload"
+
+    @staticmethod
+    def _key_fingerprint(api_key: str) -> str:
+        # File API handles belong to the key's project; never store the key itself
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+    async def lookup(self, user_id: str, digest: str) -> Optional[dict]:
+        """Returns the record for a file this user already uploaded, if its object still exists."""
+        digest = (digest or "").strip().lower()
+        if not re.fullmatch(r"[0-9a-f]{64}", digest):
+            return None
+        record = await self._index.get(user_id, digest)
+        if not record:
+            return None
+        if not await asyncio.to_thread(self.bucket.blob(record["path"]).exists):
+            # Object was removed (e.g. lifecycle rule); treat as new
+            self._index.forget(user_id, digest)
+            return None
+        return record
+
+    async def store(self, user_id: str, body: AsyncIterator[bytes], content_type: str) -> tuple[dict, bool]:
+        """
+        Streams the first file of a multipart/form-data body into the bucket.
+        Returns (record, deduplicated); a duplicate upload is dropped in favour of the stored copy.
+        """
+        mime, params = parse_options_header(content_type)
+        if mime != b"multipart/form-data" or b"boundary" not in params:
+            raise ValueError("Expected a multipart/form-data body")
+
+        reader = _FilePartReader()
+        parser = MultipartParser(params[b"boundary"], reader.callbacks())
+        hasher = hashlib.sha256()
+        size, blob, writer = 0, None, None
+        upload_id = uuid.uuid4().hex
+        start = time.perf_counter()
+        try:
+            with observe("upload.stream") as span:
+                async for chunk in body:
+                    parser.write(chunk)
+                    if not reader.pending:
+                        continue
+                    data = b"".join(reader.pending)
+                    reader.pending.clear()
+                    size += len(data)
+                    if size > self.max_bytes:
+                        raise UploadTooLarge(f"Upload exceeds {self.max_bytes // (1024 * 1024)} MB")
+                    hasher.update(data)
+                    if writer is None:
+                        path = f"users/{user_id}/uploads/{upload_id}/{self._safe_filename(reader.filename)}"
+                        blob = self.bucket.blob(path)
+                        writer = await asyncio.to_thread(blob.open, "wb", content_type=reader.content_type, chunk_size=self._CHUNK_SIZE)
+                    await asyncio.to_thread(writer.write, data)
+                parser.finalize()
+                if reader.filename is None:
+                    raise ValueError("No file part in upload")
+                if writer is None:
+                    raise ValueError("Uploaded file is empty")
+                await asyncio.to_thread(writer.close)
+                writer = None
+                if span is not None:
+                    span.set_attribute("upload.bytes", size)
+        except BaseException:
+            if writer is not None:
+                # Abandon the partial object
+                try: await asyncio.to_thread(writer.close)
+                except Exception: pass
+            if blob is not None:
+                try: await asyncio.to_thread(blob.delete)
+                except Exception: pass
+            raise
+
+        digest = hasher.hexdigest()
+        existing = await self.lookup(user_id, digest)
+        if existing:
+            logger.info(f"♻️ Duplicate upload {reader.filename} ({size} bytes); reusing {existing['path']}")
+            try: await asyncio.to_thread(blob.delete)
+            except Exception as e: logger.warning(f"Failed to drop duplicate upload {blob.name}: {e}")
+            return existing, True
+
+        record = {
+            "sha256": digest,
+            "path": blob.name,
+            "filename": reader.filename,
+            "content_type": reader.content_type,
+            "size": size,
+            "created_at": time.time(),
+            "gemini_file": None,
+        }
+        await self._index.put(user_id, digest, record)
+        logger.info(f"📄 Stored upload {reader.filename} ({size} bytes) in {time.perf_counter() - start:.1f}s")
+        return record, False
+
+    async def ensure_gemini_file(self, user_id: str, record: dict, api_key: str) -> dict:
+        """Attaches a valid File API handle to the record, uploading from the bucket only if needed."""
+        fingerprint = self._key_fingerprint(api_key)
+        handle = record.get("gemini_file") or {}
+        if handle.get("key") == fingerprint and handle.get("expires_at", 0) - time.time() > self._GEMINI_FILE_MARGIN:
+            record_cache("gemini_file", "index", True)
+            return record
+        record_cache("gemini_file", "index", False)
+
+        def _upload():
+            client = genai.Client(api_key=api_key)
+            # Streams straight from the bucket; the file is never materialised on the instance
+            with self.bucket.blob(record["path"]).open("rb") as source:
+                return client.files.upload(file=source, config=types.UploadFileConfig(
+                    mime_type=record["content_type"], display_name=record["filename"]
+                ))
+
+        try:
+            with observe("upload.gemini_file", bytes=record.get("size")):
+                uploaded = await asyncio.to_thread(_upload)
+        except Exception as e:
+            logger.warning(f"Gemini File API upload failed for {record['path']}: {e}")
+            return record
+
+        expires = uploaded.expiration_time.timestamp() if uploaded.expiration_time else time.time() + self._GEMINI_FILE_TTL
+        record = {**record, "gemini_file": {
+            "name": uploaded.name, "uri": uploaded.uri, "mime_type": uploaded.mime_type or record["content_type"],
+            "expires_at": expires, "key": fingerprint,
+        }}
+        await self._index.update(user_id, record["sha256"], record, {"gemini_file": record["gemini_file"]})
+        return record
@@ -0,0 +1,138 @@
+import asyncio
+import datetime
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import google.auth
+from google.auth.transport import requests as google_requests
+
+logger = logging.getLogger(__name__)
+
+class UrlSigner:
+    """
+    Shared V4 signed-URL minting for artifact bucket objects.
+
+    - One ADC credentials object per process, refreshed in the background before its
+      token expires (Cloud Run signs through the IAM signBlob API with that token).
+    - `sign_many` signs blobs concurrently on a bounded thread pool.
+    - Still-valid URLs are cached by object path (LRU, shared by the signer threads)
+      and reused until close to expiry.
+    """
+
+    _EXPIRATION = datetime.timedelta(days=7)
+    _REUSE_MARGIN = datetime.timedelta(days=1)   # re-sign when less than this remains
+    _TOKEN_MARGIN = 300                          # refresh the access token 5 min early
+
+    def __init__(self, bucket, max_workers: int = 16, max_entries: int = 4096):
+        self.bucket = bucket
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="url-signer")
+        self._credentials = None
+        self._cred_lock = threading.Lock()
+        self._cache: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    # --- Credentials ---
+    def _token_expiring(self) -> bool:
+        creds = self._credentials
+        if not creds.valid:
+            return True
+        expiry = getattr(creds, "expiry", None)
+        if not expiry:
+            return False
+        return (expiry - datetime.datetime.utcnow()).total_seconds() < self._TOKEN_MARGIN
+
+    def _ensure_credentials(self):
+        with self._cred_lock:
+            if self._credentials is None:
+                self._credentials, _ = google.auth.default()
+            if self._token_expiring():
+                self._credentials.refresh(google_requests.Request())
+            return self._credentials
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                creds = await asyncio.to_thread(self._ensure_credentials)
+                expiry = getattr(creds, "expiry", None)
+                delay = (expiry - datetime.datetime.utcnow()).total_seconds() - self._TOKEN_MARGIN if expiry else 600
+            except Exception as e:
+                logger.warning(f"Signer credential refresh failed: {e}")
+                delay = 30
+            await asyncio.sleep(max(30, delay))
+
+    def start(self):
+        """Keeps the shared credentials warm (call from app startup)."""
+        if not self._refresh_task:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    # --- Signing ---
+    def _cached(self, path: str) -> Optional[str]:
+        with self._cache_lock:
+            hit = self._cache.get(path)
+            if hit and hit[1] - time.time() > self._REUSE_MARGIN.total_seconds():
+                self._cache.move_to_end(path)
+                return hit[0]
+        return None
+
+    def sign_sync(self, path: str) -> str:
+        """Blocking variant, for callers already running in a worker thread."""
+        url = self._cached(path)
+        if url:
+            return url
+
+        credentials = self._ensure_credentials()
+        blob = self.bucket.blob(path)
+        # If we have a service account email (typical in Cloud Run), sign via IAM
+        service_account_email = getattr(credentials, "service_account_email", None)
+        if service_account_email:
+            url = blob.generate_signed_url(
+                version="v4",
+                expiration=self._EXPIRATION,
+                method="GET",
+                service_account_email=service_account_email,
+                access_token=credentials.token
+            )
+        else:
+            # Fallback for local dev with key file
+            url = blob.generate_signed_url(
+                version="v4",
+                expiration=self._EXPIRATION,
+                method="GET"
+            )
+
+        with self._cache_lock:
+            self._cache[path] = (url, time.time() + self._EXPIRATION.total_seconds())
+            self._cache.move_to_end(path)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return url
+
+    async def sign(self, path: str) -> str:
+        url = self._cached(path)
+        if url:
+            return url
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.sign_sync, path)
+
+    async def sign_many(self, paths: list[str]) -> dict[str, str]:
+        """Signs all paths concurrently; failed paths are logged and left out of the result."""
+        unique = list(dict.fromkeys(p for p in paths if p))
+        results = await asyncio.gather(*(self.sign(p) for p in unique), return_exceptions=True)
+        signed = {}
+        for path, result in zip(unique, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to sign URL for {path}: {result}")
+            else:
+                signed[path] = result
+        return signed
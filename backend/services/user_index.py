@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from services.telemetry import record_cache
+
+logger = logging.getLogger(__name__)
+
+class UserIndex:
+    """
+    Per-user Firestore collection of small records (`users/{uid}/{collection}/{key}`)
+    with an in-process LRU in front. Backs the image, export and upload caches; hits
+    and misses are recorded under `metric` for both tiers.
+    """
+
+    def __init__(self, db, collection: str, metric: str, max_entries: int):
+        self.db = db
+        self.collection = collection
+        self.metric = metric
+        self.max_entries = max_entries
+        self._lru: "OrderedDict[tuple[str, str], dict]" = OrderedDict()
+
+    def _doc_ref(self, user_id: str, key: str):
+        return self.db.collection("users").document(user_id).collection(self.collection).document(key)
+
+    def remember(self, user_id: str, key: str, record: dict):
+        self._lru[(user_id, key)] = record
+        self._lru.move_to_end((user_id, key))
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def forget(self, user_id: str, key: str):
+        self._lru.pop((user_id, key), None)
+
+    async def get(self, user_id: str, key: str, valid: Callable[[dict], bool] = None) -> Optional[dict]:
+        """The record for `key` from memory or Firestore, or None; records failing `valid` count as misses."""
+        record = self._lru.get((user_id, key))
+        hit = bool(record) and (valid is None or valid(record))
+        record_cache(self.metric, "memory", hit)
+        if hit:
+            self._lru.move_to_end((user_id, key))
+            return record
+
+        if not self.db or not user_id:
+            return None
+        try:
+            doc = await asyncio.to_thread(self._doc_ref(user_id, key).get)
+        except Exception as e:
+            logger.warning(f"Firestore {self.collection} lookup failed: {e}")
+            return None
+        record = doc.to_dict() if doc.exists else None
+        hit = bool(record) and (valid is None or valid(record))
+        record_cache(self.metric, "firestore", hit)
+        if not hit:
+            return None
+        self.remember(user_id, key, record)
+        return record
+
+    async def put(self, user_id: str, key: str, record: dict):
+        self.remember(user_id, key, record)
+        if not self.db or not user_id:
+            return
+        try:
+            await asyncio.to_thread(self._doc_ref(user_id, key).set, record)
+        except Exception as e:
+            logger.warning(f"Firestore {self.collection} write failed: {e}")
+
+    async def update(self, user_id: str, key: str, record: dict, fields: dict):
+        """Stores `record` (already carrying `fields`) in memory and writes only `fields` to Firestore."""
+        self.remember(user_id, key, record)
+        if not self.db or not user_id:
+            return
+        try:
+            await asyncio.to_thread(self._doc_ref(user_id, key).update, fields)
+        except Exception as e:
+            logger.warning(f"Firestore {self.collection} update failed: {e}")
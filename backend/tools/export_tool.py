@@ -1,288 +1,340 @@
+import io
 import os
 import zipfile
 import uuid
+import time
+from typing import Iterator
 from fpdf import FPDF
+from PIL import Image
 from pathlib import Path
 import logging
-import requests
-import ipaddress
-import socket
-from urllib.parse import urlparse
+from services.asset_fetcher import AssetFetcher
+from config.settings import DEFAULT_PDF_QUALITY
 
 logger = logging.getLogger(__name__)
 STATIC_DIR = Path("static")
 
-class ExportTool:
-    _DOWNLOAD_TIMEOUT = 5
+# Target resolution/codec for images embedded in PDFs. 'original' embeds the generator's PNG untouched.
+PDF_QUALITY_PROFILES = {
+    "screen":   {"dpi": 150, "format": "JPEG", "quality": 80},
+    "print":    {"dpi": 300, "format": "JPEG", "quality": 92},
+    "lossless": {"dpi": 300, "format": "PNG", "compress_level": 6},
+    "original": {"dpi": None, "format": None},
+}
+
+class _ChunkSink:
+    """Write-only, non-seekable sink: zipfile streams into it and callers drain the bytes."""
 
     def __init__(self):
+        self._parts: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+class ExportTool:
+    _UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024 # resumable upload chunk (multiple of 256 KiB)
+
+    def __init__(self, artifact_service=None, url_signer=None, fetcher: AssetFetcher = None, user_id: str = None, bucket=None):
         self.static_dir = STATIC_DIR
+        self.artifact_service = artifact_service
+        self.url_signer = url_signer
+        self.user_id = user_id
+        # An explicit bucket (e.g. in an export worker process, or a LocalBucket) wins over the artifact service's
+        self.bucket = bucket or (artifact_service.bucket if artifact_service else None)
+        self.fetcher = fetcher or AssetFetcher(bucket=self.bucket)
+        # Stage durations (seconds) of the last upload_pdf/upload_zip, reported by export workers
+        self.timings: dict[str, float] = {}
+
+    @property
+    def _asset_prefix(self) -> str | None:
+        # Direct bucket reads are limited to the caller's own objects
+        return f"users/{self.user_id}/" if self.user_id else None
 
     def _is_safe_url(self, url: str) -> bool:
-        """
-        Validates URL to prevent SSRF attacks.
-        Blocks access to metadata servers and private internal ranges.
-        """
-        try:
-            parsed = urlparse(url)
-            hostname = parsed.hostname
-            if not hostname:
-                return False
-            
-            # Allow safe schemes only
-            if parsed.scheme not in ('http', 'https'):
-                return False
-
-            # Resolve hostname to IP
-            try:
-                ip_str = socket.gethostbyname(hostname)
-                ip = ipaddress.ip_address(ip_str)
-            except socket.gaierror:
-                return False # Cannot resolve, unsafe
-
-            # Block Cloud Metadata IP (Critical)
-            if ip_str == "169.254.169.254":
-                return False
-            
-            # Check for private/loopback addresses
-            # We explicitly allow loopback for local dev/testing
-            if ip.is_loopback:
-                return True
-                
-            # Block private ranges (10.x, 172.16.x, 192.168.x)
-            # CAUTION: In some internal Cloud Run configs, services talk on private IPs.
-            # But generally, we expect to fetch public URLs of our own service.
-            if ip.is_private:
-                logger.warning(f"Blocked private IP access to {ip_str} for URL {url}")
-                return False
-                
-            return True
-        except Exception as e:
-            logger.error(f"URL Validation Error: {e}")
-            return False
+        return self.fetcher.is_safe_url(url)
 
     def _download_file_content(self, url: str) -> bytes | None:
         """Helper to safely download file content from a URL."""
-        if not self._is_safe_url(url):
-            logger.warning(f"Skipping unsafe URL: {url}")
+        return self.fetcher.fetch_url(url)
+
+    def _iter_slide_images(self, slides: list[dict]) -> Iterator[tuple[int, dict, bytes | None]]:
+        return self.fetcher.iter_slide_images(slides, allowed_prefix=self._asset_prefix)
+
+    @staticmethod
+    def _zip_arcname(idx: int, source: str) -> str:
+        # Robust filename extraction: works for paths or https://.../img.png?sig=...
+        original_filename = os.path.basename(source.split("?")[0])
+        ext = os.path.splitext(original_filename)[1] or ".png"
+        clean_name = os.path.splitext(original_filename)[0]
+        # slide_XX prefix for sorting; keep the hash tail to avoid collisions on duplicates
+        return f"slide_{idx+1:02d}_{clean_name[-8:]}{ext}"
+
+    def _write_zip(self, fileobj, slides: list[dict]) -> Iterator[int]:
+        """Streams slide images into `fileobj` as a ZIP; yields after each entry with the count added."""
+        files_added = 0
+        # Non-seekable target -> zipfile writes data descriptors; PNGs are stored, not recompressed.
+        with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_STORED) as zipf:
+            for idx, slide, content in self._iter_slide_images(slides):
+                if not content:
+                    logger.warning(f"File missing/failed for ZIP: slide {idx+1}")
+                    continue
+                source = slide.get("image_path") or slide.get("image_url") or ""
+                info = zipfile.ZipInfo(self._zip_arcname(idx, source), date_time=time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_STORED
+                zipf.writestr(info, content)
+                files_added += 1
+                yield files_added
+        yield files_added
+
+    def iter_zip(self, slides: list[dict]) -> Iterator[bytes]:
+        """Streams a ZIP of the slide images chunk by chunk (e.g. straight into an HTTP response)."""
+        sink = _ChunkSink()
+        for _ in self._write_zip(sink, slides):
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+        tail = sink.drain()
+        if tail:
+            yield tail
+
+    @staticmethod
+    def _export_path(filename: str, user_id: str = None, project_id: str = None) -> str:
+        scope = f"users/{user_id}/projects/{project_id}" if user_id and project_id else "public"
+        return f"{scope}/exports/{filename}"
+
+    def _signed_url(self, remote_path: str) -> str:
+        if self.url_signer:
+            return self.url_signer.sign_sync(remote_path)
+        return self.bucket.blob(remote_path).public_url
+
+    def upload_zip(self, slides: list[dict], user_id: str = None, project_id: str = None) -> str | None:
+        """Streams a ZIP of the slide images into the bucket via a resumable upload; returns the object path."""
+        if not slides or not self.bucket:
             return None
 
-        _DOWNLOAD_TIMEOUT = 5
-        try:
-            response = requests.get(url, timeout=_DOWNLOAD_TIMEOUT)
-            response.raise_for_status()
-            logger.info(f"Downloaded {len(response.content)} bytes from {url}.")
-            return response.content
-        except requests.exceptions.RequestException as e:
-            logger.warning(f"Download attempt failed for {url}: {e}")
+        remote_path = self._export_path(f"presentation_export_{uuid.uuid4().hex}.zip", user_id or self.user_id, project_id)
+        blob = self.bucket.blob(remote_path)
+
+        files_added = 0
+        started = time.perf_counter()
+        with blob.open("wb", content_type="application/zip", chunk_size=self._UPLOAD_CHUNK_SIZE, ignore_flush=True) as writer:
+            for files_added in self._write_zip(writer, slides):
+                pass
+        # Fetch, archive and upload are pipelined, so they are timed as one stage
+        self.timings["stream"] = time.perf_counter() - started
+
+        if files_added == 0:
+            logger.error("No files were added to the ZIP archive.")
+            try: blob.delete()
+            except Exception: pass
             return None
+        return remote_path
 
-    def create_zip(self, file_paths: list[str]) -> str:
-        """Creates a ZIP file from a list of local file paths or URLs, preserving order in filenames."""
+    def create_zip(self, slides: list[dict], user_id: str = None, project_id: str = None) -> str:
+        """
+        Streams a ZIP of the slide images into the artifact bucket via a resumable upload
+        and returns a signed URL, so any instance can serve the download.
+        """
         try:
-            if not file_paths:
-                return ""
-                
-            zip_filename = f"presentation_export_{uuid.uuid4().hex}.zip"
-            zip_path = self.static_dir / zip_filename
-            
-            files_added = 0
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                for idx, file_path in enumerate(file_paths):
-                    # Robust filename extraction: works for /static/img.png or https://.../img.png
-                    original_filename = os.path.basename(file_path.split("?")[0]) # Remove query params if any
-                    local_path = self.static_dir / original_filename
-                    
-                    # Create a sequential filename for the ZIP: slide_01_originalhash.png
-                    # We keep the hash part to avoid collisions if somehow generating duplicates, 
-                    # but prefix with slide_XX for sorting.
-                    ext = os.path.splitext(original_filename)[1]
-                    clean_name = os.path.splitext(original_filename)[0]
-                    # arcname is the name INSIDE the zip
-                    arcname = f"slide_{idx+1:02d}_{clean_name[-8:]}{ext}" 
-                    
-                    if local_path.exists():
-                        logger.info(f"Adding to ZIP: {local_path} as {arcname}")
-                        zipf.write(local_path, arcname=arcname)
-                        files_added += 1
-                    elif file_path.startswith("http"):
-                        # Fallback: Try to download
-                        content = self._download_file_content(file_path)
-                        if content:
-                            zipf.writestr(arcname, content)
-                            files_added += 1
-                        else:
-                            logger.warning(f"File missing/failed for ZIP: {local_path} (from {file_path})")
-                    else:
-                        logger.warning(f"File missing for ZIP: {local_path}")
-            
-            if files_added == 0:
-                logger.error("No files were added to the ZIP archive.")
-                if zip_path.exists():
-                    os.remove(zip_path)
-                return ""
-                
-            return f"/static/{zip_filename}"
+            remote_path = self.upload_zip(slides, user_id, project_id)
+            return self._signed_url(remote_path) if remote_path else ""
         except Exception as e:
             logger.error(f"ZIP Creation Error: {e}")
             return ""
 
-    def create_pdf(self, file_paths: list[str], slides_data: list[dict] = None, format_type: str = "pdf") -> str:
+    @staticmethod
+    def _prepare_image(img, target_w_mm: float, profile: dict, original: bytes) -> io.BytesIO:
         """
-        Creates a PDF file from images.
-        
+        Re-encodes an image for embedding: downsampled to the profile DPI at its placed
+        width (never upscaled) and encoded with the profile codec. 'original' passes through.
+        """
+        if not profile.get("dpi"):
+            return io.BytesIO(original)
+
+        max_px = max(1, round(target_w_mm / 25.4 * profile["dpi"]))
+        if img.width > max_px:
+            new_h = max(1, round(img.height * max_px / img.width))
+            img = img.resize((max_px, new_h), Image.LANCZOS)
+
+        buf = io.BytesIO()
+        if profile["format"] == "JPEG":
+            if img.mode in ("RGBA", "LA", "P"):
+                # JPEG has no alpha: flatten onto white like the page background
+                img = img.convert("RGBA")
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                background.paste(img, mask=img.split()[-1])
+                img = background
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+            img.save(buf, format="JPEG", quality=profile["quality"], optimize=True, progressive=True)
+        else:
+            img.save(buf, format="PNG", compress_level=profile.get("compress_level", 6))
+        buf.seek(0)
+        return buf
+
+    def render_pdf(self, slides: list[dict], format_type: str = "pdf", quality: str = DEFAULT_PDF_QUALITY, images: list[bytes | None] = None) -> bytes | None:
+        """
+        Renders the deck to PDF bytes entirely in memory.
+
         Args:
-            file_paths: List of local image paths.
-            slides_data: List of dicts with 'title' and 'description' keys (for handout mode).
+            slides: Slide dicts ('image_path'/'image_url', 'title', 'description').
             format_type: 'pdf' (standard) or 'pdf_handout' (vertical with notes).
+            quality: Key of PDF_QUALITY_PROFILES ('screen', 'print' or 'original').
+            images: Pre-fetched image bytes aligned with `slides` (fetched here when omitted).
         """
-        try:
-            if not file_paths:
-                return ""
+        profile = PDF_QUALITY_PROFILES.get(quality) or PDF_QUALITY_PROFILES[DEFAULT_PDF_QUALITY]
+        if images is None:
+            pages = ((slide, content) for _, slide, content in self._iter_slide_images(slides))
+        else:
+            pages = zip(slides, images)
 
-            # Defer import to avoid circular dependency issues if any
-            from PIL import Image
-            import io # Needed for ByteIO with downloaded content
-
-            pdf = FPDF()
-            pdf.set_auto_page_break(0)
-            
-            files_added = 0
-            
-            # Ensure slides_data aligns with file_paths if missing
-            if not slides_data or len(slides_data) != len(file_paths):
-                slides_data = [{"title": f"Slide {i+1}", "description": ""} for i in range(len(file_paths))]
-
-            for idx, file_path in enumerate(file_paths):
-                # Clean filename from potential query params or URL junk
-                filename = os.path.basename(file_path.split("?")[0])
-                local_path = self.static_dir / filename
-                
-                img_source = None
-                
-                # Check if file exists locally, otherwise try to download
-                if local_path.exists():
-                    img_source = str(local_path)
-                elif file_path.startswith("http"):
-                    content = self._download_file_content(file_path)
-                    if content:
-                        # Save to temp file for FPDF or use stream if FPDF supports it?
-                        # FPDF typically expects a file path. Let's write it to the local path temporarily.
-                        # This also "heals" the local state for this instance.
-                        try:
-                            with open(local_path, "wb") as f:
-                                f.write(content)
-                            img_source = str(local_path)
-                            logger.info(f"Restored local file from URL: {local_path}")
-                        except Exception as write_err:
-                            logger.error(f"Failed to write downloaded content to {local_path}: {write_err}")
-                            continue
-
-                if not img_source:
-                    logger.warning(f"File missing for PDF: {local_path}")
-                    continue
+        pdf = FPDF()
+        pdf.set_auto_page_break(False)
+        files_added = 0
 
-                try:
-                    with Image.open(img_source) as img:
-                        width_px, height_px = img.size
-                        aspect_ratio = width_px / height_px
+        for idx, (slide, content) in enumerate(pages):
+            if not content:
+                logger.warning(f"File missing for PDF: slide {idx+1}")
+                continue
+
+            try:
+                with Image.open(io.BytesIO(content)) as img:
+                    img.load()
+                    width_px, height_px = img.size
+                    aspect_ratio = width_px / height_px
 
                     # --- HANDOUT MODE (Portrait + Text) ---
                     if format_type == "pdf_handout":
-                        pdf.add_page(orientation='P')
                         page_w = 210
-                        page_h = 297
                         margin = 15
-                        
+
                         # 1. Image (Top Half)
                         # Max height ~ 120mm to leave room for text
                         max_img_h = 120
                         printable_w = page_w - (2 * margin)
-                        
+
                         img_w = printable_w
                         img_h = img_w / aspect_ratio
-                        
+
                         if img_h > max_img_h:
                             img_h = max_img_h
                             img_w = img_h * aspect_ratio
-                            
+
+                        stream = self._prepare_image(img, img_w, profile, content)
+                        pdf.add_page(orientation='P')
+
                         # Center image horizontally
                         img_x = (page_w - img_w) / 2
                         img_y = margin
-                        
-                        pdf.image(img_source, x=img_x, y=img_y, w=img_w)
-                        
+
+                        pdf.image(stream, x=img_x, y=img_y, w=img_w, h=img_h)
+
                         # 2. Text (Bottom Half)
                         text_y = img_y + img_h + 10
                         pdf.set_y(text_y)
-                        
+
                         # Title
-                        slide_title = slides_data[idx].get("title", f"Slide {idx+1}")
-                        pdf.set_font("Arial", 'B', 16)
-                        # Latin-1 encoding hack for FPDF
+                        slide_title = slide.get("title") or f"Slide {idx+1}"
+                        pdf.set_font("Helvetica", 'B', 16)
+                        # Latin-1 encoding hack for core fonts
                         slide_title = slide_title.encode('latin-1', 'replace').decode('latin-1')
-                        pdf.cell(0, 10, txt=slide_title, ln=1, align='L')
-                        
+                        pdf.cell(0, 10, text=slide_title, new_x="LMARGIN", new_y="NEXT", align='L')
+
                         # Description / Notes
-                        slide_desc = slides_data[idx].get("description") or slides_data[idx].get("image_prompt", "")
-                        
+                        slide_desc = slide.get("description") or slide.get("image_prompt", "")
+
                         pdf.set_y(pdf.get_y() + 5)
-                        pdf.set_font("Arial", '', 11)
+                        pdf.set_font("Helvetica", '', 11)
                         slide_desc = slide_desc.encode('latin-1', 'replace').decode('latin-1')
-                        pdf.multi_cell(0, 6, txt=slide_desc)
-                        
+                        pdf.multi_cell(0, 6, text=slide_desc)
+
                     # --- STANDARD MODE (Smart Landscape) ---
                     else:
                         # > 1.1 means Landscape (e.g. 16:9 ~ 1.77). Square/near-square (1.0) stays Portrait.
-                        orientation = 'L' if aspect_ratio > 1.1 else 'P' 
-                        
-                        pdf.add_page(orientation=orientation)
-                        
+                        orientation = 'L' if aspect_ratio > 1.1 else 'P'
+
                         # A4 Dimensions in mm
                         a4_w_portrait = 210
                         a4_h_portrait = 297
-                        
+
                         if orientation == 'L':
                             page_w = a4_h_portrait # 297
                             page_h = a4_w_portrait # 210
                         else:
                             page_w = a4_w_portrait # 210
                             page_h = a4_h_portrait # 297
-                            
+
                         margin = 10
                         printable_w = page_w - (2 * margin)
                         printable_h = page_h - (2 * margin)
-                        
+
                         # Fit Logic: maximize width/height while keeping AR
-                        # Calculate target dimensions
                         target_w = printable_w
                         target_h = target_w / aspect_ratio
-                        
+
                         if target_h > printable_h:
                             # Too tall, fit to height
                             target_h = printable_h
                             target_w = target_h * aspect_ratio
-                            
+
+                        stream = self._prepare_image(img, target_w, profile, content)
+                        pdf.add_page(orientation=orientation)
+
                         # Centering
                         x = (page_w - target_w) / 2
                         y = (page_h - target_h) / 2
-                        
-                        pdf.image(img_source, x=x, y=y, w=target_w)
 
-                    files_added += 1
-                        
-                except Exception as img_err:
-                    logger.error(f"Error processing image {local_path}: {img_err}")
+                        pdf.image(stream, x=x, y=y, w=target_w, h=target_h)
 
-            if files_added == 0:
-                return ""
+                files_added += 1
 
-            suffix = "_handout" if format_type == "pdf_handout" else ""
-            pdf_filename = f"presentation_export_{uuid.uuid4().hex}{suffix}.pdf"
-            pdf_path = self.static_dir / pdf_filename
-            pdf.output(str(pdf_path))
-            
-            return f"/static/{pdf_filename}"
+            except Exception as img_err:
+                logger.error(f"Error processing image for slide {idx+1}: {img_err}")
+
+        if files_added == 0:
+            return None
+        return bytes(pdf.output())
+
+    def upload_pdf(self, slides: list[dict], format_type: str = "pdf", quality: str = DEFAULT_PDF_QUALITY, user_id: str = None, project_id: str = None) -> str | None:
+        """Renders the PDF in memory and uploads it to the bucket; returns the object path."""
+        if not slides or not self.bucket:
+            return None
+        started = time.perf_counter()
+        data = self.render_pdf(slides, format_type=format_type, quality=quality)
+        self.timings["render"] = time.perf_counter() - started
+        if not data:
+            return None
+        suffix = "_handout" if format_type == "pdf_handout" else ""
+        remote_path = self._export_path(f"presentation_export_{uuid.uuid4().hex}{suffix}.pdf", user_id or self.user_id, project_id)
+        started = time.perf_counter()
+        self.bucket.blob(remote_path).upload_from_string(data, content_type="application/pdf")
+        self.timings["upload"] = time.perf_counter() - started
+        return remote_path
+
+    def create_pdf(self, slides: list[dict], format_type: str = "pdf", quality: str = DEFAULT_PDF_QUALITY, user_id: str = None, project_id: str = None) -> str:
+        """Renders the PDF in memory, stores it as an export artifact and returns its URL."""
+        try:
+            if not slides:
+                return ""
+            if not self.bucket:
+                # Local fallback without a bucket: serve from /static
+                data = self.render_pdf(slides, format_type=format_type, quality=quality)
+                if not data:
+                    return ""
+                pdf_filename = f"presentation_export_{uuid.uuid4().hex}.pdf"
+                (self.static_dir / pdf_filename).write_bytes(data)
+                return f"/static/{pdf_filename}"
+            remote_path = self.upload_pdf(slides, format_type, quality, user_id, project_id)
+            return self._signed_url(remote_path) if remote_path else ""
         except Exception as e:
             logger.error(f"PDF Creation Error: {e}")
-            return ""
\ No newline at end of file
+            return ""
@@ -1,148 +1,277 @@
 import os
-import io
 import uuid
+import time
+import asyncio
+import functools
+import hashlib
 import logging
-import datetime
-from datetime import timedelta
-import requests
-import google.auth
-from google.auth.transport import requests as google_requests
+from collections import OrderedDict
 from google import genai
 from google.genai import types
-from PIL import Image
+from services.url_signer import UrlSigner
+from services.telemetry import observe, model_label, MODEL_FALLBACKS, RATE_LIMITED
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+FALLBACK_IMAGE_MODEL = "gemini-2.5-flash-image"
+
+def is_rate_limit_error(err: Exception) -> bool:
+    """True if the error is a Gemini quota/rate-limit rejection (HTTP 429)."""
+    msg = str(err)
+    return getattr(err, "code", None) == 429 or "429" in msg or "RESOURCE_EXHAUSTED" in msg
+
+def is_not_found_error(err: Exception) -> bool:
+    msg = str(err)
+    return "404" in msg or "NOT_FOUND" in msg
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD concurrency limiter for image generation.
+    Adds one slot after each success faster than `latency_target`,
+    halves the limit on a 429 and never drops below `minimum`.
+    """
+
+    def __init__(self, initial: int = 4, maximum: int = 16, minimum: int = 1, latency_target: float = 45.0):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            while self.in_flight >= self.limit:
+                await self._cond.wait()
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.release()
+
+    async def record_success(self, latency: float):
+        async with self._cond:
+            if latency <= self.latency_target and self.limit < self.maximum:
+                self.limit += 1
+                self._cond.notify_all()
+            elif latency > self.latency_target and self.limit > self.minimum:
+                self.limit -= 1
+
+    async def record_throttle(self):
+        async with self._cond:
+            new_limit = max(self.minimum, self.limit // 2)
+            if new_limit != self.limit:
+                logger.warning(f"🐢 Rate limited: image concurrency {self.limit} -> {new_limit}")
+            self.limit = new_limit
+
+class LimiterRegistry:
+    """
+    Process-wide limiters, one per (API key, model), so concurrent runs on the same key
+    (several tabs, a regenerate during a run) share the 429 and latency signal instead of
+    each probing the quota on its own. Keys are held only as fingerprints; the least
+    recently used limiters are dropped past `max_entries`.
+    """
+
+    def __init__(self, max_entries: int = 1024, **limiter_kwargs):
+        self.max_entries = max_entries
+        self.limiter_kwargs = limiter_kwargs
+        self._limiters: "OrderedDict[tuple[str, str], AdaptiveConcurrencyLimiter]" = OrderedDict()
+
+    def get(self, api_key: str, model: str) -> AdaptiveConcurrencyLimiter:
+        key = (hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16], model)
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limiter = self._limiters[key] = AdaptiveConcurrencyLimiter(**self.limiter_kwargs)
+        self._limiters.move_to_end(key)
+        while len(self._limiters) > self.max_entries:
+            self._limiters.popitem(last=False)
+        return limiter
+
 class ImageGenerationTool:
-    def __init__(self, api_key: str = None, artifact_service = None):
+    _MAX_RATE_LIMIT_RETRIES = 3
+    _RATE_LIMIT_BACKOFF = 2.0
+
+    def __init__(self, api_key: str = None, artifact_service = None, limiter: AdaptiveConcurrencyLimiter = None, cache = None, url_signer: UrlSigner = None):
         self.api_key = api_key or os.environ.get("GOOGLE_API_KEY")
         if not self.api_key:
             raise ValueError("GOOGLE_API_KEY is required for image generation.")
-        
+
         self.client = genai.Client(api_key=self.api_key)
         self.artifact_service = artifact_service
-        
+        self.limiter = limiter
+        self.cache = cache
+
         if not self.artifact_service:
             logger.warning("No ArtifactService provided. Images will not be saved.")
+        self.url_signer = url_signer or (UrlSigner(self.artifact_service.bucket) if self.artifact_service else None)
 
-    def generate_and_save(self, prompt: str, aspect_ratio: str = "16:9", user_id: str = None, project_id: str = None, logo_url: str = None, model: str = "gemini-3-pro-image-preview") -> dict:
-        """
-        Generates an image using Nano Banana (Gemini Image models) and saves it via ADK Artifact Service.
-        Returns a dict: {"url": str, "path": str} or {"error": str}.
-        """
+    # --- Helpers ---
+    def _build_config(self, aspect_ratio: str, image_size: str = "2K") -> types.GenerateContentConfig:
+        return types.GenerateContentConfig(
+            response_modalities=["IMAGE"],
+            image_config=types.ImageConfig(
+                aspect_ratio=aspect_ratio,
+                image_size=image_size # Default to high quality
+            ),
+            safety_settings=[
+                types.SafetySetting(
+                    category="HARM_CATEGORY_DANGEROUS_CONTENT",
+                    threshold="BLOCK_ONLY_HIGH"
+                )
+            ]
+        )
+
+    def _build_fallback_config(self, aspect_ratio: str) -> types.GenerateContentConfig:
+        return types.GenerateContentConfig(
+            response_modalities=["IMAGE"],
+            image_config=types.ImageConfig(
+                aspect_ratio=aspect_ratio
+            )
+        )
+
+    @staticmethod
+    def _extract_image_bytes(response) -> bytes | None:
+        if response.parts:
+            for part in response.parts:
+                if part.inline_data:
+                    return part.inline_data.data
+        return None
+
+    @staticmethod
+    def _remote_path(user_id: str = None, project_id: str = None) -> str:
+        filename = f"{uuid.uuid4()}.png"
+        if project_id and user_id:
+            return f"users/{user_id}/projects/{project_id}/assets/{filename}"
+        elif user_id:
+            return f"users/{user_id}/generated/{filename}"
+        return f"public/generated/{filename}"
+
+    async def _asign_path(self, remote_path: str) -> dict:
         try:
-            logger.info(f"Generating image with prompt: {prompt[:50]}... | Model: {model}")
-            
-            # Nano Banana uses generate_content, NOT generate_images
+            url = await self.url_signer.sign(remote_path)
+            return {"url": url, "path": remote_path}
+        except Exception as sign_err:
+            logger.error(f"❌ Failed to sign URL. Ensure Service Account has 'Token Creator' role. Error: {sign_err}")
+            return {"error": f"Signing Error: {str(sign_err)}"}
+
+    def _upload(self, image_bytes: bytes, user_id: str = None, project_id: str = None) -> str:
+        remote_path = self._remote_path(user_id, project_id)
+        blob = self.artifact_service.bucket.blob(remote_path)
+        blob.upload_from_string(image_bytes, content_type="image/png")
+        return remote_path
+
+    # --- Native async path ---
+    async def _agenerate_content(self, prompt: str, model: str, config: types.GenerateContentConfig):
+        """Calls the genai async client, retrying 429s with backoff and feeding the limiter."""
+        attempt = 0
+        while True:
             try:
-                response = self.client.models.generate_content(
-                    model=model,
-                    contents=prompt,
-                    config=types.GenerateContentConfig(
-                        response_modalities=["IMAGE"],
-                        image_config=types.ImageConfig(
-                            aspect_ratio=aspect_ratio,
-                            image_size="2K" # Default to high quality
-                        ),
-                        safety_settings=[
-                            types.SafetySetting(
-                                category="HARM_CATEGORY_DANGEROUS_CONTENT",
-                                threshold="BLOCK_ONLY_HIGH"
-                            )
-                        ]
-                    )
-                )
+                if self.limiter:
+                    with observe("image.limiter_wait"):
+                        await self.limiter.acquire()
+                    try:
+                        # Timed after acquire: queueing behind the limit must not read as slow generation
+                        started = time.monotonic()
+                        with observe("image.generate", model=model, attempt=attempt):
+                            response = await self.client.aio.models.generate_content(model=model, contents=prompt, config=config)
+                        latency = time.monotonic() - started
+                    finally:
+                        await self.limiter.release()
+                    await self.limiter.record_success(latency)
+                else:
+                    with observe("image.generate", model=model, attempt=attempt):
+                        response = await self.client.aio.models.generate_content(model=model, contents=prompt, config=config)
+                return response
             except Exception as e:
-                if "404" in str(e) or "NOT_FOUND" in str(e):
-                    logger.warning(f"⚠️ Model '{model}' not found. Falling back to 'gemini-2.5-flash-image'...")
-                    response = self.client.models.generate_content(
-                        model="gemini-2.5-flash-image",
-                        contents=prompt,
-                        config=types.GenerateContentConfig(
-                            response_modalities=["IMAGE"],
-                            image_config=types.ImageConfig(
-                                aspect_ratio=aspect_ratio
-                            )
-                        )
-                    )
+                if is_rate_limit_error(e):
+                    RATE_LIMITED.labels("genai", model_label(model)).inc()
+                if is_rate_limit_error(e) and attempt < self._MAX_RATE_LIMIT_RETRIES:
+                    if self.limiter:
+                        await self.limiter.record_throttle()
+                    delay = self._RATE_LIMIT_BACKOFF * (2 ** attempt)
+                    attempt += 1
+                    logger.warning(f"⏳ 429 from '{model}', retry {attempt}/{self._MAX_RATE_LIMIT_RETRIES} in {delay:.0f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                raise
+
+    async def _agenerate_and_store(self, prompt: str, aspect_ratio: str, user_id: str, project_id: str,
+                                   model: str, image_size: str, cache_key: str = None) -> dict:
+        """Generation + upload + signing for a cache miss; returns the same dict shape as `agenerate_and_save`."""
+        try:
+            logger.info(f"Generating image (async) with prompt: {prompt[:50]}... | Model: {model}")
+            used_model = model
+            try:
+                response = await self._agenerate_content(prompt, model, self._build_config(aspect_ratio, image_size))
+            except Exception as e:
+                if is_not_found_error(e):
+                    logger.warning(f"⚠️ Model '{model}' not found. Falling back to '{FALLBACK_IMAGE_MODEL}'...")
+                    MODEL_FALLBACKS.labels(model_label(model), FALLBACK_IMAGE_MODEL).inc()
+                    response = await self._agenerate_content(prompt, FALLBACK_IMAGE_MODEL, self._build_fallback_config(aspect_ratio))
+                    used_model = FALLBACK_IMAGE_MODEL
                 else:
                     raise e
 
-            # Extract image from response parts
-            image_bytes = None
-            if response.parts:
-                for part in response.parts:
-                    if part.inline_data:
-                        image_bytes = part.inline_data.data
-                        break
-            
+            image_bytes = self._extract_image_bytes(response)
             if not image_bytes:
                 logger.error("No image data found in response.")
                 return {"error": "No image generated."}
-            
-            # Post-processing (Watermark) placeholder
-            if logo_url:
-                try:
-                    pass 
-                except Exception as e:
-                    logger.warning(f"Watermarking failed: {e}")
-
-            # Upload via ArtifactService (ADK Native)
-            if self.artifact_service:
-                filename = f"{uuid.uuid4()}.png"
-                
-                # Construct path
-                if project_id and user_id:
-                    remote_path = f"users/{user_id}/projects/{project_id}/assets/{filename}"
-                elif user_id:
-                    remote_path = f"users/{user_id}/generated/{filename}"
-                else:
-                    remote_path = f"public/generated/{filename}"
-                
-                # Upload and get Signed URL
-                blob = self.artifact_service.bucket.blob(remote_path)
-                blob.upload_from_string(image_bytes, content_type="image/png")
-                
-                try:
-                    # Cloud Run Signing Logic: Use IAM API if private key is missing
-                    credentials, _ = google.auth.default()
-                    
-                    # Refresh credentials to ensure we have a token
-                    if not credentials.valid:
-                        request = google_requests.Request()
-                        credentials.refresh(request)
-                    
-                    # If we have a service account email (typical in Cloud Run), use it
-                    service_account_email = getattr(credentials, "service_account_email", None)
-                    
-                    if service_account_email:
-                        logger.info(f"Signing URL using Service Account: {service_account_email}")
-                        url = blob.generate_signed_url(
-                            version="v4",
-                            expiration=datetime.timedelta(days=7),
-                            method="GET",
-                            service_account_email=service_account_email,
-                            access_token=credentials.token
-                        )
-                    else:
-                        # Fallback for local dev with key file
-                        url = blob.generate_signed_url(
-                            version="v4",
-                            expiration=datetime.timedelta(days=7),
-                            method="GET"
-                        )
-                    
-                    logger.info(f"✅ Upload Success via ADK: {url[:50]}...")
-                    return {"url": url, "path": remote_path}
-                    
-                except Exception as sign_err:
-                    logger.error(f"❌ Failed to sign URL. Ensure Service Account has 'Token Creator' role. Error: {sign_err}")
-                    return {"error": f"Signing Error: {str(sign_err)}"}
-            else:
+
+            if not self.artifact_service:
                 return {"error": "ArtifactService not configured."}
 
+            with observe("image.upload", bytes=len(image_bytes)):
+                remote_path = await asyncio.to_thread(self._upload, image_bytes, user_id, project_id)
+            with observe("image.sign"):
+                result = await self._asign_path(remote_path)
+            if "url" in result:
+                logger.info(f"✅ Upload Success via ADK: {result['url'][:50]}...")
+            # A fallback image must not be served later as the requested model's output
+            if cache_key and "path" in result and used_model == model:
+                await self.cache.put(user_id, cache_key, result["path"], model=used_model)
+            return result
+
+        except Exception as e:
+            logger.error(f"Generation Fatal Error: {e}")
+            return {"error": str(e)}
+
+    async def agenerate_and_save(self, prompt: str, aspect_ratio: str = "16:9", user_id: str = None, project_id: str = None, logo_url: str = None, model: str = "gemini-3-pro-image-preview", image_size: str = "2K", bypass_cache: bool = False) -> dict:
+        """
+        Generates an image using Nano Banana (Gemini Image models) via `client.aio` and saves it to the artifact bucket.
+        The Gemini call is awaited on the event loop (no worker thread per image);
+        only the short GCS upload is offloaded; signing goes through the shared UrlSigner.
+        Identical (prompt, model, aspect_ratio, image_size) inputs are served from
+        `self.cache` unless `bypass_cache` is set (explicit "regenerate"); identical
+        requests already in flight share one generation.
+        Returns a dict: {"url": str, "path": str} or {"error": str}; cache hits add "cached": True.
+        """
+        try:
+            cache_key = None
+            if self.cache and self.artifact_service:
+                cache_key = self.cache.make_key(prompt, model, aspect_ratio, image_size, logo_url)
+                if not bypass_cache:
+                    cached_path = await self.cache.get(user_id, cache_key)
+                    if cached_path:
+                        logger.info(f"♻️ Image cache hit: {cached_path}")
+                        result = await self._asign_path(cached_path)
+                        if "url" in result:
+                            return {**result, "cached": True}
+
+            produce = functools.partial(self._agenerate_and_store, prompt, aspect_ratio, user_id, project_id, model, image_size, cache_key)
+            if cache_key and not bypass_cache:
+                return await self.cache.single_flight(user_id, cache_key, produce)
+            return await produce()
+
         except Exception as e:
             logger.error(f"Generation Fatal Error: {e}")
             return {"error": str(e)}
@@ -1,7 +1,45 @@
+import json
+import random
+import time
+from functools import lru_cache
+
 import google.oauth2.credentials
 import google.auth
-from googleapiclient.discovery import build
+import google_auth_httplib2
+import httplib2
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
 import logging
+from services.telemetry import observe, RATE_LIMITED
+
+_HTTP_TIMEOUT = 60
+_MAX_REQUESTS_PER_BATCH = 400          # well under the API's per-call limits
+_MAX_BATCH_BYTES = 512 * 1024
+_QUOTA_RETRIES = 5
+_QUOTA_REASONS = ("rateLimitExceeded", "userRateLimitExceeded", "quotaExceeded")
+
+@lru_cache(maxsize=1)
+def get_slides_service():
+    """
+    Process-wide Slides API client, built from the discovery document bundled with
+    google-api-python-client (parsed once). It carries no credentials: each tool
+    instance executes requests with its own authorized http.
+    """
+    document = json.loads(get_static_doc("slides", "v1"))
+    return build_from_document(document, http=httplib2.Http(timeout=_HTTP_TIMEOUT))
+
+def _is_quota_error(error: HttpError) -> bool:
+    if error.resp.status == 429:
+        return True
+    if error.resp.status == 403:
+        try:
+            details = json.loads(error.content.decode("utf-8")).get("error", {})
+            reasons = [e.get("reason") for e in details.get("errors", [])] + [details.get("status")]
+        except Exception:
+            return False
+        return any(r in _QUOTA_REASONS or r == "RESOURCE_EXHAUSTED" for r in reasons)
+    return False
 
 class GoogleSlidesTool:
     def __init__(self, access_token: str = None):
@@ -17,47 +55,149 @@ class GoogleSlidesTool:
             self.creds, _ = google.auth.default()
             logging.info("GoogleSlidesTool initialized with ADC (Service Account)")
 
-        self.service = build('slides', 'v1', credentials=self.creds)
+        self.service = get_slides_service()
+        # httplib2.Http is not thread-safe, so the shared client gets a per-tool transport
+        self.http = google_auth_httplib2.AuthorizedHttp(self.creds, http=httplib2.Http(timeout=_HTTP_TIMEOUT))
+
+    def _execute(self, request):
+        """Executes an API request, backing off and retrying on rate-limit/quota errors only."""
+        for attempt in range(_QUOTA_RETRIES + 1):
+            try:
+                return request.execute(http=self.http)
+            except HttpError as e:
+                if not _is_quota_error(e):
+                    raise
+                RATE_LIMITED.labels("slides", "").inc()
+                if attempt == _QUOTA_RETRIES:
+                    raise
+                delay = min(32, 2 ** attempt) + random.random()
+                logging.warning(f"Slides API quota hit ({e.resp.status}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    @staticmethod
+    def _slide_requests(index: int, slide: dict) -> list[dict]:
+        """Requests for one slide: title + notes in the left column, the infographic in the right."""
+        slide_id = f"slide_{index}"
+        title_id, body_id, image_box_id = f"{slide_id}_title", f"{slide_id}_body", f"{slide_id}_image"
+        requests = [{
+            'createSlide': {
+                'objectId': slide_id,
+                'insertionIndex': index,
+                'slideLayoutReference': {'predefinedLayout': 'TITLE_AND_TWO_COLUMNS'},
+                'placeholderIdMappings': [
+                    {'layoutPlaceholder': {'type': 'TITLE', 'index': 0}, 'objectId': title_id},
+                    {'layoutPlaceholder': {'type': 'BODY', 'index': 0}, 'objectId': body_id},
+                    {'layoutPlaceholder': {'type': 'BODY', 'index': 1}, 'objectId': image_box_id},
+                ]
+            }
+        }]
+
+        title = slide.get('title') or f"Slide {index + 1}"
+        requests.append({'insertText': {'objectId': title_id, 'insertionIndex': 0, 'text': title}})
+
+        body = slide.get('description') or slide.get('image_prompt') or ""
+        if body:
+            requests.append({'insertText': {'objectId': body_id, 'insertionIndex': 0, 'text': body}})
+
+        image_url = slide.get('image_url') or ""
+        if image_url.startswith("https://"):
+            # Slides can't place an image "into" a placeholder directly; replacing a shape keeps its box
+            marker = f"{{{{infographic_{index}}}}}"
+            requests.append({'insertText': {'objectId': image_box_id, 'insertionIndex': 0, 'text': marker}})
+            requests.append({
+                'replaceAllShapesWithImage': {
+                    'imageUrl': image_url,
+                    'imageReplaceMethod': 'CENTER_INSIDE',
+                    'pageObjectIds': [slide_id],
+                    'containsText': {'text': marker, 'matchCase': True}
+                }
+            })
+        else:
+            requests.append({'deleteObject': {'objectId': image_box_id}})
+        return requests
+
+    @staticmethod
+    def _chunk(per_slide: list[list[dict]]) -> list[list[dict]]:
+        """Packs per-slide request groups into batches bounded by request count and payload size."""
+        batches, current, current_bytes = [], [], 0
+        for group in per_slide:
+            group_bytes = len(json.dumps(group))
+            if current and (len(current) + len(group) > _MAX_REQUESTS_PER_BATCH or current_bytes + group_bytes > _MAX_BATCH_BYTES):
+                batches.append(current)
+                current, current_bytes = [], 0
+            current.extend(group)
+            current_bytes += group_bytes
+        if current:
+            batches.append(current)
+        return batches
+
+    @staticmethod
+    def _split_images(requests: list[dict]) -> tuple[list[dict], list[tuple[str, list[dict]]]]:
+        """Separates each slide's image placement (marker + replace) from the rest of a batch."""
+        rest, images = [], {}
+        for request in requests:
+            insert = request.get('insertText')
+            if insert and insert['objectId'].endswith('_image'):
+                images[insert['objectId']] = [request]
+            elif 'replaceAllShapesWithImage' in request:
+                box_id = request['replaceAllShapesWithImage']['pageObjectIds'][0] + '_image'
+                images[box_id].append(request)
+            else:
+                rest.append(request)
+        return rest, list(images.items())
+
+    def _batch_update(self, presentation_id: str, requests: list[dict]):
+        with observe("slides.batch_update", requests=len(requests)):
+            return self._execute(self.service.presentations().batchUpdate(
+                presentationId=presentation_id,
+                body={'requests': requests}
+            ))
+
+    def _apply_batch(self, presentation_id: str, requests: list[dict]):
+        """
+        Applies one batch. batchUpdate is all-or-nothing, so if Slides rejects it (typically an
+        image URL it can't fetch) the slides are re-applied without images, and each image is
+        then placed on its own; a failing image only costs that image.
+        """
+        try:
+            self._batch_update(presentation_id, requests)
+            return
+        except HttpError as e:
+            rest, images = self._split_images(requests)
+            if e.resp.status != 400 or not images:
+                raise
+            logging.warning(f"Slides batch rejected ({e.resp.status}); retrying with images placed one by one")
+
+        self._batch_update(presentation_id, rest)
+        for box_id, image_requests in images:
+            try:
+                self._batch_update(presentation_id, image_requests)
+            except HttpError as e:
+                if e.resp.status != 400:
+                    raise
+                logging.warning(f"Skipping image for {box_id}: {e}")
+                self._batch_update(presentation_id, [{'deleteObject': {'objectId': box_id}}])
 
     def create_presentation(self, slides_data: list, title: str = "Infographic Presentation"):
         try:
             # 1. Create a blank presentation
-            presentation = self.service.presentations().create(body={'title': title}).execute()
+            presentation = self._execute(self.service.presentations().create(body={'title': title}))
             presentation_id = presentation.get('presentationId')
             logging.info(f"Created presentation {presentation_id}")
 
-            # 2. Add slides
-            requests = []
-            for i, slide in enumerate(slides_data):
-                slide_id = f"slide_{i}"
-                requests.append({
-                    'createSlide': {
-                        'objectId': slide_id,
-                        'slideLayoutReference': {'predefinedLayout': 'TITLE_AND_BODY'}
-                    }
-                })
-                
-                # Title
-                requests.append({
-                    'insertText': {
-                        'objectId': slide_id,
-                        'insertionIndex': 0,
-                        'text': slide.get('title', 'Slide')
-                    }
-                })
-                
-                # Note: To insert text into specific placeholders, we need to know their IDs.
-                # For simplicity in MVP, we just create the slide.
-                # A more robust impl would query the layout placeholders.
-
-            if requests:
-                self.service.presentations().batchUpdate(
-                    presentationId=presentation_id, 
-                    body={'requests': requests}
-                ).execute()
+            # 2. Build all slides; the default blank first slide is dropped in the first batch
+            per_slide = [self._slide_requests(i, slide) for i, slide in enumerate(slides_data)]
+            default_slides = [{'deleteObject': {'objectId': s['objectId']}} for s in presentation.get('slides', [])]
+            if per_slide and default_slides:
+                per_slide[0] = per_slide[0] + default_slides
+
+            batches = self._chunk(per_slide)
+            for requests in batches:
+                self._apply_batch(presentation_id, requests)
+            logging.info(f"Filled presentation {presentation_id}: {len(slides_data)} slides in {len(batches)} batchUpdate call(s)")
 
             return presentation_id
 
         except Exception as e:
             logging.error(f"Failed to create slides: {e}")
-            raise e
\ No newline at end of file
+            raise e
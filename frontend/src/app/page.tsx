@@ -25,9 +25,26 @@ interface A2UIComponent { id: string; component: string; src?: string; text?: st
 interface StreamMessage {
   log?: string;
   updateComponents?: { components: A2UIComponent[] };
-  updateDataModel?: { value?: { script?: ProjectDetails['script'], project_id?: string } };
+  updateDataModel?: { path?: string; op?: "add" | "replace" | "remove"; value?: any };
 }
 
+// Applies a targeted A2UI data model op (e.g. /script/slides/3/image_url) to the script without a full snapshot.
+const applyScriptPatch = (script: ProjectDetails['script'], path: string, op: string, value: unknown): ProjectDetails['script'] => {
+    const keys = path.split("/").filter(Boolean).slice(1); // drop leading "script"
+    if (!keys.length) return value as ProjectDetails['script'];
+    const root: any = { ...script, slides: [...script.slides] };
+    let node: any = root;
+    for (const key of keys.slice(0, -1)) {
+        const child = node[key];
+        node[key] = Array.isArray(child) ? [...child] : { ...child };
+        node = node[key];
+    }
+    const last = keys[keys.length - 1];
+    if (op === "remove") delete node[last];
+    else node[last] = value;
+    return root;
+};
+
 const processStream = async (reader: ReadableStreamDefaultReader<Uint8Array>, onMessage: (msg: StreamMessage) => void) => {
     const decoder = new TextDecoder();
     let buffer = "";
@@ -194,8 +211,10 @@ export default function App() {
           
           const data = await res.json();
           if (data.url) window.open(data.url, '_blank');
-          if (data.pdf) window.open(`${BACKEND_URL}${data.pdf}`, '_blank');
-          if (data.zip) window.open(`${BACKEND_URL}${data.zip}`, '_blank');
+          // Artifacts are either signed bucket URLs (absolute) or legacy /static paths
+          const assetUrl = (u: string) => u.startsWith("http") ? u : `${BACKEND_URL}${u}`;
+          if (data.pdf) window.open(assetUrl(data.pdf), '_blank');
+          if (data.zip) window.open(assetUrl(data.zip), '_blank');
       } catch (e) {
           console.error("Export failed:", e);
           alert("Export failed. Please check permissions or try again.");
@@ -204,7 +223,7 @@ export default function App() {
       }
   };
 
-  const handleStream = useCallback(async (targetPhase: "script" | "graphics", currentScript?: ProjectDetails['script']) => {
+  const handleStream = useCallback(async (targetPhase: "script" | "graphics", currentScript?: ProjectDetails['script'], regenerate = false) => {
     if (abortControllerRef.current) abortControllerRef.current.abort();
     const abortController = new AbortController();
     abortControllerRef.current = abortController;
@@ -250,6 +269,8 @@ CONSTRAINTS:
         setPhase("graphics");
         body.script = currentScript;
         body.phase = "graphics";
+        // Fresh images for every slide; otherwise a finished deck is served from the image cache
+        if (regenerate) body.regenerate = true;
     }
 
     try {
@@ -274,10 +295,15 @@ CONSTRAINTS:
                 });
             }
             if (msg.updateDataModel) {
-                if (msg.updateDataModel.value?.script) setScript(msg.updateDataModel.value.script);
-                if (msg.updateDataModel.value?.project_id) {
-                    setCurrentProjectId(msg.updateDataModel.value.project_id);
-                    localStorage.setItem("lastProjectId", msg.updateDataModel.value.project_id);
+                const { path = "/", op = "replace", value } = msg.updateDataModel;
+                if (path.startsWith("/script/")) {
+                    setScript(prev => prev ? applyScriptPatch(prev, path, op, value) : prev);
+                    return;
+                }
+                if (value?.script) setScript(value.script);
+                if (value?.project_id) {
+                    setCurrentProjectId(value.project_id);
+                    localStorage.setItem("lastProjectId", value.project_id);
                 }
             }
         });
@@ -472,7 +498,12 @@ CONSTRAINTS:
                     {phase === 'review' ? (
                         <button onClick={() => handleStream('graphics', script!)} disabled={isStreaming} className="bg-emerald-500 text-white px-6 py-2.5 rounded-2xl text-sm font-bold shadow-lg">Generate Images</button>
                     ) : (
-                        <button onClick={() => handleStream('script')} disabled={isStreaming || !query.trim()} className="bg-blue-600 text-white px-6 py-2.5 rounded-2xl text-sm font-bold shadow-lg">Generate Plan</button>
+                        <div className="flex gap-2">
+                            {phase === 'graphics' && script && (
+                                <button onClick={() => handleStream('graphics', script, true)} disabled={isStreaming} className="bg-white/10 text-slate-200 px-6 py-2.5 rounded-2xl text-sm font-bold shadow-lg">Regenerate Images</button>
+                            )}
+                            <button onClick={() => handleStream('script')} disabled={isStreaming || !query.trim()} className="bg-blue-600 text-white px-6 py-2.5 rounded-2xl text-sm font-bold shadow-lg">Generate Plan</button>
+                        </div>
                     )}
                 </div>
             </div>